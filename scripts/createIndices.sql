@@ -8,6 +8,8 @@ CREATE INDEX Param_index
 ON Results (Param)
 CREATE INDEX SampleDate_index
 ON Results (SampleDate)
+CREATE INDEX SampleId_index
+ON Results (SampleId)
 
 CREATE INDEX StateCode_index
 ON Stations (StateCode)
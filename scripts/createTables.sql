@@ -11,6 +11,9 @@ IF OBJECT_ID('dbo.Stations', 'U') IS NOT NULL
 IF OBJECT_ID('dbo.Params', 'U') IS NOT NULL
 	DROP TABLE [dbo].[Params]
 
+IF OBJECT_ID('dbo.SyncState', 'U') IS NOT NULL
+	DROP TABLE [dbo].[SyncState]
+
 CREATE TABLE [dbo].[Results](
 	[Id] [int] IDENTITY(1,1) NOT NULL,
 	[AnalysisDate] [datetime2(7)] NULL,
@@ -105,3 +108,17 @@ CREATE TABLE [dbo].[Stations](
 CREATE TABLE [dbo].[Params](
 	[Param] [nvarchar](500) NULL
 ) ON [PRIMARY]
+
+CREATE TABLE [dbo].[SyncState](
+	[DataSource] [nvarchar](20) NOT NULL,
+	[WindowLo] [datetime] NULL,
+	[WindowHi] [datetime] NOT NULL,
+	[Results] [int] NULL,
+	[Stations] [int] NULL,
+	[Checksum] [nvarchar](32) NULL,
+	[UpdatedAt] [datetime] NOT NULL,
+ CONSTRAINT [PK_SyncState] PRIMARY KEY CLUSTERED
+(
+	[DataSource] ASC
+)WITH (PAD_INDEX = OFF, STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+) ON [PRIMARY]
@@ -71,9 +71,10 @@ setup(
     ],
     install_requires=[
         'docopt==0.6.2',
-        'pyodbc==3.0.10',
+        'pyodbc==4.0.30',
         'pyproj==1.9.4',
         'dateutils==0.6.6',
+        'numpy==1.16.6',
         'requests==2.7.0'
     ],
     dependency_links=[
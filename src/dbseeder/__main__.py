@@ -4,15 +4,44 @@
 '''UGS Chemistry database seeder
 Usage:
   dbseeder createdb <configuration>
-  dbseeder seed <source> <file_location> <configuration>
-  dbseeder update <source> <configuration>
-  dbseeder postprocess <configuration>
+  dbseeder seed <source> <file_location> <configuration> [--memory=<mb>] [--grouping=<mode>] [--batch-size=<rows>] [--batch-mb=<mb>]
+                [--insert-mode=<mode>] [--bulk-folder=<folder>] [--bulk-mb=<mb>] [--workers=<n>] [--writers=<n>]
+                [--transformers=<n>] [--columnar] [--balance=<where>] [--resume]
+  dbseeder update <source> <configuration> [--balance=<where>] [--fetch-days=<n>] [--fetch-threads=<n>]
+                  [--key-cache=<file>]
+  dbseeder postprocess <configuration> [--elevation-threads=<n>] [--elevation-rate=<n>]
+  dbseeder balance <configuration>
   dbseeder (-h | --help)
 Options:
   -h --help     Show this screen.
-  <configuration> dev, stage, prod
+  <configuration> dev, stage, prod or local for a sqlite database
   <source> WQP, SDWIS, DOGM, DWR, UGS
   <file_location> the parent location of the programs data
+  --memory=<mb>  the megabytes of results to group in memory before spilling to disk [default: 256]
+  --grouping=<mode>  stream to group results in one pass or staged to group them in sqlite [default: stream]
+  --batch-size=<rows>  the number of rows to insert before committing [default: 5000]
+  --batch-mb=<mb>  the megabytes of parameters to insert before committing [default: 32]
+  --insert-mode=<mode>  executemany to bind parameter arrays, values for multi row VALUES inserts
+                        or bulk to load spooled files with BULK INSERT [default: executemany]
+  --bulk-folder=<folder>  the folder for bulk load files readable by the database server [default: bulk]
+  --bulk-mb=<mb>  the megabytes in a bulk load file before a new one is started [default: 256]
+  --workers=<n>  the number of processes seeding results csv files at the same time [default: 1]
+  --writers=<n>  the number of workers that can insert rows at the same time. defaults to workers
+  --transformers=<n>  the number of threads transforming results between a csv reader and the inserts.
+                      0 reads, transforms and inserts each sample set in turn [default: 0]
+  --columnar  transform results a column at a time in batches of at least batch size rows
+  --balance=<where>  python to add charge balances as results are transformed, database to compute them
+                     in the database after the results are inserted or incremental to compute them in the
+                     database for only the samples given new rows. an incremental update also inserts
+                     analytes that arrive late for samples already in the database [default: python]
+  --resume  skip the files and sample sets a seed that did not finish committed
+  --fetch-days=<n>  the number of days of results in each web service request an update sends.
+                    0 sends one request [default: 30]
+  --fetch-threads=<n>  the number of web service requests an update sends at the same time [default: 4]
+  --key-cache=<file>  a local sqlite file keeping the station and sample ids in the database so an update
+                      only asks the database about ids it has not seen. use one file per configuration
+  --elevation-threads=<n>  the number of station elevations to look up at the same time [default: 8]
+  --elevation-rate=<n>  the most elevation requests to send each second. 0 does not limit them [default: 20]
 '''
 
 import sys
@@ -25,13 +54,34 @@ def main():
     seeder = Seeder()
 
     if arguments['seed']:
-        return seeder.seed(source=arguments['<source>'], file_location=arguments['<file_location>'], who=arguments['<configuration>'])
+        return seeder.seed(source=arguments['<source>'], file_location=arguments['<file_location>'], who=arguments['<configuration>'],
+                           memory_budget=int(arguments['--memory']) * 1024 * 1024,
+                           grouping=arguments['--grouping'],
+                           batch_size=int(arguments['--batch-size']),
+                           byte_budget=int(arguments['--batch-mb']) * 1024 * 1024,
+                           insert_mode=arguments['--insert-mode'],
+                           bulk_folder=arguments['--bulk-folder'],
+                           bulk_file_size=int(arguments['--bulk-mb']) * 1024 * 1024,
+                           workers=int(arguments['--workers']),
+                           writers=int(arguments['--writers'] or arguments['--workers']),
+                           transformers=int(arguments['--transformers']),
+                           columnar=arguments['--columnar'],
+                           balance=arguments['--balance'],
+                           resume=arguments['--resume'])
     elif arguments['update']:
-        return seeder.update(source=arguments['<source>'], who=arguments['<configuration>'])
+        return seeder.update(source=arguments['<source>'], who=arguments['<configuration>'],
+                             balance=arguments['--balance'],
+                             fetch_days=int(arguments['--fetch-days']),
+                             fetch_threads=int(arguments['--fetch-threads']),
+                             key_cache=arguments['--key-cache'])
     elif arguments['createdb']:
         return seeder.create_tables(who=arguments['<configuration>'])
     elif arguments['postprocess']:
-        return seeder.post_process(who=arguments['<configuration>'])
+        return seeder.post_process(who=arguments['<configuration>'],
+                                   threads=int(arguments['--elevation-threads']),
+                                   rate=float(arguments['--elevation-rate']))
+    elif arguments['balance']:
+        return seeder.balance(who=arguments['<configuration>'])
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+backends.py
+----------------------------------
+the databases that can be seeded
+'''
+
+import datetime
+import re
+import sqlite3
+from bulk import SqlServerBulkLoader, SqliteBulkLoader, read_table_columns, get_sqlite_table
+from os.path import join, dirname
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+script_dir = join(dirname(__file__), '..', '..', 'scripts')
+
+#: sqlite has no native time type so store it like sql server displays it
+sqlite3.register_adapter(datetime.time, str)
+
+#: the number of candidate ids inserted into the temp table with each executemany
+CANDIDATES_PER_INSERT = 10000
+
+
+def create(db):
+    '''Given a database configuration from secrets, returns the backend for it.
+    A configuration with `'backend': 'sqlite'` is a local sqlite database at `path`.
+    Everything else is a sql server `connection_string`.
+    '''
+    if isinstance(db, dict) and db.get('backend') == 'sqlite':
+        return SqliteBackend(db['path'], spatialite=db.get('spatialite', False))
+
+    return SqlServerBackend(db)
+
+
+def read_script(name):
+    with open(join(script_dir, name), 'r') as f:
+        return f.read()
+
+
+def find_new_ids(sql, connection, table, column, ids):
+    '''loads the ids into a temp table and anti-joins it with table.column on the server
+    sql - the backend sql with the candidates statements
+    ids - an iterable of ids. duplicates and None are ignored
+
+    returns the set of ids that are not in the table
+    '''
+    ids = list(set(ids) - set([None]))
+
+    if not ids:
+        return set()
+
+    cursor = connection.cursor()
+    #: a temp table is left behind if a statement fails
+    cursor.execute(sql['drop_candidates'])
+    cursor.execute(sql['create_candidates'])
+
+    if hasattr(cursor, 'fast_executemany'):
+        cursor.fast_executemany = True
+
+    try:
+        for i in xrange(0, len(ids), CANDIDATES_PER_INSERT):
+            cursor.executemany(sql['insert_candidate'], [(id,) for id in ids[i:i + CANDIDATES_PER_INSERT]])
+
+        return set(row[0] for row in cursor.execute(sql['new_ids'].format(table, column)).fetchall())
+    finally:
+        cursor.execute(sql['drop_candidates'])
+        connection.commit()
+
+
+#: the columns of the SyncState table
+sync_state_columns = ['DataSource', 'WindowLo', 'WindowHi', 'Results', 'Stations', 'Checksum', 'UpdatedAt']
+
+
+def get_sync_state(sql, connection, source):
+    '''returns the SyncState row of source as a dictionary or None if it has not been updated'''
+    cursor = connection.cursor()
+    row = cursor.execute(sql['get_sync_state'], (source,)).fetchone()
+
+    if row is None:
+        return None
+
+    return dict(zip(sync_state_columns, row))
+
+
+def save_sync_state(sql, connection, state):
+    '''replaces the SyncState row of state['DataSource']'''
+    cursor = connection.cursor()
+    cursor.execute(sql['delete_sync_state'], (state['DataSource'],))
+    cursor.execute(sql['insert_sync_state'], [state.get(column) for column in sync_state_columns])
+    connection.commit()
+
+
+class SqlServerBackend(object):
+    '''The production UGSWaterChemistry sql server database'''
+
+    name = 'sqlserver'
+
+    #: communication link failures and timeouts are worth retrying on a new connection
+    transient_errors = (pyodbc.OperationalError,) if pyodbc else ()
+
+    sql = {
+        'health_check': 'SELECT 1',
+        'shape_parameter': 'geometry::STGeomFromText(?, 26912)',
+        'max_sample_date': 'SELECT max(SampleDate) FROM [UGSWaterChemistry].[dbo].[Results]',
+        'drop_candidates': 'IF OBJECT_ID(\'tempdb..#Candidates\') IS NOT NULL DROP TABLE #Candidates',
+        'create_candidates': 'CREATE TABLE #Candidates (Id nvarchar(100) NOT NULL PRIMARY KEY)',
+        'insert_candidate': 'INSERT INTO #Candidates (Id) VALUES (?)',
+        'new_ids': ('SELECT Id FROM #Candidates AS t WHERE NOT EXISTS('
+                    + 'SELECT 1 FROM [UGSWaterChemistry].[dbo].[{0}] WHERE [{1}] = t.Id)'),
+        'missing_elevation': 'SELECT Lon_X, Lat_Y, Id FROM Stations WHERE Elev IS NULL OR Elev = 0 OR Elev > 20000',
+        'update_elevation': 'UPDATE Stations set Elev=?, ElevUnit=?, ElevMeth=? WHERE Id=?',
+        'get_sync_state': ('SELECT DataSource, WindowLo, WindowHi, Results, Stations, Checksum, UpdatedAt '
+                           + 'FROM [UGSWaterChemistry].[dbo].[SyncState] WHERE DataSource = ?'),
+        'delete_sync_state': 'DELETE FROM [UGSWaterChemistry].[dbo].[SyncState] WHERE DataSource = ?',
+        'insert_sync_state': ('INSERT INTO [UGSWaterChemistry].[dbo].[SyncState] (DataSource, WindowLo, WindowHi, Results, '
+                              + 'Stations, Checksum, UpdatedAt) VALUES (?, ?, ?, ?, ?, ?, ?)')
+    }
+
+    def __init__(self, db):
+        '''db - the secrets configuration containing the `connection_string`'''
+        super(SqlServerBackend, self).__init__()
+
+        self.db = db
+
+    def connect(self):
+        if pyodbc is None:
+            raise Exception('pyodbc is required to connect to sql server.')
+
+        return pyodbc.connect(self.db['connection_string'])
+
+    def is_transient(self, error):
+        '''returns True if the transient_errors error is worth retrying'''
+        return True
+
+    def create_tables(self, connection):
+        cursor = connection.cursor()
+        cursor.execute(read_script('createTables.sql'))
+        cursor.execute(read_script('createIndices.sql'))
+        connection.commit()
+
+    def update_params_table(self, connection):
+        connection.cursor().execute(read_script('populateParamsTable.sql'))
+        connection.commit()
+
+    def find_new_ids(self, connection, table, column, ids):
+        '''returns the set of ids that are not in table.column'''
+        return find_new_ids(self.sql, connection, table, column, ids)
+
+    def get_sync_state(self, connection, source):
+        '''returns the last successful update of source or None'''
+        return get_sync_state(self.sql, connection, source)
+
+    def save_sync_state(self, connection, state):
+        '''records a successful update. state - a dictionary with a value for each of sync_state_columns'''
+        save_sync_state(self.sql, connection, state)
+
+    def get_bulk_loader(self, connection):
+        return SqlServerBulkLoader(connection)
+
+
+class SqliteBackend(object):
+    '''A local sqlite database with the same tables for running and profiling the pipeline
+    without a sql server. Shapes are stored as WKT unless `spatialite` is True.
+    '''
+
+    name = 'sqlite'
+
+    #: only the operational errors for a locked or busy database are transient. see is_transient
+    transient_errors = (sqlite3.OperationalError,)
+
+    sql = {
+        'health_check': 'SELECT 1',
+        'shape_parameter': '?',
+        'max_sample_date': 'SELECT max(SampleDate) FROM Results',
+        'drop_candidates': 'DROP TABLE IF EXISTS temp.Candidates',
+        'create_candidates': 'CREATE TEMP TABLE Candidates (Id TEXT NOT NULL PRIMARY KEY)',
+        'insert_candidate': 'INSERT INTO temp.Candidates (Id) VALUES (?)',
+        'new_ids': 'SELECT Id FROM temp.Candidates AS t WHERE NOT EXISTS(SELECT 1 FROM {0} WHERE {1} = t.Id)',
+        'missing_elevation': 'SELECT Lon_X, Lat_Y, Id FROM Stations WHERE Elev IS NULL OR Elev = 0 OR Elev > 20000',
+        'update_elevation': 'UPDATE Stations set Elev=?, ElevUnit=?, ElevMeth=? WHERE Id=?',
+        'update_params': 'INSERT INTO Params SELECT DISTINCT Param FROM Results WHERE Param IS NOT NULL',
+        'get_sync_state': ('SELECT DataSource, WindowLo, WindowHi, Results, Stations, Checksum, UpdatedAt '
+                           + 'FROM SyncState WHERE DataSource = ?'),
+        'delete_sync_state': 'DELETE FROM SyncState WHERE DataSource = ?',
+        'insert_sync_state': ('INSERT INTO SyncState (DataSource, WindowLo, WindowHi, Results, Stations, Checksum, UpdatedAt) '
+                              + 'VALUES (?, ?, ?, ?, ?, ?, ?)')
+    }
+
+    index_re = re.compile(r'CREATE INDEX (\w+)\s+ON (\w+) \((\w+)\)')
+
+    def __init__(self, path, spatialite=False):
+        '''path - the sqlite database file
+        spatialite - store shapes as spatialite geometries. requires the mod_spatialite extension
+        '''
+        super(SqliteBackend, self).__init__()
+
+        self.path = path
+        self.spatialite = spatialite
+
+        if spatialite:
+            self.sql = dict(self.sql, shape_parameter='GeomFromText(?, 26912)')
+
+    def connect(self):
+        #: pooled connections are handed to whichever thread needs one
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.text_factory = str
+
+        if self.spatialite:
+            connection.enable_load_extension(True)
+            connection.execute("SELECT load_extension('mod_spatialite')")
+
+        return connection
+
+    def is_transient(self, error):
+        '''returns True if the transient_errors error is worth retrying. missing tables and syntax errors
+        are operational errors too
+        '''
+        message = str(error).lower()
+
+        return 'locked' in message or 'busy' in message
+
+    def create_tables(self, connection):
+        tables = read_table_columns()
+
+        for table, columns in tables.iteritems():
+            connection.execute('DROP TABLE IF EXISTS {}'.format(table))
+
+            if self.spatialite and table == 'Stations':
+                columns = [column for column in columns if column[0] != 'Shape']
+
+            connection.execute(get_sqlite_table(table, columns))
+
+        if self.spatialite:
+            connection.execute('SELECT InitSpatialMetadata(1)')
+            connection.execute("SELECT AddGeometryColumn('Stations', 'Shape', 26912, 'POINT', 'XY')")
+
+        for name, table, column in self.index_re.findall(read_script('createIndices.sql')):
+            connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(name, table, column))
+
+        connection.commit()
+
+    def update_params_table(self, connection):
+        connection.execute('DELETE FROM Params')
+        connection.execute(self.sql['update_params'])
+        connection.commit()
+
+    def find_new_ids(self, connection, table, column, ids):
+        '''returns the set of ids that are not in table.column'''
+        return find_new_ids(self.sql, connection, table, column, ids)
+
+    def get_sync_state(self, connection, source):
+        '''returns the last successful update of source or None'''
+        return get_sync_state(self.sql, connection, source)
+
+    def save_sync_state(self, connection, state):
+        '''records a successful update. state - a dictionary with a value for each of sync_state_columns'''
+        save_sync_state(self.sql, connection, state)
+
+    def get_bulk_loader(self, connection):
+        return SqliteBulkLoader(connection)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+bulk.py
+----------------------------------
+spool rows to bulk load files and load them
+'''
+
+import datetime
+import os
+import re
+import threading
+from collections import OrderedDict
+from os.path import join, dirname
+from writers import get_columns, get_table
+
+CREATE_TABLES = join(dirname(__file__), '..', '..', 'scripts', 'createTables.sql')
+
+#: the default size of a bulk load file before a new one is started
+DEFAULT_FILE_SIZE = 256 * 1024 * 1024
+
+FIELD_TERMINATOR = '\t'
+ROW_TERMINATOR = '\n'
+
+sqlite_types = {
+    'int': 'INTEGER',
+    'bigint': 'INTEGER',
+    'float': 'REAL',
+    'decimal': 'REAL'
+}
+
+table_re = re.compile(r'CREATE TABLE \[dbo\]\.\[(\w+)\]\((.*?)\n(?: CONSTRAINT|\))', re.S)
+column_re = re.compile(r'^\s*\[(\w+)\] \[(\w+)', re.M)
+
+
+def read_table_columns(path=CREATE_TABLES):
+    '''Given the create tables script, returns {table: [(column, type)]} in the order of the script'''
+    with open(path, 'r') as f:
+        sql = f.read()
+
+    tables = OrderedDict()
+    for table, body in table_re.findall(sql):
+        tables[table] = column_re.findall(body)
+
+    return tables
+
+
+def get_sqlite_table(table, columns):
+    '''returns a sqlite create table statement for the columns read from the create tables script'''
+    definitions = []
+    for column, column_type in columns:
+        if column == 'Id':
+            definitions.append('Id INTEGER PRIMARY KEY AUTOINCREMENT')
+            continue
+
+        definitions.append('{} {}'.format(column, sqlite_types.get(column_type, 'TEXT')))
+
+    return 'CREATE TABLE IF NOT EXISTS {} ({})'.format(table, ', '.join(definitions))
+
+
+def format_value(value):
+    '''formats a typed value as a field in a character bulk load file. None is an empty field'''
+    if value is None:
+        return ''
+    elif isinstance(value, unicode):
+        value = value.encode('utf8')
+    elif isinstance(value, datetime.datetime):
+        #: strftime does not support years before 1900
+        return value.isoformat(' ')
+    elif isinstance(value, float):
+        return repr(value)
+    elif not isinstance(value, str):
+        return str(value)
+
+    #: character files have no escaping so terminators become spaces
+    return value.replace('\t', ' ').replace('\r', ' ').replace('\n', ' ')
+
+
+def parse_value(field):
+    '''the inverse of format_value for loaders that read the files themselves'''
+    if field == '':
+        return None
+
+    return field.decode('utf8')
+
+
+class BulkFileSpooler(object):
+    '''Streams rows to tab delimited utf8 files in the column order of the create tables script.
+    A new file is started when the current one reaches `max_bytes`. Finished files are handed
+    to the `loader` so each file is loaded with one bulk statement.
+    '''
+
+    def __init__(self, folder, insert_template, loader=None, max_bytes=DEFAULT_FILE_SIZE, tables=None,
+                 lock=None, auto_flush=True):
+        '''folder - the folder to write the files. it must be readable by the database server
+        insert_template - the insert statement template whose column order the rows are in
+        loader - an object with `load(table, path, format_file)`
+        max_bytes - the size of a file before a new one is started
+        tables - the output of read_table_columns. mainly for testing
+        lock - held while files are loaded. e.g. a semaphore limiting the processes loading at once
+        auto_flush - load the file when it is full. if False files are only loaded by `flush`
+                     so the caller decides which rows are loaded together. see `full`
+        '''
+        super(BulkFileSpooler, self).__init__()
+
+        self.folder = folder
+        self.table = get_table(insert_template)
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.auto_flush = auto_flush
+        self.rows_written = 0
+        self.files = []
+        self.loaded = []
+        self.lock = lock or threading.Lock()
+
+        self.columns = get_columns(insert_template)
+
+        row_columns = [column.lower() for column in self.columns]
+        table_columns = [column for column, column_type in (tables or read_table_columns())[self.table]
+                         if column != 'Id']
+
+        #: the position of each file column in the incoming rows
+        self.indices = [row_columns.index(column.lower()) if column.lower() in row_columns else None
+                        for column in table_columns]
+
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        self.format_file = self._write_format_file(table_columns)
+        self.file = None
+        self.file_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        elif self.file:
+            self.file.close()
+            self.file = None
+
+    def write(self, rows):
+        '''rows: an iterable of sequences in the same order as the columns of the insert template'''
+        for row in rows:
+            if self.file is None:
+                self._open()
+
+            line = FIELD_TERMINATOR.join([format_value(row[i]) if i is not None else '' for i in self.indices])
+            line += ROW_TERMINATOR
+
+            self.file.write(line)
+            self.file_bytes += len(line)
+            self.rows_written += 1
+
+            if self.auto_flush and self.full:
+                self._rotate()
+
+    @property
+    def full(self):
+        '''True when the current file has reached `max_bytes`'''
+        return self.file is not None and self.file_bytes >= self.max_bytes
+
+    def write_batch(self, batch):
+        '''writes the rows of a Batch with a column for each column of the insert template'''
+        self.write(batch.rows(self.columns))
+
+    def flush(self):
+        '''closes the current file and loads any files that have not been loaded'''
+        if self.file is not None:
+            self._rotate()
+
+    def _open(self):
+        path = join(self.folder, '{}_{:04d}.tsv'.format(self.table, len(self.files)))
+
+        self.file = open(path, 'wb')
+        self.file_bytes = 0
+        self.files.append(path)
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+
+        if self.loader is None:
+            return
+
+        for path in self.files:
+            if path in self.loaded:
+                continue
+
+            with self.lock:
+                self.loader.load(self.table, path, self.format_file)
+            self.loaded.append(path)
+
+    def _write_format_file(self, columns):
+        '''writes a non xml bcp format file mapping each field to its table column skipping the Id'''
+        path = join(self.folder, '{}.fmt'.format(self.table))
+
+        with open(path, 'wb') as f:
+            f.write('10.0\r\n{}\r\n'.format(len(columns)))
+            for i, column in enumerate(columns):
+                terminator = '\\t' if i < len(columns) - 1 else '\\n'
+                f.write('{0}\tSQLCHAR\t0\t0\t"{1}"\t{2}\t{3}\t""\r\n'.format(i + 1, terminator, i + 2, column))
+
+        return path
+
+
+class SqlServerBulkLoader(object):
+    '''loads bulk files with one BULK INSERT per file'''
+
+    sql = {
+        'bulk_insert': ("BULK INSERT [UGSWaterChemistry].[dbo].[{}] FROM '{}' "
+                        "WITH (FORMATFILE = '{}', CODEPAGE = '65001', KEEPNULLS, TABLOCK)"),
+        'max_id': 'SELECT ISNULL(MAX(Id), 0) FROM [UGSWaterChemistry].[dbo].[{}]',
+        #: character data is parsed into geometry with srid 0. only the rows past the Id before the load are touched
+        'Stations': ('UPDATE [UGSWaterChemistry].[dbo].[Stations] SET Shape = geometry::STGeomFromText(Shape.STAsText(), 26912) '
+                     'WHERE Id > ? AND Shape IS NOT NULL AND Shape.STSrid <> 26912')
+    }
+
+    def __init__(self, connection):
+        super(SqlServerBulkLoader, self).__init__()
+
+        self.connection = connection
+
+    def load(self, table, path, format_file):
+        cursor = self.connection.cursor()
+
+        if table in self.sql:
+            before = cursor.execute(self.sql['max_id'].format(table)).fetchone()[0]
+
+        cursor.execute(self.sql['bulk_insert'].format(table, self._quote(path), self._quote(format_file)))
+
+        if table in self.sql:
+            cursor.execute(self.sql[table], (before,))
+
+        self.connection.commit()
+
+    def _quote(self, path):
+        return os.path.abspath(path).replace("'", "''")
+
+
+class SqliteBulkLoader(object):
+    '''loads bulk files into sqlite to verify the file format without a sql server'''
+
+    def __init__(self, connection, tables=None):
+        super(SqliteBulkLoader, self).__init__()
+
+        self.connection = connection
+        self.tables = tables or read_table_columns()
+
+    def load(self, table, path, format_file):
+        columns = [column for column, column_type in self.tables[table] if column != 'Id']
+
+        self.connection.execute(get_sqlite_table(table, self.tables[table]))
+
+        statement = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns), ','.join('?' * len(columns)))
+
+        with open(path, 'rb') as f:
+            rows = (map(parse_value, line.rstrip(ROW_TERMINATOR).split(FIELD_TERMINATOR)) for line in f)
+            self.connection.executemany(statement, rows)
+
+        self.connection.commit()
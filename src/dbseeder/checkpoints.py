@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+checkpoints.py
+----------------------------------
+record the work a seed run has committed so an interrupted run can be resumed
+'''
+
+import os
+import sqlite3
+
+#: the file the seed manifest is kept in
+MANIFEST = 'seed-manifest.sqlite3'
+
+#: the seconds a worker waits for another worker to finish writing to the manifest
+LOCK_TIMEOUT = 60
+
+
+class CheckpointError(Exception):
+    pass
+
+
+class Manifest(object):
+    '''The csv files a seed run has finished and the sample ids it has committed from the
+    file it was working on.
+
+    Sample ids are recorded as pending before the rows holding them are committed and
+    marked committed afterwards, along with the largest Results Id before the rows were
+    sent. A resumed run skips the committed samples and deletes the rows of pending samples
+    written after that Id since it can not know whether their commit finished.
+    The files are identified by path, size and modification time so a file that changes
+    between runs is not mistaken for the one that was partly seeded.
+    '''
+
+    sql = {
+        'create_files': ('CREATE TABLE IF NOT EXISTS Files (Path TEXT PRIMARY KEY, Size INTEGER NOT NULL, '
+                         'MTime REAL NOT NULL, Done INTEGER NOT NULL DEFAULT 0, PendingAfter INTEGER)'),
+        'create_samples': ('CREATE TABLE IF NOT EXISTS Samples (Path TEXT NOT NULL, SampleId TEXT NOT NULL, '
+                           'Committed INTEGER NOT NULL, PRIMARY KEY (Path, SampleId)) WITHOUT ROWID'),
+        'get_file': 'SELECT Size, MTime, Done FROM Files WHERE Path = ?',
+        'start_file': 'INSERT INTO Files (Path, Size, MTime) VALUES (?, ?, ?)',
+        'finish_file': 'UPDATE Files SET Done = 1 WHERE Path = ?',
+        'set_pending_after': 'UPDATE Files SET PendingAfter = ? WHERE Path = ?',
+        'get_pending_after': 'SELECT PendingAfter FROM Files WHERE Path = ?',
+        'add_pending': 'INSERT OR IGNORE INTO Samples (Path, SampleId, Committed) VALUES (?, ?, 0)',
+        'commit_pending': 'UPDATE Samples SET Committed = 1 WHERE Path = ? AND Committed = 0',
+        'get_samples': 'SELECT SampleId FROM Samples WHERE Path = ? AND Committed = ?',
+        'clear_pending': 'DELETE FROM Samples WHERE Path = ? AND Committed = 0',
+        'finished_samples': 'DELETE FROM Samples WHERE Path = ?'
+    }
+
+    def __init__(self, path=MANIFEST):
+        '''path - the sqlite file to keep the manifest in. it is created if it does not exist'''
+        super(Manifest, self).__init__()
+
+        self.path = path
+
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        self.connection.text_factory = str
+        self.connection.execute(self.sql['create_files'])
+        self.connection.execute(self.sql['create_samples'])
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def reset(self):
+        '''forgets every file'''
+        self.connection.execute('DELETE FROM Files')
+        self.connection.execute('DELETE FROM Samples')
+        self.connection.commit()
+
+    def remove(self):
+        '''closes and deletes the manifest once a run has finished'''
+        self.close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_done(self, csv_file):
+        '''returns True if every row of the file has been committed'''
+        row = self._get_file(csv_file)
+
+        return bool(row and row[2])
+
+    def start(self, csv_file):
+        '''records the file as being seeded. raises a CheckpointError if it changed since it was started'''
+        size, mtime = self._stat(csv_file)
+        row = self._get_file(csv_file)
+
+        if row is None:
+            self.connection.execute(self.sql['start_file'], (csv_file, size, mtime))
+            self.connection.commit()
+        elif (row[0], row[1]) != (size, mtime):
+            raise CheckpointError('{} changed since it was partly seeded. Seed without resuming.'.format(csv_file))
+
+    def finish(self, csv_file):
+        '''records that every row of the file has been committed'''
+        self.connection.execute(self.sql['finish_file'], (csv_file,))
+        self.connection.execute(self.sql['finished_samples'], (csv_file,))
+        self.connection.commit()
+
+    def add_pending(self, csv_file, sample_ids, after_id=0):
+        '''records the samples about to be committed
+        after_id - the largest Results Id before the rows of the samples are sent
+        '''
+        self.connection.execute(self.sql['set_pending_after'], (after_id, csv_file))
+        self.connection.executemany(self.sql['add_pending'],
+                                    [(csv_file, sample_id) for sample_id in sample_ids if sample_id is not None])
+        self.connection.commit()
+
+    def commit_pending(self, csv_file):
+        '''records that the pending samples were committed'''
+        self.connection.execute(self.sql['commit_pending'], (csv_file,))
+        self.connection.commit()
+
+    def clear_pending(self, csv_file):
+        self.connection.execute(self.sql['clear_pending'], (csv_file,))
+        self.connection.commit()
+
+    def get_committed(self, csv_file):
+        '''returns the set of sample ids of the file that have been committed'''
+        return self._get_samples(csv_file, 1)
+
+    def get_pending(self, csv_file):
+        '''returns the set of sample ids of the file that may or may not have been committed'''
+        return self._get_samples(csv_file, 0)
+
+    def get_pending_after(self, csv_file):
+        '''returns the largest Results Id before the pending samples were sent'''
+        row = self.connection.execute(self.sql['get_pending_after'], (csv_file,)).fetchone()
+
+        return (row[0] or 0) if row else 0
+
+    def _get_samples(self, csv_file, committed):
+        return set(row[0] for row in self.connection.execute(self.sql['get_samples'], (csv_file, committed)))
+
+    def _get_file(self, csv_file):
+        return self.connection.execute(self.sql['get_file'], (csv_file,)).fetchone()
+
+    def _stat(self, csv_file):
+        stat = os.stat(csv_file)
+
+        return stat.st_size, stat.st_mtime
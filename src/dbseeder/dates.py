@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+dates.py
+----------------------------------
+fast parsing of the date and time strings in the source files
+'''
+
+import datetime
+import threading
+from collections import OrderedDict
+from dateutil.parser import parse
+
+#: the number of distinct strings to remember the parsed value of
+DEFAULT_CACHE_SIZE = 8192
+
+
+class LruCache(object):
+    '''A dictionary that forgets the least recently used key when it is full. Safe to share between threads.'''
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        super(LruCache, self).__init__()
+
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, create):
+        '''returns the value for key calling create(key) to make it if it is not in the cache'''
+        with self.lock:
+            if key in self.items:
+                self.hits += 1
+                #: move it to the most recently used end
+                value = self.items[key] = self.items.pop(key)
+
+                return value
+
+        value = create(key)
+
+        with self.lock:
+            self.misses += 1
+            self.items[key] = value
+
+            if len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+        return value
+
+
+class DateParser(object):
+    '''Parses the dates and times of a run.
+
+    `YYYY-MM-DD` dates and `HH:MM:SS` times are read by position and anything else is
+    handed to dateutil. Parsed strings are remembered since the same few thousand dates
+    repeat across every row of a file. Dates after `now` are None and `now` is read once
+    when the parser is created.
+    '''
+
+    def __init__(self, now=None, cache_size=DEFAULT_CACHE_SIZE):
+        '''now - the cutoff for dates in the future. defaults to when the parser is created
+        cache_size - the number of distinct date and time strings to remember
+        '''
+        super(DateParser, self).__init__()
+
+        self.now = now or datetime.datetime.now()
+        self.dates = LruCache(cache_size)
+        self.times = LruCache(cache_size)
+
+    def parse_date(self, value):
+        '''returns a datetime or None if the value is empty, not a date or in the future'''
+        if isinstance(value, datetime.datetime):
+            return self._before_now(value)
+
+        if not isinstance(value, basestring):
+            return self._parse_with_dateutil(value)
+
+        value = value.strip()
+
+        if value == '':
+            return None
+
+        return self.dates.get(value, self._parse_date)
+
+    def parse_time(self, value):
+        '''returns a time or None if the value is empty or not a time'''
+        if isinstance(value, datetime.time):
+            return value
+
+        if not isinstance(value, basestring):
+            return self._parse_time(value)
+
+        value = value.strip()
+
+        if value == '':
+            return None
+
+        return self.times.get(value, self._parse_time)
+
+    def _parse_date(self, value):
+        if is_iso_date(value):
+            try:
+                return self._before_now(datetime.datetime(int(value[:4]), int(value[5:7]), int(value[8:])))
+            except ValueError:
+                #: e.g. february 30th. let dateutil decide
+                pass
+
+        return self._parse_with_dateutil(value)
+
+    def _parse_with_dateutil(self, value):
+        try:
+            return self._before_now(parse(value))
+        except Exception:
+            return None
+
+    def _parse_time(self, value):
+        try:
+            if is_iso_time(value):
+                return datetime.time(int(value[:2]), int(value[3:5]), int(value[6:]))
+
+            return datetime.time(*map(int, value.split(':')))
+        except (AttributeError, TypeError, ValueError, OverflowError):
+            return None
+
+    def _before_now(self, value):
+        try:
+            if value > self.now:
+                return None
+        except TypeError:
+            #: aware dates can not be compared to now
+            return None
+
+        return value
+
+
+def is_iso_date(value):
+    '''YYYY-MM-DD'''
+    return (len(value) == 10 and value[4] == '-' and value[7] == '-' and
+            value[:4].isdigit() and value[5:7].isdigit() and value[8:].isdigit())
+
+
+def is_iso_time(value):
+    '''HH:MM:SS'''
+    return (len(value) == 8 and value[2] == ':' and value[5] == ':' and
+            value[:2].isdigit() and value[3:5].isdigit() and value[6:].isdigit())
@@ -7,9 +7,11 @@ dbseeder
 the dbseeder module
 '''
 
-import pyodbc
+import backends
 import factory
-import requests
+import sessions
+from elevations import ElevationFetcher, EPQS_URL, UPDATES_PER_COMMIT
+from services import ChargeBalancer
 from os.path import join, dirname
 try:
     import secrets
@@ -29,58 +31,101 @@ class Seeder(object):
             db = secrets.stage
         elif who == 'prod':
             db = secrets.prod
+        elif who == 'local':
+            db = secrets.local
         return db
 
-    def create_tables(self, who):
-        db = self._get_db(who)
+    def _get_pool(self, who):
+        '''returns a connection pool for the configuration to share between every step'''
+        return sessions.ConnectionPool(backends.create(self._get_db(who)))
 
+    def create_tables(self, who):
         print('connecting to {} database'.format(who))
 
-        script_dir = dirname(__file__)
-
-        with open(join(script_dir, join('..', '..', 'scripts', 'createTables.sql')), 'r') as f:
-            create_tables_sql = f.read()
-        with open(join(script_dir, join('..', '..', 'scripts', 'createIndices.sql')), 'r') as f:
-            create_indices_sql = f.read()
-
-        try:
-            c = pyodbc.connect(db['connection_string'])
-            cursor = c.cursor()
-            cursor.execute(create_tables_sql)
-            cursor.execute(create_indices_sql)
-            cursor.commit()
-        except Exception, e:
-            raise e
-        finally:
-            if cursor:
-                del cursor
-            if c:
-                del c
+        with self._get_pool(who) as pool:
+            pool.backend.create_tables(pool.session().connection)
 
         print('done')
 
         return True
 
-    def seed(self, source, file_location, who):
+    def seed(self, source, file_location, who, **options):
+        '''seed the sources from the csv files in file_location
+        options - keyword arguments passed through to each program
+        '''
         db = self._get_db(who)
 
         programs = self._parse_source_args(source)
 
-        for program in programs:
-            seederClass = factory.create(program)
+        with self._get_pool(who) as pool:
+            for program in programs:
+                seederClass = factory.create(program)
 
-            seeder = seederClass(db, file_location=file_location)
-            seeder.seed()
+                seeder = seederClass(db, file_location=file_location, pool=pool, **options)
+                seeder.seed()
 
-    def post_process(self, who):
+    def post_process(self, who, **options):
         '''
         Recalculate StateCode and CountyCode for the entire dataset (not sure that we can trust what's there)
         Populate Elev, ElevUnit, & ElevMeth only for records that have missing or bad data
+        options - keyword arguments passed through to the ElevationFetcher
         '''
         stations_fc = 'UGSWaterChemistry.dbo.Stations'
         stations_identity = 'Stations_identity'
-        epqs_service_url = r'http://nationalmap.gov/epqs/pqs.php'
 
+        with self._get_pool(who) as pool:
+            if pool.backend.name == 'sqlserver':
+                self._calculate_fips(who, stations_fc, stations_identity)
+
+            self._update_elevations(pool, EPQS_URL, **options)
+            self._update_params_table(pool)
+
+    def balance(self, who):
+        '''recalculate the charge balance rows of every sample from the results in the database'''
+        with self._get_pool(who) as pool:
+            self._update_charge_balances(pool)
+
+    def _update_elevations(self, pool, epqs_service_url, updates_per_commit=UPDATES_PER_COMMIT, **options):
+        '''Populate Elev, ElevUnit, & ElevMeth from the elevation point query service
+        updates_per_commit - the number of elevations to update before committing
+        options - keyword arguments passed through to the ElevationFetcher e.g. threads and rate
+        '''
+        backend = pool.backend
+        connection = pool.session().connection
+        cursor = connection.cursor()
+
+        print('looking up points with null elevation values')
+        cursor.execute(backend.sql['missing_elevation'])
+        rows = cursor.fetchall()
+        total = len(rows)
+
+        unit = 'meters'
+        method = 'Other'
+        answered = 0
+        updates = []
+
+        def commit():
+            cursor.executemany(backend.sql['update_elevation'], updates)
+            connection.commit()
+
+            del updates[:]
+
+        with ElevationFetcher(epqs_service_url, **options) as fetcher:
+            for id, elev in fetcher.fetch(rows):
+                answered += 1
+
+                if elev is not None:
+                    updates.append((elev, unit, method, id))
+
+                if len(updates) >= updates_per_commit:
+                    commit()
+                    print('{} out of {} completed ({}%)'.format(answered, total, (answered/float(total)*100.00)))
+
+        if updates:
+            commit()
+
+    def _calculate_fips(self, who, stations_fc, stations_identity):
+        '''Recalculate StateCode and CountyCode with arcpy through the sde connection file'''
         arcpy.env.workspace = dirname(__file__)
         db = r'connection_files\{}.sde'.format(who)
 
@@ -104,54 +149,22 @@ class Seeder(object):
         print('removing join')
         arcpy.RemoveJoin_management(stationsLyr, stations_identity)
 
-        #: Elevation
-        print('looping through points with null elevation values')
-        connection = pyodbc.connect(self._get_db(who)['connection_string'])
-        cursor = connection.cursor()
-        cursor.execute('''
-            SELECT Lon_X, Lat_Y, Id
-            FROM Stations
-            WHERE Elev IS NULL OR Elev = 0 OR Elev > 20000
-        ''')
-        i = 0
-        batch_size = 100
-        rows = cursor.fetchall()
-        total = len(rows)
-        for row in rows:
-            payload = {'x': row.Lon_X, 'y': row.Lat_Y, 'units': 'Meters', 'output': 'json'}
-            r = requests.get(epqs_service_url, params=payload)
-            try:
-                elev = r.json()['USGS_Elevation_Point_Query_Service']['Elevation_Query']['Elevation']
-            except:
-                print('error retrieving elevation for Lon: {} & Lat: {}. Skipping'.format(row.Lon_X, row.Lat_Y))
-                continue
-
-            unit = 'meters'
-            method = 'Other'
-            cursor.execute('''
-                UPDATE Stations set Elev=?, ElevUnit=?, ElevMeth=?
-                WHERE Id=?
-            ''', elev, unit, method, row.Id)
-
-            i += 1
-            if i % batch_size == 0:
-                connection.commit()
-                print('{} out of {} completed ({}%)'.format(i, total, (i/float(total)*100.00)))
-
-        self._update_params_table(who)
-
-    def update(self, source, who):
+    def update(self, source, who, **options):
+        '''add the rows published since the last update
+        options - keyword arguments passed through to each program
+        '''
         db = self._get_db(who)
 
         programs = self._parse_source_args(source)
 
-        for program in programs:
-            seederClass = factory.create(program)
+        with self._get_pool(who) as pool:
+            for program in programs:
+                seederClass = factory.create(program)
 
-            seeder = seederClass(db)
-            seeder.update()
+                seeder = seederClass(db, pool=pool, **options)
+                seeder.update()
 
-        self._update_params_table(who)
+            self._update_params_table(pool)
 
     def _parse_source_args(self, source):
         all_sources = ['WQP', 'SDWIS', 'DOGM', 'DWR', 'UGS']
@@ -165,19 +178,10 @@ class Seeder(object):
             else:
                 return None
 
-    def _update_params_table(self, who):
-        script_dir = dirname(__file__)
-        with open(join(script_dir, join('..', '..', 'scripts', 'populateParamsTable.sql')), 'r') as f:
-            sql = f.read()
-
-        try:
-            c = pyodbc.connect(self._get_db(who)['connection_string'])
-            cursor = c.cursor()
-            cursor.execute(sql)
-        except Exception, e:
-            raise e
-        finally:
-            if cursor:
-                del cursor
-            if c:
-                del c
+    def _update_charge_balances(self, pool):
+        with pool.session() as session:
+            ChargeBalancer.update_in_database(session.connection)
+
+    def _update_params_table(self, pool):
+        with pool.session() as session:
+            pool.backend.update_params_table(session.connection)
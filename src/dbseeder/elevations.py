@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+elevations.py
+----------------------------------
+look up the elevations of points from the elevation point query service at the same time
+'''
+
+import requests
+import sys
+import threading
+import time
+from Queue import Queue, Empty
+from requests.adapters import HTTPAdapter
+
+#: the elevation point query service
+EPQS_URL = r'http://nationalmap.gov/epqs/pqs.php'
+
+#: the number of points to look up at the same time
+DEFAULT_THREADS = 8
+
+#: the most requests to send each second. 0 does not limit the requests
+DEFAULT_RATE = 20
+
+#: the number of times to retry a request after a connection error or a busy response
+DEFAULT_RETRIES = 3
+
+#: the seconds to wait before the first retry. doubled for every retry after that
+DEFAULT_RETRY_DELAY = 1
+
+#: the seconds to wait for the service to answer a request
+DEFAULT_TIMEOUT = 30
+
+#: the number of elevations to update before committing
+UPDATES_PER_COMMIT = 500
+
+#: the responses that are worth asking again for
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+#: tells the reader a lookup thread has finished
+STOP = object()
+
+
+class RateLimiter(object):
+    '''Spaces out calls to `wait` so no more than `rate` return each second across every thread.'''
+
+    def __init__(self, rate=DEFAULT_RATE, clock=time.time, sleep=time.sleep):
+        '''rate - the calls allowed each second. 0 or None does not wait
+        clock, sleep - mainly for testing
+        '''
+        super(RateLimiter, self).__init__()
+
+        self.interval = 1.0 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.next = 0
+
+    def wait(self):
+        '''waits for this caller's turn'''
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = self.clock()
+            turn = max(now, self.next)
+            self.next = turn + self.interval
+
+        if turn > now:
+            self.sleep(turn - now)
+
+
+class ElevationFetcher(object):
+    '''Looks up the elevations of points with a pool of threads sharing keep-alive connections.
+
+    Requests are spaced out by a `RateLimiter`. Connection errors and busy responses are
+    retried with a doubling delay. A point that still fails, or whose response has no
+    elevation, is returned with an elevation of None.
+    '''
+
+    def __init__(self, url=EPQS_URL, threads=DEFAULT_THREADS, rate=DEFAULT_RATE, retries=DEFAULT_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY, timeout=DEFAULT_TIMEOUT):
+        '''url - the elevation point query service
+        threads - the number of points to look up at the same time
+        rate - the most requests to send each second. 0 does not limit the requests
+        retries - the number of times to retry a request after a connection error or a busy response
+        retry_delay - the seconds to wait before the first retry
+        timeout - the seconds to wait for the service to answer a request
+        '''
+        super(ElevationFetcher, self).__init__()
+
+        self.url = url
+        self.threads = max(1, threads)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+        #: one connection per thread is kept open between requests
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.threads)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def fetch(self, points):
+        '''looks up an iterable of (x, y, id) points in WGS84 and yields (id, elevation in meters) as they are
+        answered
+        '''
+        points = list(points)
+        work = Queue()
+        answers = Queue()
+        cancelled = threading.Event()
+        errors = []
+
+        for point in points:
+            work.put(point)
+
+        def look_up():
+            try:
+                while not cancelled.is_set():
+                    try:
+                        x, y, id = work.get_nowait()
+                    except Empty:
+                        break
+
+                    answers.put((id, self.get_elevation(x, y)))
+            except BaseException:
+                errors.append(sys.exc_info())
+                cancelled.set()
+            finally:
+                answers.put(STOP)
+
+        threads = min(self.threads, len(points)) or 1
+
+        for i in xrange(threads):
+            thread = threading.Thread(target=look_up, name='elevation-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+
+        stopped = 0
+
+        try:
+            while stopped < threads:
+                answer = answers.get()
+
+                if answer is STOP:
+                    stopped += 1
+                    continue
+
+                yield answer
+        finally:
+            cancelled.set()
+
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+    def get_elevation(self, x, y):
+        '''returns the elevation in meters at x, y or None if the service does not have one'''
+        payload = {'x': x, 'y': y, 'units': 'Meters', 'output': 'json'}
+        delay = self.retry_delay
+
+        for attempt in xrange(self.retries + 1):
+            self.limiter.wait()
+
+            try:
+                response = self.session.get(self.url, params=payload, timeout=self.timeout)
+
+                if response.status_code not in RETRY_STATUSES:
+                    break
+
+                problem = 'status {}'.format(response.status_code)
+            except requests.exceptions.RequestException as e:
+                response = None
+                problem = e
+
+            if attempt == self.retries:
+                print('error retrieving elevation for Lon: {} & Lat: {}. {}. Skipping'.format(x, y, problem))
+
+                return None
+
+            time.sleep(delay)
+            delay *= 2
+
+        try:
+            response.raise_for_status()
+
+            return response.json()['USGS_Elevation_Point_Query_Service']['Elevation_Query']['Elevation']
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+            print('error retrieving elevation for Lon: {} & Lat: {}. Skipping'.format(x, y))
+
+            return None
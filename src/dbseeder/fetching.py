@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+fetching.py
+----------------------------------
+download the partitions of a web service query at the same time
+'''
+
+import sys
+import threading
+import zlib
+from datetime import timedelta
+from Queue import Queue, Empty, Full
+
+#: the number of partitions to download at the same time
+DEFAULT_THREADS = 4
+
+#: the number of days of results in a partition
+DEFAULT_PARTITION_DAYS = 30
+
+#: the number of chunks of rows a fetch holds before the downloads wait. 0 holds every row
+DEFAULT_QUEUE_SIZE = 64
+
+#: the number of rows handed from a download to the reader at a time
+ROWS_PER_CHUNK = 1000
+
+#: tells the reader a download has finished
+STOP = object()
+
+#: the checksum of a fetch fits in 64 bits
+CHECKSUM_MODULUS = 2 ** 64
+
+
+class FetchError(Exception):
+    pass
+
+
+def get_date_partitions(lo, hi, days=DEFAULT_PARTITION_DAYS):
+    '''splits the inclusive date range lo..hi into inclusive ranges of at most `days` days that do not overlap.
+    a single range is returned if days is 0 or None
+    '''
+    if not days or hi < lo:
+        return [(lo, hi)]
+
+    partitions = []
+    step = timedelta(days=days)
+    day = timedelta(days=1)
+
+    while lo <= hi:
+        partitions.append((lo, min(lo + step - day, hi)))
+        lo += step
+
+    return partitions
+
+
+class PartitionedFetcher(object):
+    '''Downloads csv urls at the same time with a pool of threads.
+
+    `fetch` starts the downloads and returns a `Fetch` that iterates like a csv reader
+    over the rows of every url: the header once and then the rows in the order they arrive.
+    Every url must have the same header.
+    '''
+
+    def __init__(self, get_csv, threads=DEFAULT_THREADS):
+        '''get_csv - called with a url. returns an iterator of csv rows starting with the header
+        threads - the number of urls to download at the same time
+        '''
+        super(PartitionedFetcher, self).__init__()
+
+        if threads < 1:
+            raise FetchError('A fetcher needs at least one thread.')
+
+        self.get_csv = get_csv
+        self.threads = threads
+
+    def fetch(self, urls, queue_size=DEFAULT_QUEUE_SIZE):
+        '''starts downloading urls and returns a Fetch of their rows
+        queue_size - the number of chunks of rows to hold before the downloads wait. 0 holds every row
+        '''
+        return Fetch(self.get_csv, urls, min(self.threads, len(urls)) or 1, queue_size)
+
+
+class Fetch(object):
+    '''The merged rows of urls being downloaded by threads. Iterates like a csv reader.
+
+    `rows_read` counts the rows that have been read, not counting the header. `checksum`
+    is the sum of the crc32 of each row read, so it is the same for the same rows
+    in any order.
+    '''
+
+    def __init__(self, get_csv, urls, threads, queue_size):
+        super(Fetch, self).__init__()
+
+        self.get_csv = get_csv
+        self.threads = threads
+        self.urls = Queue()
+        self.chunks = Queue(queue_size)
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.error = None
+        self.header = None
+        self.rows_read = 0
+        self.checksum = 0
+        self.rows = self._read()
+
+        for url in urls:
+            self.urls.put(url)
+
+        for i in xrange(threads):
+            thread = threading.Thread(target=self._download, name='fetch-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.rows.next()
+
+    def close(self):
+        '''stops the downloads. rows that have not been read are thrown away'''
+        self.cancelled.set()
+
+        #: unblock any download waiting on a full queue
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except Empty:
+                break
+
+    def _read(self):
+        stopped = 0
+
+        while stopped < self.threads:
+            chunk = self.chunks.get()
+
+            if chunk is STOP:
+                stopped += 1
+                continue
+
+            if self.error:
+                break
+
+            header, rows = chunk
+
+            if self.header is None:
+                self.header = header
+                yield header
+            elif header != self.header:
+                self.close()
+                raise FetchError('The partitions of a fetch have different headers.')
+
+            for row in rows:
+                self.rows_read += 1
+                self.checksum = (self.checksum + (zlib.crc32('\x1f'.join(row)) & 0xffffffff)) % CHECKSUM_MODULUS
+
+                yield row
+
+        if self.error:
+            self.close()
+            raise self.error[0], self.error[1], self.error[2]
+
+    def _download(self):
+        try:
+            while not self.cancelled.is_set():
+                try:
+                    url = self.urls.get_nowait()
+                except Empty:
+                    break
+
+                rows = self.get_csv(url)
+
+                try:
+                    self._download_rows(rows)
+                finally:
+                    if hasattr(rows, 'close'):
+                        rows.close()
+        except BaseException:
+            with self.lock:
+                if self.error is None:
+                    self.error = sys.exc_info()
+
+            self.cancelled.set()
+        finally:
+            self._put(STOP)
+
+    def _download_rows(self, rows):
+        header = next(rows, None)
+
+        if header is None:
+            return
+
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+
+            if len(chunk) >= ROWS_PER_CHUNK:
+                if self.cancelled.is_set():
+                    return
+
+                self._put((header, chunk))
+                chunk = []
+
+        #: sent even when empty so a fetch of partitions without rows still has a header
+        self._put((header, chunk))
+
+    def _put(self, item):
+        '''waits for room in the queue unless the fetch is cancelled'''
+        while True:
+            try:
+                self.chunks.put(item, block=not self.cancelled.is_set(), timeout=0.1)
+
+                return
+            except Full:
+                if self.cancelled.is_set():
+                    return
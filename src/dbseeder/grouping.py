@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+grouping.py
+----------------------------------
+single pass grouping of csv rows
+'''
+
+import csv
+import heapq
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from itertools import groupby
+
+#: the default number of bytes of rows to hold before spilling to disk
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+#: the rough cost of a python string in a row besides its characters
+CELL_OVERHEAD = 40
+
+
+class SampleGrouper(object):
+    '''Groups csv rows by the value in a key column while reading them once.
+
+    Rows are grouped in memory while they fit inside `memory_budget`. When the
+    budget is exceeded the groups are sorted by key and spilled to disk as a run.
+    The runs are merged when the input is exhausted so every key is yielded once
+    with all of its rows in the order they were read.
+    '''
+
+    def __init__(self, key_index, memory_budget=DEFAULT_MEMORY_BUDGET, temp_folder=None):
+        '''key_index - the index of the column to group by
+        memory_budget - the approximate number of bytes of rows to keep in memory
+        temp_folder - the parent folder for spilled runs. defaults to the system temp
+        '''
+        super(SampleGrouper, self).__init__()
+
+        self.key_index = key_index
+        self.memory_budget = memory_budget
+        self.temp_folder = temp_folder
+        self.runs = []
+
+    def group(self, rows):
+        '''rows: an iterable of lists, most likely a csv reader past the header
+
+        yields (key, list(rows)) tuples
+        '''
+        groups = OrderedDict()
+        size = 0
+        spill_folder = None
+
+        try:
+            for row in rows:
+                key = row[self.key_index]
+
+                try:
+                    groups[key].append(row)
+                except KeyError:
+                    groups[key] = [row]
+
+                size += self._get_size(row)
+                if size < self.memory_budget:
+                    continue
+
+                if spill_folder is None:
+                    spill_folder = tempfile.mkdtemp(prefix='dbseeder', dir=self.temp_folder)
+
+                self._spill(groups, spill_folder)
+                groups = OrderedDict()
+                size = 0
+
+            if not self.runs:
+                for key, group in groups.iteritems():
+                    yield key, group
+
+                return
+
+            if groups:
+                self._spill(groups, spill_folder)
+
+            for key, group in self._merge_runs():
+                yield key, group
+        finally:
+            self.runs = []
+            if spill_folder is not None:
+                shutil.rmtree(spill_folder, ignore_errors=True)
+
+    def _get_size(self, row):
+        '''an estimate of the memory used by a row'''
+        return sum(len(cell) for cell in row) + CELL_OVERHEAD * len(row)
+
+    def _spill(self, groups, folder):
+        '''writes the groups sorted by key to a new run file'''
+        path = os.path.join(folder, 'run{}.csv'.format(len(self.runs)))
+
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            for key in sorted(groups.iterkeys()):
+                writer.writerows(groups[key])
+
+        self.runs.append(path)
+
+    def _read_run(self, path, run):
+        '''yields (key, run, sequence, row) so rows sort by key then by the order they were read'''
+        with open(path, 'rb') as f:
+            for sequence, row in enumerate(csv.reader(f)):
+                yield row[self.key_index], run, sequence, row
+
+    def _merge_runs(self):
+        '''k-way merges the sorted runs yielding (key, list(rows))'''
+        readers = [self._read_run(path, run) for run, path in enumerate(self.runs)]
+
+        for key, items in groupby(heapq.merge(*readers), key=lambda item: item[0]):
+            yield key, [item[3] for item in items]
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+keycache.py
+----------------------------------
+a local copy of the station and sample ids in the database
+'''
+
+import hashlib
+import math
+import numpy
+import sqlite3
+import struct
+
+#: the share of keys that are not in a bloom filter it reports as maybe being in it
+DEFAULT_ERROR_RATE = 0.01
+
+#: the number of rows to read from the database at a time while syncing
+ROWS_PER_FETCH = 10000
+
+#: the number of Ids below the mark read again at each sync. an identity value reserved by a transaction
+#: that commits after a sync is smaller than the mark the sync left
+SYNC_OVERLAP = 10000
+
+#: the number of keys looked up in the cache with each statement. sqlite before 3.32 allows 999 parameters
+KEYS_PER_LOOKUP = 900
+
+#: the name the StationIds without their _WQX are kept under
+STRIPPED_STATIONS = 'StrippedStations'
+
+
+def encode_key(key):
+    '''keys are kept as utf-8 bytes since sql server returns unicode and the csv files are bytes'''
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+
+    return str(key)
+
+
+class BloomFilter(object):
+    '''A set that can only answer "definitely not a member" or "maybe a member".
+
+    Each key sets `hashes` bits picked by double hashing the md5 of the key so the filter
+    takes about 10 bits per key at a 1% error rate no matter how long the keys are.
+    '''
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        '''capacity - the number of keys the filter is sized for
+        error_rate - the share of keys that are not members reported as maybe members once it is full
+        '''
+        super(BloomFilter, self).__init__()
+
+        capacity = max(1, capacity)
+
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(float(self.size) / capacity * math.log(2))))
+        self.bits = numpy.zeros(self.size, dtype=bool)
+
+    def __contains__(self, key):
+        return bool(self.contains([key])[0])
+
+    def contains(self, keys):
+        '''returns a boolean array that is False for the keys that are definitely not members'''
+        keys = list(keys)
+
+        if not keys:
+            return numpy.zeros(0, dtype=bool)
+
+        return self.bits[self._get_bits(keys)].all(axis=1)
+
+    def add(self, keys):
+        '''adds an iterable of keys'''
+        keys = list(keys)
+
+        if keys:
+            self.bits[self._get_bits(keys).ravel()] = True
+
+    def _get_bits(self, keys):
+        '''returns a (keys, hashes) array of the bits for each key'''
+        hashes = numpy.array([struct.unpack('<QQ', hashlib.md5(encode_key(key)).digest()) for key in keys],
+                             dtype=numpy.uint64)
+
+        first = hashes[:, 0] % self.size
+        #: a step of 0 would probe the same bit `hashes` times
+        second = hashes[:, 1] % max(1, self.size - 1) + 1
+
+        steps = numpy.arange(self.hashes, dtype=numpy.uint64)
+
+        return (first[:, None] + steps[None, :] * second[:, None]) % self.size
+
+
+class KeyCache(object):
+    '''The StationIds and SampleIds in the database, kept in a local sqlite file.
+
+    `sync` copies the rows added to the database since the last sync. Each table's
+    high-water mark is its largest `Id` seen. The last `SYNC_OVERLAP` Ids below the mark
+    are read again to pick up rows that were committed after an earlier sync read past
+    them. If the table's largest Id drops below the mark, the table has been recreated
+    and its keys are copied again. Rows deleted from a table that still has larger Ids
+    are not noticed, so delete the cache file after deleting rows. Lookups go through a
+    bloom filter first so most keys that are not in the cache never touch the file.
+
+    When `strip_station` is given each StationId is also kept in its `_WQX` stripped form
+    under `STRIPPED_STATIONS`.
+    '''
+
+    #: the column holding the key of each table
+    tables = {
+        'Stations': 'StationId',
+        'Results': 'SampleId'
+    }
+
+    sql = {
+        'max_id': 'SELECT MAX(Id) FROM {}',
+        'rows_after': 'SELECT Id, {1} FROM {0} WHERE Id > ? ORDER BY Id',
+        'create_keys': ('CREATE TABLE IF NOT EXISTS Keys (TableName TEXT NOT NULL, Key TEXT NOT NULL, '
+                        'PRIMARY KEY (TableName, Key)) WITHOUT ROWID'),
+        'create_marks': 'CREATE TABLE IF NOT EXISTS Marks (TableName TEXT PRIMARY KEY, HighId INTEGER NOT NULL)',
+        'insert_key': 'INSERT OR IGNORE INTO Keys (TableName, Key) VALUES (?, ?)',
+        'set_mark': 'INSERT OR REPLACE INTO Marks (TableName, HighId) VALUES (?, ?)',
+        'get_mark': 'SELECT HighId FROM Marks WHERE TableName = ?',
+        'clear': 'DELETE FROM Keys WHERE TableName = ?',
+        'count': 'SELECT COUNT(*) FROM Keys WHERE TableName = ?',
+        'keys': 'SELECT Key FROM Keys WHERE TableName = ?',
+        'lookup': 'SELECT Key FROM Keys WHERE TableName = ? AND Key IN ({})'
+    }
+
+    def __init__(self, path, error_rate=DEFAULT_ERROR_RATE, overlap=SYNC_OVERLAP, strip_station=None):
+        '''path - the sqlite file to keep the keys in. it is created if it does not exist
+        error_rate - the share of keys that are not cached that still have to be looked up in the file
+        overlap - the number of Ids below the mark to read again at each sync
+        strip_station - returns a StationId without its _WQX
+        '''
+        super(KeyCache, self).__init__()
+
+        self.path = path
+        self.error_rate = error_rate
+        self.overlap = overlap
+        self.strip_station = strip_station
+        self.filters = {}
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.text_factory = str
+        self.connection.execute(self.sql['create_keys'])
+        self.connection.execute(self.sql['create_marks'])
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def sync(self, connection):
+        '''copies the keys added to the database since the last sync and builds the bloom filters
+        connection - a connection to the database being updated
+
+        returns {table: the number of rows past the mark}
+        '''
+        read = {}
+
+        for table, column in self.tables.iteritems():
+            read[table] = self._sync_table(connection, table, column)
+            self.filters[table] = self._build_filter(table)
+
+        if self.strip_station:
+            self.filters[STRIPPED_STATIONS] = self._build_filter(STRIPPED_STATIONS)
+
+        return read
+
+    def find_new(self, table, keys):
+        '''returns the set of keys that are not in the cache of table'''
+        keys = list(set(keys) - set([None]))
+        bloom = self.filters.get(table)
+
+        if bloom is None:
+            bloom = self.filters[table] = self._build_filter(table)
+
+        maybe = [key for key, member in zip(keys, bloom.contains(keys)) if member]
+
+        return set(keys) - self._lookup(table, maybe)
+
+    def get_mark(self, table):
+        '''returns the largest Id of table that has been copied'''
+        row = self.connection.execute(self.sql['get_mark'], (table,)).fetchone()
+
+        return row[0] if row else 0
+
+    def _sync_table(self, connection, table, column):
+        cursor = connection.cursor()
+        mark = self.get_mark(table)
+        stripped = table == 'Stations' and self.strip_station
+
+        high = cursor.execute(self.sql['max_id'].format(table)).fetchone()[0] or 0
+
+        if high < mark:
+            #: the table was recreated since the last sync
+            self.connection.execute(self.sql['clear'], (table,))
+
+            if stripped:
+                self.connection.execute(self.sql['clear'], (STRIPPED_STATIONS,))
+
+            mark = 0
+
+        read = 0
+        high_mark = mark
+        cursor.execute(self.sql['rows_after'].format(table, column), (max(0, mark - self.overlap),))
+
+        while True:
+            rows = cursor.fetchmany(ROWS_PER_FETCH)
+
+            if not rows:
+                break
+
+            read += sum(1 for row in rows if row[0] > mark)
+            high_mark = max(high_mark, rows[-1][0])
+
+            keys = [row[1] for row in rows if row[1] is not None]
+
+            self.connection.executemany(self.sql['insert_key'], [(table, encode_key(key)) for key in keys])
+
+            if stripped:
+                self.connection.executemany(self.sql['insert_key'],
+                                            [(STRIPPED_STATIONS, encode_key(self.strip_station(key)))
+                                             for key in keys])
+
+        self.connection.execute(self.sql['set_mark'], (table, high_mark))
+        self.connection.commit()
+
+        return read
+
+    def _build_filter(self, table):
+        count = self.connection.execute(self.sql['count'], (table,)).fetchone()[0]
+        bloom = BloomFilter(count, self.error_rate)
+
+        cursor = self.connection.execute(self.sql['keys'], (table,))
+
+        while True:
+            rows = cursor.fetchmany(ROWS_PER_FETCH)
+
+            if not rows:
+                break
+
+            bloom.add(row[0] for row in rows)
+
+        return bloom
+
+    def _lookup(self, table, keys):
+        '''returns the keys that are in the cache file'''
+        found = set()
+
+        for i in xrange(0, len(keys), KEYS_PER_LOOKUP):
+            chunk = keys[i:i + KEYS_PER_LOOKUP]
+            encoded = dict((encode_key(key), key) for key in chunk)
+            statement = self.sql['lookup'].format(','.join('?' * len(encoded)))
+
+            for row in self.connection.execute(statement, [table] + encoded.keys()):
+                found.add(encoded[row[0]])
+
+        return found
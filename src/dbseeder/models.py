@@ -7,6 +7,13 @@ models
 The basic models
 '''
 
+import schema
+from collections import OrderedDict
+from itertools import izip, repeat
+
+#: the value of a field that was not in the source row. it is cast to None
+MISSING = object()
+
 
 class Concentration(object):
 
@@ -209,3 +216,186 @@ class Concentration(object):
             pass
 
         return value
+
+
+class Batch(object):
+
+    """
+    rows stored column by column with one list per field. sets of rows, e.g. the
+    results of a sample, are appended whole and the (start, stop) of each is kept
+    """
+
+    def __init__(self, fields):
+        super(Batch, self).__init__()
+
+        self.fields = list(fields)
+        self.columns = OrderedDict((field, []) for field in self.fields)
+        self.sets = []
+        self.count = 0
+
+        self._header = None
+        self._indices = None
+
+    def __len__(self):
+        return self.count
+
+    def append_rows(self, rows, header):
+        """
+        appends a set of csv rows. header is the field name of each csv column.
+        like dict(zip(header, row)) the last column with a name wins
+        """
+        if header is not self._header:
+            self._header = header
+            self._indices = dict((name, i) for i, name in enumerate(header))
+
+        for field, column in self.columns.iteritems():
+            i = self._indices.get(field)
+
+            if i is None:
+                column.extend(repeat(MISSING, len(rows)))
+            else:
+                column.extend([row[i] if i < len(row) else MISSING for row in rows])
+
+        self._add_set(len(rows))
+
+    def append_dicts(self, rows):
+        """
+        appends a set of {field: value} rows
+        """
+        for field, column in self.columns.iteritems():
+            column.extend([row.get(field, MISSING) for row in rows])
+
+        self._add_set(len(rows))
+
+    def append_columns(self, columns):
+        """
+        appends a set of rows given as {field: list of values}. fields that are not given are None
+        """
+        count = len(next(columns.itervalues())) if columns else 0
+
+        for field, column in self.columns.iteritems():
+            column.extend(columns.get(field) or repeat(None, count))
+
+        self._add_set(count)
+
+    def rows(self, fields=None):
+        """
+        returns a list of tuples with the values of fields. defaults to every field
+        """
+        if self.count == 0:
+            return []
+
+        return zip(*[self.columns[field] for field in fields or self.fields])
+
+    def _add_set(self, count):
+        self.sets.append((self.count, self.count + count))
+        self.count += count
+
+
+class Record(object):
+
+    """
+    a row with a slot for each field of a schema in insert order. it reads and writes
+    like the dictionary rows but fields that were never set are not `in` the record
+    """
+
+    __slots__ = ()
+
+    #: the schema the record was made from
+    schema = None
+
+    #: the field names in the order of the insert statement
+    fields = ()
+
+    #: the field names for membership tests
+    field_set = frozenset()
+
+    def __init__(self, values=None):
+        super(Record, self).__init__()
+
+        if values:
+            for field, value in values.iteritems():
+                self[field] = value
+
+    @classmethod
+    def from_row(cls, header, row):
+        """
+        creates a record from a csv row and the field name of each column. columns
+        that are not fields are skipped and like dict(zip(header, row)) the last column with a name wins
+        """
+        record = cls()
+
+        for field, value in izip(header, row):
+            if field in cls.field_set:
+                setattr(record, field, value)
+
+        return record
+
+    def __getitem__(self, field):
+        if field not in self.field_set:
+            raise KeyError(field)
+
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        if field not in self.field_set:
+            raise KeyError(field)
+
+        setattr(self, field, value)
+
+    def __contains__(self, field):
+        return field in self.field_set and hasattr(self, field)
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.items() == other.items()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, dict(self.items()))
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [field for field in self.fields if hasattr(self, field)]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.keys()]
+
+    def values(self):
+        """
+        the value of every field in insert order. fields that were never set are None
+        """
+        return [getattr(self, field, None) for field in self.fields]
+
+
+def record_class(name, row_schema):
+    """
+    returns a Record class with a slot for each field of the schema
+    """
+    fields = tuple(row_schema)
+
+    return type(name, (Record,), {
+        '__slots__': fields,
+        'schema': row_schema,
+        'fields': fields,
+        'field_set': frozenset(fields)
+    })
+
+
+#: a row of the Stations table
+StationRecord = record_class('StationRecord', schema.station)
+
+#: a row of the Results table
+ResultRecord = record_class('ResultRecord', schema.result)
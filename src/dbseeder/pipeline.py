@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+pipeline.py
+----------------------------------
+overlap reading, transforming and writing with threads and bounded queues
+'''
+
+import sys
+import threading
+from Queue import Queue
+
+#: the number of items a queue holds before the stage feeding it waits
+DEFAULT_QUEUE_SIZE = 64
+
+#: tells the next stage there is nothing more to come
+STOP = object()
+
+
+class PipelineError(Exception):
+    pass
+
+
+class Pipeline(object):
+    '''A reader thread feeding a pool of transform threads feeding a writer.
+
+    The reader pulls items from the source, the transformers call `transform` on each
+    item and the writer calls `write` with each result in the calling thread so it can
+    keep using the calling thread's database session. The stages are joined by queues
+    holding at most `queue_size` items so a slow writer stops the reader from running
+    ahead. Results are written in the order the transformers finish them.
+    '''
+
+    def __init__(self, transform, write, transformers=2, queue_size=DEFAULT_QUEUE_SIZE):
+        '''transform - called with each item from the source. returns the value to write
+        write - called with each transformed value
+        transformers - the number of transform threads
+        queue_size - the number of items each queue can hold
+        '''
+        super(Pipeline, self).__init__()
+
+        if transformers < 1:
+            raise PipelineError('A pipeline needs at least one transformer.')
+
+        self.transform = transform
+        self.write = write
+        self.transformers = transformers
+        self.queue_size = queue_size
+        self.failed = threading.Event()
+        self.lock = threading.Lock()
+        self.error = None
+
+    def run(self, source):
+        '''reads every item from source and returns the number of items written.
+        The first error raised by any stage stops the pipeline and is raised here.
+        '''
+        self.failed.clear()
+        self.error = None
+
+        items = Queue(self.queue_size)
+        results = Queue(self.queue_size)
+
+        threads = [threading.Thread(target=self._read, args=(source, items), name='pipeline-reader')]
+        threads += [threading.Thread(target=self._transform, args=(items, results), name='pipeline-transform-{}'.format(i))
+                    for i in xrange(self.transformers)]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        written = self._write(results)
+
+        for thread in threads:
+            thread.join()
+
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+
+        return written
+
+    def _read(self, source, items):
+        try:
+            for item in source:
+                if self.failed.is_set():
+                    break
+
+                items.put(item)
+        except BaseException:
+            self._fail()
+        finally:
+            for i in xrange(self.transformers):
+                items.put(STOP)
+
+    def _transform(self, items, results):
+        '''transforms items until it gets a STOP. after a failure items are drained without
+        being transformed so the reader is never left blocked on a full queue
+        '''
+        try:
+            while True:
+                item = items.get()
+
+                if item is STOP:
+                    break
+
+                if self.failed.is_set():
+                    continue
+
+                try:
+                    results.put(self.transform(item))
+                except BaseException:
+                    self._fail()
+        finally:
+            results.put(STOP)
+
+    def _write(self, results):
+        '''writes results until every transformer has stopped. after a failure results are
+        drained without being written so the transformers are never left blocked on a full queue
+        '''
+        stopped = 0
+        written = 0
+
+        while stopped < self.transformers:
+            result = results.get()
+
+            if result is STOP:
+                stopped += 1
+                continue
+
+            if self.failed.is_set():
+                continue
+
+            try:
+                self.write(result)
+                written += 1
+            except BaseException:
+                self._fail()
+
+        return written
+
+    def _fail(self):
+        '''records the first error and tells the other stages to stop'''
+        with self.lock:
+            if self.error is None:
+                self.error = sys.exc_info()
+
+        self.failed.set()
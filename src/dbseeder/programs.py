@@ -7,25 +7,52 @@ Programs.py
 the different source programs
 '''
 
+import backends
 import csv
-import pyodbc
+import multiprocessing
 import re
 import schema
-import sqlite3
 import os
 from collections import OrderedDict
 from datetime import datetime
 from dateutil.parser import parse as dateparser
 from glob import glob
-from os.path import join, isdir, basename, splitext
+from itertools import izip
+from os.path import join, isdir, basename, splitext, dirname, abspath
 from querycsv import query_csv
 from functools import partial
+from bulk import BulkFileSpooler, DEFAULT_FILE_SIZE
+from checkpoints import Manifest, MANIFEST
+from fetching import PartitionedFetcher, get_date_partitions, DEFAULT_PARTITION_DAYS, DEFAULT_THREADS
+from grouping import SampleGrouper, DEFAULT_MEMORY_BUDGET
+from keycache import KeyCache, STRIPPED_STATIONS
+from models import Batch, Record, ResultRecord
+from pipeline import Pipeline, DEFAULT_QUEUE_SIZE
+from sessions import ConnectionPool
 from services import Caster, Reproject, Normalizer, ChargeBalancer, HttpClient
+from writers import ExecuteManyWriter, MultiRowValuesWriter, DEFAULT_BATCH_SIZE, DEFAULT_BYTE_BUDGET
 from benchmarking import get_milliseconds
 
 
 TEMPDB = 'temp.sqlite3'
 
+#: the program used by the current worker process. see _init_worker
+_worker = None
+
+
+def _init_worker(db, options, writer_lock):
+    '''creates the program for a seeding worker process'''
+    global _worker
+
+    _worker = WqpProgram(db, writer_lock=writer_lock, **options)
+
+
+def _seed_results_file(csv_file):
+    '''seeds a results csv file in a worker process returning the number of sample sets'''
+    _worker._stage_by_file(csv_file)
+
+    return _worker._seed_results_file(csv_file)
+
 
 class WqpProgram(object):
     '''class for handling wqp csv files'''
@@ -33,7 +60,7 @@ class WqpProgram(object):
     datasource = 'WQP'
 
     wqp_url = ('http://www.waterqualitydata.us/{}/search?sampleMedia=Water&startDateLo={}&startDateHi={}&'
-               'bBox=-115%2C35.5%2C-108%2C42.5&mimeType=csv')
+               'bBox=-115%2C35.5%2C-108%2C42.5&mimeType=csv&zip=yes')
 
     fields = {
         'sample_id': 'ActivityIdentifier',
@@ -44,6 +71,9 @@ class WqpProgram(object):
         'distinct_sample_id': 'select distinct({}) from {}',
         'sample_id': 'select * from {} where {} = \'{}\'',
         'wqxids': 'select {0} from {1} where {0} LIKE \'%_WQX%\'',
+        'analytes': 'SELECT SampleId, Param, SampFrac, Unit FROM Results WHERE SampleId IN ({})',
+        'max_result_id': 'SELECT MAX(Id) FROM Results',
+        'delete_samples': 'DELETE FROM Results WHERE DataSource = ? AND Id > ? AND SampleId IN ({})',
         'station_insert': ('insert into Stations (OrgId, OrgName, StationId, StationName, StationType, StationComment,'
                            + ' HUC8, Lon_X, Lat_Y, HorAcc, HorAccUnit, HorCollMeth, HorRef, Elev, ElevUnit, ElevAcc,'
                            + ' ElevAccUnit, ElevMeth, ElevRef, StateCode, CountyCode, Aquifer, FmType, AquiferType,'
@@ -55,16 +85,19 @@ class WqpProgram(object):
                           + ' ResultComment, ResultStatus, ResultValue, SampComment, SampDepth, SampDepthRef,'
                           + ' SampDepthU, SampEquip, SampFrac, SampleDate, SampleTime, SampleId, SampMedia, SampMeth,'
                           + ' SampMethName, SampType, StationId, Unit, USGSPCode) values ({})'),
-        'create_index': "CREATE INDEX IF NOT EXISTS 'ActivityIdentifier_{0}' ON '{0}' ('ActivityIdentifier' ASC)",
-        'max_sample_date': 'SELECT max(SampleDate) FROM [UGSWaterChemistry].[dbo].[Results]',
-        'new_stations': ('SELECT * FROM (VALUES{}) AS t(StationId) WHERE NOT EXISTS('
-                         + 'SELECT 1 FROM [UGSWaterChemistry].[dbo].[Stations] WHERE [StationId] = t.StationId)'),
-        'new_results': ('SELECT * FROM (VALUES{}) AS t(SampleId) WHERE NOT EXISTS('
-                        + 'SELECT 1 FROM [UGSWaterChemistry].[dbo].[Results] WHERE [SampleId] = t.SampleId)')
     }
 
     wqx_re = re.compile('(_WQX)-')
 
+    #: the position of the fields identifying an analyte of a sample in a transformed result row
+    analyte_indices = [schema.result.keys().index(field) for field in ['SampleId', 'Param', 'SampFrac', 'Unit']]
+
+    insert_modes = {
+        'executemany': ExecuteManyWriter,
+        'values': MultiRowValuesWriter,
+        'bulk': BulkFileSpooler
+    }
+
     station_config = OrderedDict([
         ('OrganizationIdentifier', 'OrgId'),
         ('OrganizationFormalName', 'OrgName'),
@@ -146,10 +179,46 @@ class WqpProgram(object):
         ('USGSPCode', 'USGSPCode')
     ])
 
-    def __init__(self, db, file_location=None):
+    def __init__(self, db, file_location=None, memory_budget=DEFAULT_MEMORY_BUDGET, grouping='stream',
+                 batch_size=DEFAULT_BATCH_SIZE, byte_budget=DEFAULT_BYTE_BUDGET, insert_mode='executemany',
+                 bulk_folder='bulk', bulk_file_size=DEFAULT_FILE_SIZE, pool=None, workers=1, writers=None,
+                 staging_db=TEMPDB, writer_lock=None, transformers=0, queue_size=DEFAULT_QUEUE_SIZE,
+                 columnar=False, balance='python', fetch_days=DEFAULT_PARTITION_DAYS, fetch_threads=DEFAULT_THREADS,
+                 key_cache=None, manifest=MANIFEST, resume=False):
         '''create a new WQP program
-        db - the connection string for the database to seed
+        db - the secrets configuration for the database to seed
+        pool - a ConnectionPool shared with other programs. one is created for `db` if None
+        workers - the number of processes seeding results csv files at the same time
+        writers - the number of workers that can send rows to the database at the same time. defaults to workers
+        staging_db - the sqlite database for querying csv files. workers use one per results file
+        writer_lock - a semaphore held while rows are sent to the database. set for workers
+        transformers - the number of threads transforming sample sets while another thread reads the csv and
+                       this thread inserts rows. 0 reads, transforms and inserts each sample set in sequence
+        queue_size - the number of sample sets waiting between pipeline stages
+        columnar - transform results a column at a time in batches of whole sample sets with at least
+                   `batch_size` rows instead of a dictionary per row
+        balance - `python` to add the charge balance rows while each sample set is transformed,
+                  `database` to compute them for every sample with one statement after the results are inserted or
+                  `incremental` to compute them in the database for only the samples that were given new rows.
+                  an incremental update also inserts new analytes for samples that are already in the database.
+                  seeding gives every sample new rows so it is the same as `database`
+        fetch_days - the number of days of results in each request an update sends. 0 sends one request
+        fetch_threads - the number of requests for results and the number for stations an update sends at the same time
+        key_cache - the sqlite file to keep a copy of the station and sample ids in the database in. an update checks
+                    ids against it and only asks the database about the ids it does not have. None asks about every id
+        manifest - the sqlite file a seed records the files and sample sets it has committed in. it is removed
+                   when the seed finishes
+        resume - skip the work recorded in the manifest by a seed that did not finish and reuse its staging database
         file_location - the path on disk to find csv files to ETL
+        memory_budget - the number of bytes of results to group in memory before spilling to disk
+        grouping - `stream` to group results in a single pass over the csv or
+                   `staged` to group them with sqlite queries against the staging database
+        batch_size - the number of rows to insert before committing
+        byte_budget - the approximate number of bytes to insert before committing
+        insert_mode - `executemany` to bind parameter arrays, `values` to send multi row VALUES statements
+                      or `bulk` to spool rows to files loaded with BULK INSERT
+        bulk_folder - the folder for bulk load files. it must be readable by the database server
+        bulk_file_size - the number of bytes in a bulk load file before a new one is started
 
         if `file_location` is None, it is assumed to be an update
         operation
@@ -157,6 +226,65 @@ class WqpProgram(object):
         super(WqpProgram, self).__init__()
 
         self.db = db
+        self.owns_pool = pool is None
+        self.pool = pool or ConnectionPool(backends.create(db))
+        self.backend = self.pool.backend
+        self.memory_budget = memory_budget
+        self.batch_size = batch_size
+        self.byte_budget = byte_budget
+        self.writers = {}
+        self.workers = workers
+        self.writer_connections = writers or workers
+        self.staging_db = staging_db
+        self.writer_lock = writer_lock
+        self.transformers = transformers
+        self.queue_size = queue_size
+        self.columnar = columnar
+
+        if balance not in ['python', 'database', 'incremental']:
+            raise Exception('Unknown balance {}. Use python, database or incremental.'.format(balance))
+
+        self.balance = balance
+        self.fetch_days = fetch_days
+        self.fetcher = PartitionedFetcher(HttpClient.get_csv, fetch_threads)
+        self.key_cache_path = key_cache
+        self.key_cache = None
+        self.manifest_path = manifest
+        self.resume = resume
+        self.manifest = None
+        #: the csv file being seeded, the sample ids of it that were committed by an earlier run
+        #: and the ids written since the last checkpoint
+        self.checkpoint_file = None
+        self.committed_samples = set()
+        self.written_samples = []
+
+        #: the options to create the same program in a worker process
+        self.worker_options = {
+            'memory_budget': memory_budget,
+            'grouping': grouping,
+            'batch_size': batch_size,
+            'byte_budget': byte_budget,
+            'insert_mode': insert_mode,
+            'bulk_folder': bulk_folder,
+            'bulk_file_size': bulk_file_size,
+            'transformers': transformers,
+            'queue_size': queue_size,
+            'columnar': columnar,
+            'balance': balance,
+            'manifest': manifest
+        }
+
+        if insert_mode not in self.insert_modes:
+            raise Exception('Unknown insert mode {}. Use executemany, values or bulk.'.format(insert_mode))
+
+        self.insert_mode = insert_mode
+        self.bulk_folder = bulk_folder
+        self.bulk_file_size = bulk_file_size
+
+        if grouping not in ['stream', 'staged']:
+            raise Exception('Unknown grouping {}. Use stream or staged.'.format(grouping))
+
+        self.grouping = grouping
 
         #: if file_location is None then we are updating
         if file_location is not None:
@@ -180,25 +308,56 @@ class WqpProgram(object):
         if not hasattr(self, 'results_folder') or not hasattr(self, 'stations_folder'):
             raise Exception('You must pass a file location if you are seeding. Did you want to update?')
 
+        self.manifest = Manifest(self.manifest_path)
+        finished = False
+
+        if not self.resume:
+            self.manifest.reset()
+
         try:
             self._seed_by_file()
+            self._flush_writers()
+
+            if self.balance != 'python':
+                self._update_charge_balances()
+
+            finished = True
         finally:
-            if hasattr(self, 'cursor'):
-                del self.cursor
+            #: an interrupted seed keeps its staging database and manifest to resume from
+            self._close(keep_staging=not finished)
+
+        self.manifest.remove()
+        self.manifest = None
 
     def update(self):
+        result_rows = new_stations = None
+
         try:
-            last_updated = self._get_most_recent_result_date()
+            last_updated = self._get_last_updated()
+            window_end = datetime.now()
 
             if not last_updated:
                 raise Exception('No last updated date')
 
-            #: get new results from wqp service
-            result_url = self._format_url(self.wqp_url, 'Result', last_updated)
+            if self.key_cache_path:
+                self.key_cache = KeyCache(self.key_cache_path, strip_station=lambda id: re.sub(self.wqx_re, '-', id))
+                read = self.key_cache.sync(self.pool.session().connection)
+                print('copied {Stations} station and {Results} result rows to the key cache'.format(**read))
+
+            #: get new results from wqp service a partition of the days at a time
+            result_rows = self.fetcher.fetch(self._get_partition_urls(self.wqp_url, 'Result', last_updated, window_end))
+            #: the stations are downloaded alongside the results and held until they are needed
+            new_stations = self.fetcher.fetch(self._get_partition_urls(self.wqp_url, 'Station', last_updated, window_end),
+                                              queue_size=0)
             #: group them as if they were read from querycsv
-            new_results = self._group_rows_by_id(HttpClient.get_csv(result_url))
-            #: remove results that have a sample id already in the database
-            new_results = self._remove_existing_results(new_results)
+            new_results = self._group_rows_by_id(result_rows)
+            if self.balance == 'incremental':
+                #: results for samples in the database are checked one analyte at a time
+                existing_analytes = self._get_existing_analytes(new_results.keys())
+            else:
+                #: remove results that have a sample id already in the database
+                new_results = self._remove_existing_results(new_results)
+                existing_analytes = set()
             #: find the station ids from the new results that aren't in the database
             new_station_ids = self._find_new_station_ids(new_results)
             #: check database for stripped wqx and remove wqx id's since they are duplicates
@@ -207,31 +366,77 @@ class WqpProgram(object):
             if new_station_ids and len(new_station_ids) > 0:
                 print('of the new stations found, attempting to insert {}'.format(len(new_station_ids)))
 
-                station_url = self._format_url(self.wqp_url, 'Station', last_updated)
-                new_stations = HttpClient.get_csv(station_url)
+                header = next(new_stations, None)
 
-                if not new_stations:
-                    raise Exception('WQP service should have returned results but result is empty. {}'.format(station_url))
-
-                header = new_stations.next()
+                if header is None:
+                    raise Exception('WQP service should have returned stations but the result is empty. {}'.format(
+                        self._format_url(self.wqp_url, 'Station', last_updated)))
 
                 stations = self._extract_stations_by_id(new_stations, new_station_ids, header)
                 wqx = self._get_wqx_duplicate_ids(stations)
 
                 self._seed_stations(stations, header=header, wqx=wqx)
+                self._flush_writers()
             else:
                 print('all stations already in database')
+
+            sample_ids = set()
             for samples_for_id in new_results.values():
-                self._seed_results(samples_for_id)
+                rows = self._transform_results(samples_for_id)
 
+                if existing_analytes:
+                    rows = [row for row in rows if self._get_analyte(row) not in existing_analytes]
+
+                if rows:
+                    self._write_results(rows)
+                    sample_ids.add(self._get_analyte(rows[0])[0])
+
+            self._flush_writers()
+
+            if self.balance == 'incremental':
+                self._update_charge_balances(sample_ids)
+            elif self.balance == 'database':
+                self._update_charge_balances()
+
+            self._save_sync_state(last_updated, window_end, result_rows, new_stations)
         finally:
-            if hasattr(self, 'cursor'):
-                del self.cursor
+            #: stop any downloads that are not needed. e.g. the stations when they are all in the database
+            for fetch in [result_rows, new_stations]:
+                if fetch is not None:
+                    fetch.close()
+
+            if self.key_cache:
+                self.key_cache.close()
+                self.key_cache = None
+
+            self._close()
+
+    def _close(self, keep_staging=False):
+        '''drops the writers, removes the staging database and gives the connection back to the pool'''
+        self.writers = {}
+
+        if self.manifest is not None:
+            self.manifest.close()
+
+        #: the stations wqx lookup stages the stations csv
+        if os.path.exists(self.staging_db) and not keep_staging:
+            os.remove(self.staging_db)
+
+        if self.owns_pool:
+            self.pool.close()
+        else:
+            self.pool.end_session()
 
     def _seed_by_file(self):
         print('processing stations')
 
         for csv_file in self._get_files(self.stations_folder):
+            if self.manifest.is_done(csv_file):
+                print('skipping {}: seeded by an earlier run'.format(basename(csv_file)))
+                continue
+
+            self.manifest.start(csv_file)
+
             #: create csv reader
             with open(csv_file, 'r') as f:
                 print('processing {}'.format(basename(csv_file)))
@@ -245,38 +450,269 @@ class WqpProgram(object):
 
                 self._seed_stations(reader, header=header, wqx=wqx)
 
+                #: a stations file is committed all at once
+                self._flush_writers()
+                self.manifest.finish(csv_file)
+
                 print('processing {}: done'.format(basename(csv_file)))
 
         print('processing results')
 
-        for csv_file in self._get_files(self.results_folder):
-            print('processing {}'.format(basename(csv_file)))
+        csv_files = self._get_files(self.results_folder)
+        finished = [csv_file for csv_file in csv_files if self.manifest.is_done(csv_file)]
+
+        for csv_file in finished:
+            print('skipping {}: seeded by an earlier run'.format(basename(csv_file)))
+
+        csv_files = [csv_file for csv_file in csv_files if csv_file not in finished]
+
+        if self.workers > 1 and len(csv_files) > 1:
+            return self._seed_results_in_parallel(csv_files)
+
+        for csv_file in csv_files:
+            self._seed_results_file(csv_file)
+
+    def _seed_results_file(self, csv_file):
+        '''seeds the sample sets in a results csv file returning the number of sample sets'''
+        print('processing {}'.format(basename(csv_file)))
+
+        self._start_checkpoints(csv_file)
+
+        if self.columnar:
+            sample_sets = self._seed_result_batches(csv_file)
+        elif self.transformers > 0:
+            pipeline = Pipeline(self._transform_results,
+                                self._write_sample_set,
+                                transformers=self.transformers,
+                                queue_size=self.queue_size)
+
+            sample_sets = pipeline.run(self._report_progress(self._get_sample_sets(csv_file)))
+        else:
+            sample_sets = 0
+            for samples in self._report_progress(self._get_sample_sets(csv_file)):
+                self._write_sample_set(self._transform_results(samples))
+                sample_sets += 1
+
+        self._checkpoint()
+        self.manifest.finish(csv_file)
+
+        print('processing {}: done'.format(basename(csv_file)))
+
+        return sample_sets
+
+    def _stage_by_file(self, csv_file):
+        '''gives a worker a staging database and bulk folder named after the csv file it seeds so a resumed
+        run finds the ones an interrupted worker left behind
+        '''
+        name = splitext(basename(csv_file))[0]
+
+        #: the rows of the last file were sent at its final checkpoint
+        self.writers = {}
+        self.staging_db = join(dirname(abspath(self.manifest_path)), '{}.staging.sqlite3'.format(name))
+        self.bulk_folder = join(self.worker_options['bulk_folder'], name)
+
+    def _start_checkpoints(self, csv_file):
+        '''opens the manifest in a worker, removes the rows of samples from csv_file that an interrupted run
+        may have committed and reads the samples it did commit so they are skipped
+        '''
+        if self.manifest is None:
+            self.manifest = Manifest(self.manifest_path)
+
+        self.manifest.start(csv_file)
+
+        pending = self.manifest.get_pending(csv_file)
+        if pending:
+            print('removing {} sample sets that may not have been committed'.format(len(pending)))
+            self._delete_samples(pending, self.manifest.get_pending_after(csv_file))
+            self.manifest.clear_pending(csv_file)
+
+        self.checkpoint_file = csv_file
+        self.committed_samples = self.manifest.get_committed(csv_file)
+        self.written_samples = []
+
+        if self.committed_samples:
+            print('skipping {} sample sets committed by an earlier run'.format(len(self.committed_samples)))
+
+    def _checkpoint(self):
+        '''commits the queued rows and records their sample ids in the manifest'''
+        after_id = 0
+
+        #: no rows are sent until a writer exists
+        if self.writers:
+            after_id = self.pool.session().execute(self.sql['max_result_id']).fetchone()[0] or 0
+
+        self.manifest.add_pending(self.checkpoint_file, self.written_samples, after_id)
+        self._flush_writers()
+        self.manifest.commit_pending(self.checkpoint_file)
+
+        self.written_samples = []
+
+    def _write_sample_set(self, rows):
+        '''queues the transformed rows of a sample set and commits them at the next checkpoint'''
+        if not rows:
+            return
+
+        self._write_results(rows)
+        self._wrote_samples([rows[0][self.analyte_indices[0]]])
+
+    def _wrote_samples(self, sample_ids):
+        self.written_samples.extend(sample_ids)
+
+        #: the writers wait for a checkpoint to send their rows so a sample set is never partly committed
+        if any(writer.full for writer in self.writers.values()):
+            self._checkpoint()
+
+    def _delete_samples(self, sample_ids, after_id):
+        '''deletes the rows of this datasource for the sample ids with an Id larger than after_id'''
+        sample_ids = list(sample_ids)
+        chunk_size = ChargeBalancer.samples_per_statement
+        session = self.pool.session()
+
+        for i in xrange(0, len(sample_ids), chunk_size):
+            chunk = sample_ids[i:i + chunk_size]
+            session.execute(self.sql['delete_samples'].format(','.join('?' * len(chunk))),
+                            [self.datasource, after_id] + chunk)
+
+        session.commit()
+
+    def _seed_result_batches(self, csv_file):
+        '''seeds the sample sets in a results csv file a batch at a time returning the number of sample sets'''
+        sample_sets = [0]
+
+        def write(batches):
+            self._write_batches(batches)
+            sample_sets[0] += len(batches[0].sets)
+
+            sample_ids = batches[0].columns['SampleId']
+            self._wrote_samples([sample_ids[start] for start, stop in batches[0].sets])
+
+        batches = self._get_sample_batches(csv_file)
+
+        if self.transformers > 0:
+            pipeline = Pipeline(self._transform_batch, write, transformers=self.transformers, queue_size=self.queue_size)
+            pipeline.run(batches)
+        else:
+            for batch in batches:
+                write(self._transform_batch(batch))
+
+        return sample_sets[0]
+
+    def _seed_results_in_parallel(self, csv_files):
+        '''seeds the results csv files in a pool of `workers` processes. At most `writers`
+        workers send rows to the database at the same time.
+        '''
+        workers = min(self.workers, len(csv_files))
+        writer_lock = multiprocessing.BoundedSemaphore(self.writer_connections)
+
+        print('processing {} files with {} workers'.format(len(csv_files), workers))
+
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(self.db, self.worker_options, writer_lock))
+
+        try:
+            #: one file at a time so a large file does not hold up a chunk of small ones
+            sample_sets = sum(pool.imap_unordered(_seed_results_file, csv_files, chunksize=1))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        print('processing results: {} sample sets'.format(sample_sets))
 
-            #: create sqlite db and get unique sample ids
-            unique_sample_ids = self._get_distinct_sample_ids_from(csv_file)
+        return sample_sets
 
-            try:
-                #: this needs to be done after get_distinct so that the table is created in the db
-                self._add_sample_index(csv_file)
+    def _report_progress(self, sample_sets):
+        '''yields the sample sets printing the average time per set every 5000 sets'''
+        count = 0
+        sets_start = get_milliseconds()
 
-                sample_sets = 0
-                sets_start = get_milliseconds()
+        for samples in sample_sets:
+            yield samples
 
-                for sample_id in unique_sample_ids:
-                    samples = self._get_samples_for_id(sample_id, csv_file)
+            count += 1
+            elapsed = get_milliseconds() - sets_start
+            if count % 5000 == 0:
+                print('{} total sample sets (avg {} milliseconds per set)'.format(count, round(elapsed/count, 5)))
 
-                    self._seed_results(samples)
+    def _get_sample_sets(self, csv_file):
+        '''Given a results csv file, yields the etl'd rows for each sample id'''
+        if self.grouping == 'staged':
+            return self._get_staged_sample_sets(csv_file)
 
-                    sample_sets += 1
-                    elapsed = get_milliseconds() - sets_start
-                    if sample_sets % 5000 == 0:
-                        print('{} total sample sets (avg {} milliseconds per set)'.format(sample_sets,
-                                                                                          round(elapsed/sample_sets, 5)))
+        return self._get_streamed_sample_sets(csv_file)
 
-            finally:
-                #: in case something goes wrong always clean up the db
-                os.remove(TEMPDB)
-            print('processing {}: done'.format(basename(csv_file)))
+    def _get_streamed_sample_sets(self, csv_file):
+        '''Reads the csv file once and yields the etl'd rows for each sample id'''
+        for header, rows in self._get_grouped_rows(csv_file):
+            yield self._etl_column_names(rows, self.result_config, header=header)
+
+    def _get_grouped_rows(self, csv_file):
+        '''Reads the csv file once and yields the header and the csv rows for each sample id.
+        Sample sets are grouped in memory until `memory_budget` is reached and then spilled to disk.
+        '''
+        with open(csv_file, 'rb') as f:
+            reader = csv.reader(f)
+            header = reader.next()
+
+            grouper = SampleGrouper(header.index(self.fields['sample_id']), memory_budget=self.memory_budget)
+
+            for sample_id, rows in grouper.group(reader):
+                if self._is_committed(sample_id):
+                    continue
+
+                yield header, rows
+
+    def _get_sample_batches(self, csv_file):
+        '''Given a results csv file, yields Batches of whole sample sets with at least `batch_size` rows'''
+        fields = schema.result.keys()
+        batch = Batch(fields)
+
+        if self.grouping == 'staged':
+            for samples in self._report_progress(self._get_staged_sample_sets(csv_file)):
+                batch.append_dicts(samples)
+
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = Batch(fields)
+        else:
+            field_names = None
+
+            for header, rows in self._report_progress(self._get_grouped_rows(csv_file)):
+                if field_names is None:
+                    field_names = self._get_field_names(header, self.result_config)
+
+                batch.append_rows(rows, field_names)
+
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = Batch(fields)
+
+        if len(batch) > 0:
+            yield batch
+
+    def _get_staged_sample_sets(self, csv_file):
+        '''Loads the csv file into the staging database and yields the etl'd rows for each sample id'''
+        #: create sqlite db and get unique sample ids
+        unique_sample_ids = self._get_distinct_sample_ids_from(csv_file)
+        finished = False
+
+        try:
+            for sample_id in unique_sample_ids:
+                if self._is_committed(sample_id[0]):
+                    continue
+
+                yield self._get_samples_for_id(sample_id, csv_file)
+
+            finished = True
+        finally:
+            #: an interrupted seed reuses the staging database when it is resumed
+            if finished or self.manifest is None:
+                os.remove(self.staging_db)
+
+    def _is_committed(self, sample_id):
+        '''True if an earlier run committed the sample set. ids are compared as they are cast'''
+        return bool(self.committed_samples) and sample_id.strip() in self.committed_samples
 
     def _seed_stations(self, rows, header=None, wqx=None):
         stations = []
@@ -293,25 +729,23 @@ class WqpProgram(object):
             #: cast
             row = Caster.cast(row, schema.station)
 
-            #: set datasource, reproject and update shape
-            row = self._update_row(row)
-
-            #: normalize data including stripping _WXP etc
-            row = Normalizer.normalize_station(row)
+            #: store row for later
+            stations.append(row)
 
-            #: reorder and filter out any fields not in the schema
-            row = Normalizer.reorder_filter(row, schema.station)
+        #: set datasource, reproject and update shape for every station at once
+        stations = self._update_rows(stations)
 
-            #: have to generate sql manually because of quoting on spatial WKT
-            row = Caster.cast_for_sql(row)
+        #: normalize data including stripping _WXP etc
+        stations = map(Normalizer.normalize_station, stations)
 
-            #: store row for later
-            stations.append(row.values())
+        #: reorder and filter out any fields not in the schema
+        stations = [Normalizer.reorder_filter(station, schema.station).values() for station in stations]
 
         #: insert stations
         self._insert_rows(stations, self.sql['station_insert'])
 
-    def _seed_results(self, samples_for_id):
+    def _transform_results(self, samples_for_id):
+        '''returns the rows to insert for a sample set. safe to call from any thread'''
         #: cast to defined schema types
         samples = map(partial(Caster.cast, schema=schema.result), samples_for_id)
 
@@ -322,20 +756,71 @@ class WqpProgram(object):
         samples = map(Normalizer.normalize_sample, samples)
 
         #: create charge balance rows from sample
-        charge_balances = ChargeBalancer.get_charge_balance(samples)
-
-        samples.extend(charge_balances)
+        if self.balance == 'python':
+            samples.extend(ChargeBalancer.get_charge_balance(samples))
 
         #: reorder and filter out any fields not in the schema
         samples = map(partial(Normalizer.reorder_filter, schema=schema.result), samples)
 
-        samples = map(Caster.cast_for_sql, samples)
+        return map(lambda sample: sample.values(), samples)
+
+    def _transform_batch(self, batch):
+        '''returns the Batch of results and the Batch of their charge balances, if they are made in python.
+        safe to call from any thread'''
+        #: cast to defined schema types
+        batch = Caster.cast_batch(batch, schema.result)
+
+        #: set datasource and spatial information
+        batch = self._update_batch(batch)
+
+        #: normalize chemical names and units
+        batch = Normalizer.normalize_batch(batch)
+
+        if self.balance != 'python':
+            return (batch,)
 
-        rows = map(lambda sample: sample.values(), samples)
+        #: create charge balance rows for each sample set
+        return batch, ChargeBalancer.get_charge_balance_batch(batch)
 
-        #: TODO determine if this should this be batched in sets bigger than just a sample set?
+    def _write_results(self, rows):
+        #: rows are batched across sample sets by the writer
         self._insert_rows(rows, self.sql['result_insert'])
 
+    def _write_batches(self, batches):
+        writer = self._get_writer(self.sql['result_insert'])
+
+        for batch in batches:
+            writer.write_batch(batch)
+
+    def _update_charge_balances(self, sample_ids=None):
+        '''replaces the charge balance rows with ones computed by the database
+        sample_ids - the samples to balance. every sample if None
+        '''
+        if sample_ids is None:
+            print('calculating charge balances')
+        else:
+            print('calculating charge balances for {} samples'.format(len(sample_ids)))
+
+        ChargeBalancer.update_in_database(self.pool.session().connection, sample_ids)
+
+    def _get_existing_analytes(self, sample_ids):
+        '''returns the set of (SampleId, Param, SampFrac, Unit) already in the database for the sample ids'''
+        analytes = set()
+        sample_ids = list(sample_ids)
+        chunk_size = ChargeBalancer.samples_per_statement
+
+        for i in xrange(0, len(sample_ids), chunk_size):
+            chunk = sample_ids[i:i + chunk_size]
+            statement = self.sql['analytes'].format(','.join('?' * len(chunk)))
+
+            analytes.update(tuple(row) for row in self.pool.session().execute(statement, chunk).fetchall())
+
+        return analytes
+
+    def _get_analyte(self, row):
+        '''returns the (SampleId, Param, SampFrac, Unit) of a transformed result row'''
+        return tuple(row[i] for i in self.analyte_indices)
+
     def _get_files(self, location):
         '''Takes the file location and returns the csv's within it.'''
 
@@ -356,7 +841,8 @@ class WqpProgram(object):
 
         unique_sample_ids = query_csv(self.sql['distinct_sample_id'].format(self.fields['sample_id'], file_name),
                                       [file_path],
-                                      TEMPDB)
+                                      self.staging_db,
+                                      indices=[self.fields['sample_id']])
         if len(unique_sample_ids) > 0:
             #: remove header cell
             unique_sample_ids.pop(0)
@@ -377,7 +863,7 @@ class WqpProgram(object):
         if file_name:
             rows = query_csv(self.sql['wqxids'].format(self.fields['monitoring_location_id'], file_name),
                              [file_path],
-                             TEMPDB)
+                             self.staging_db)
             if len(rows) > 0:
                 rows.pop(0)
 
@@ -396,7 +882,7 @@ class WqpProgram(object):
         file_name = self._get_file_name_without_extension(file_path)
         samples_for_id = query_csv(self.sql['sample_id'].format(file_name, self.fields['sample_id'], sample_id_set[0]),
                                    [file_path],
-                                   TEMPDB)
+                                   self.staging_db)
 
         return self._etl_column_names(samples_for_id, config or self.result_config)
 
@@ -405,7 +891,7 @@ class WqpProgram(object):
         list of rows with the correct field names'''
 
         #: we have an already etl'd station. skip it.
-        if type(rows) is dict:
+        if isinstance(rows, (dict, Record)):
             return rows
 
         if len(rows) == 0:
@@ -415,21 +901,26 @@ class WqpProgram(object):
             #: get header cell from rows and remove
             header = rows.pop(0)
 
-        def return_value_if_not_in_config(key):
-            if key in config:
-                return config[key]
-
-            return key
-
-        header = map(lambda x: return_value_if_not_in_config(x), header)
+        header = self._get_field_names(header, config)
 
         #: if we are passing a single item, not an array of sets, don't map over it.
         #: this is when we have a station and not a set of results
-        if not isinstance(rows[0], tuple):
+        if not isinstance(rows[0], (tuple, list)):
             return dict(zip(header, rows))
 
         return map(lambda x: dict(zip(header, x)), rows)
 
+    def _get_field_names(self, header, config):
+        '''Given a csv header, return the field name for each column'''
+
+        def return_value_if_not_in_config(key):
+            if key in config:
+                return config[key]
+
+            return key
+
+        return map(lambda x: return_value_if_not_in_config(x), header)
+
     def _get_file_name_without_extension(self, file_path):
         '''Given a filename with an extension, the file name is returned without the extension.'''
 
@@ -438,67 +929,118 @@ class WqpProgram(object):
     def _update_row(self, row):
         '''Given a dictionary as a row, take the lat and long field, project it to UTM, and transform to WKT'''
 
-        template = 'geometry::STGeomFromText(\'POINT ({} {})\', 26912)'
+        return self._update_rows([row])[0]
 
-        row['DataSource'] = self.datasource
+    def _update_rows(self, rows):
+        '''Given a list of dictionaries, set the datasource and the WKT shape of every row
+        with a lat and long. The points are reprojected to UTM in one call.'''
 
-        x = row['Lon_X']
-        y = row['Lat_Y']
+        template = 'POINT ({} {})'
 
-        if not (x and y):
-            return row
+        points = []
+        for row in rows:
+            row['DataSource'] = self.datasource
 
-        if 'Shape' not in row:
-            return row
+            if 'Shape' in row and row['Lon_X'] and row['Lat_Y']:
+                points.append(row)
 
-        shape = Reproject.to_utm(x, y)
+        if not points:
+            return rows
 
-        row['Shape'] = template.format(shape[0], shape[1])
+        xs, ys = Reproject.to_utm_batch([row['Lon_X'] for row in points], [row['Lat_Y'] for row in points])
 
-        return row
+        #: tolist returns python floats so the WKT is formatted like a single point
+        for row, x, y in izip(points, xs.tolist(), ys.tolist()):
+            row['Shape'] = template.format(x, y)
 
-    def _insert_rows(self, rows, insert_statement):
-        '''Given a list of fields and an sql statement, execute the statement after `batch_size` number of statements'''
-        batch_size = 5000
+        return rows
 
-        if not hasattr(self, 'cursor') or not self.cursor:
-            c = pyodbc.connect(self.db['connection_string'])
-            self.cursor = c.cursor()
+    def _update_batch(self, batch):
+        '''_update_rows for a Batch'''
+        columns = batch.columns
+        columns['DataSource'] = [self.datasource] * len(batch)
 
-        i = 1
-        #: format and stage sql statements
-        for row in rows:
-            statement = insert_statement.format(','.join(row))
+        if 'Shape' not in columns:
+            return batch
 
-            try:
-                self.cursor.execute(statement)
-                i += 1
-            except Exception, e:
-                del self.cursor
-                raise e
+        points = [i for i, (x, y) in enumerate(izip(columns['Lon_X'], columns['Lat_Y'])) if x and y]
 
-            #: commit commands to database
-            if i % batch_size == 0:
-                self.cursor.commit()
+        if not points:
+            return batch
 
-            self.cursor.commit()
+        xs, ys = Reproject.to_utm_batch([columns['Lon_X'][i] for i in points], [columns['Lat_Y'][i] for i in points])
 
-    def _add_sample_index(self, filepath):
-        '''Add an index to ActivityIdentifier field for the table matching the file'''
-        with sqlite3.connect(TEMPDB) as conn:
-            conn.cursor().execute(self.sql['create_index'].format(basename(filepath)[:-4]))
+        shapes = columns['Shape']
+        for i, x, y in izip(points, xs.tolist(), ys.tolist()):
+            shapes[i] = 'POINT ({} {})'.format(x, y)
 
-    def _get_most_recent_result_date(self):
-        #: open connection if one hasn't been opened
-        if not hasattr(self, 'cursor') or not self.cursor:
-            c = pyodbc.connect(self.db['connection_string'])
-            self.cursor = c.cursor()
+        return batch
 
-        try:
-            last_updated = self.cursor.execute(self.sql['max_sample_date']).fetchone()
-        except Exception, e:
-            del self.cursor
-            raise e
+    def _insert_rows(self, rows, insert_statement):
+        '''Given a list of typed rows and an insert statement template, queue the rows with the
+        writer for the statement. The writer commits after `batch_size` rows or `byte_budget` bytes'''
+        self._get_writer(insert_statement).write(rows)
+
+    def _get_writer(self, insert_statement):
+        '''returns the writer for the insert statement template creating it if needed'''
+        if insert_statement in self.writers:
+            return self.writers[insert_statement]
+
+        #: held so a statement retried on a new connection does not close the writer's connection
+        connection = self.pool.session().hold()
+
+        if self.insert_mode == 'bulk':
+            writer = BulkFileSpooler(self.bulk_folder,
+                                     insert_statement,
+                                     loader=self.backend.get_bulk_loader(connection),
+                                     max_bytes=self.bulk_file_size,
+                                     lock=self.writer_lock,
+                                     auto_flush=self.manifest is None)
+        else:
+            writer = self.insert_modes[self.insert_mode](connection,
+                                                         insert_statement,
+                                                         parameters={'Shape': self.backend.sql['shape_parameter']},
+                                                         batch_size=self.batch_size,
+                                                         byte_budget=self.byte_budget,
+                                                         lock=self.writer_lock,
+                                                         auto_flush=self.manifest is None)
+        self.writers[insert_statement] = writer
+
+        return writer
+
+    def _flush_writers(self):
+        '''sends and commits any queued rows'''
+        for writer in self.writers.values():
+            writer.flush()
+
+    def _get_last_updated(self):
+        '''returns the end of the last successful update of this source. the first update of a database
+        starts from the most recent sample date instead
+        '''
+        state = self.backend.get_sync_state(self.pool.session().connection, self.datasource)
+
+        if state:
+            print('updating {} from the end of the last update {}'.format(self.datasource, state['WindowHi']))
+
+            return state['WindowHi']
+
+        return self._get_most_recent_result_date()
+
+    def _save_sync_state(self, window_start, window_end, result_rows, new_stations):
+        '''records the window and what was downloaded so the next update starts where this one ended'''
+        self.backend.save_sync_state(self.pool.session().connection, {
+            'DataSource': self.datasource,
+            'WindowLo': self._parse_date(window_start),
+            'WindowHi': window_end,
+            'Results': result_rows.rows_read,
+            #: the stations are only read when there are new ones
+            'Stations': new_stations.rows_read,
+            'Checksum': '{:016x}'.format(result_rows.checksum),
+            'UpdatedAt': datetime.now()
+        })
+
+    def _get_most_recent_result_date(self):
+        last_updated = self.pool.session().execute(self.backend.sql['max_sample_date']).fetchone()
 
         #: fetchone returns a set with one item
         if last_updated and len(last_updated) == 1:
@@ -506,30 +1048,44 @@ class WqpProgram(object):
 
     def _format_url(self, template, source, last_updated, today=None):
         date_format = '%m-%d-%Y'
-        lo = dateparser(last_updated).strftime(date_format)
+        lo = self._parse_date(last_updated).strftime(date_format)
         hi = datetime.now().strftime(date_format)
 
         if today:
-            hi = dateparser(today).strftime(date_format)
+            hi = self._parse_date(today).strftime(date_format)
 
         return template.format(source, lo, hi)
 
+    def _get_partition_urls(self, template, source, last_updated, today=None):
+        '''returns a url for each partition of `fetch_days` days from last_updated through today'''
+        lo = self._parse_date(last_updated).date()
+        hi = self._parse_date(today or datetime.now()).date()
+
+        return [self._format_url(template, source, start, end) for start, end in get_date_partitions(lo, hi, self.fetch_days)]
+
+    def _parse_date(self, value):
+        if isinstance(value, basestring):
+            return dateparser(value)
+
+        return value
+
     def _group_rows_by_id(self, cursor, config=None):
         '''groups samples by SampleId as they would be formatted by querycsv
         cursor: generator
         config: an optional config to setup the etl. mainly for testing
 
-        returns a dicionary with sample_id's as the key, with a list of rows as values
+        returns a dicionary with sample_id's as the key, with a list of ResultRecords as values
         '''
         unique_sample_ids = {}
 
         if not cursor:
             return
 
-        header = cursor.next()
+        #: a whole update is held in memory so keep the rows as records instead of dictionaries
+        header = self._get_field_names(cursor.next(), config or self.result_config)
 
         for row in cursor:
-            row = self._etl_column_names(row, config or self.result_config, header=header)
+            row = ResultRecord.from_row(header, row)
 
             sample_id = row['SampleId']
             if sample_id in unique_sample_ids:
@@ -557,9 +1113,7 @@ class WqpProgram(object):
 
                 unique_station_ids.add(station_id)
 
-        unique_station_ids = self._get_unique_station_ids(list(unique_station_ids))
-
-        return [id[0] for id in unique_station_ids]
+        return list(self._get_unique_station_ids(unique_station_ids))
 
     def _get_unique_station_ids(self, station_ids):
         '''queries the Stations table to find stations that have not been inserted yet
@@ -567,17 +1121,11 @@ class WqpProgram(object):
 
         returns a set of station ids
         '''
+        if self.key_cache:
+            #: the ids the cache does not have are checked in case another update added them since the sync
+            station_ids = self.key_cache.find_new('Stations', station_ids)
 
-        station_ids = map(lambda station_id: '(\'{}\')'.format(station_id), station_ids)
-
-        if not hasattr(self, 'cursor') or not self.cursor:
-            c = pyodbc.connect(self.db['connection_string'])
-            self.cursor = c.cursor()
-
-        statement = self.sql['new_stations'].format(','.join(station_ids))
-        self.cursor.execute(statement)
-
-        return self.cursor.fetchall()
+        return self.backend.find_new_ids(self.pool.session().connection, 'Stations', 'StationId', station_ids)
 
     def _extract_stations_by_id(self, cursor, station_ids, header):
         '''loops over a cursor of stations and returns the stations that have an id
@@ -592,12 +1140,15 @@ class WqpProgram(object):
             return
 
         stations_to_insert = []
+        found = set()
 
         for row in cursor:
             #: have to etl row to check station id
             row = self._etl_column_names(row, self.station_config, header=header)
 
-            if row['StationId'] in station_ids:
+            #: a station is in every partition of an update with one of its results
+            if row['StationId'] in station_ids and row['StationId'] not in found:
+                found.add(row['StationId'])
                 stations_to_insert.append(row)
 
         return stations_to_insert
@@ -620,8 +1171,12 @@ class WqpProgram(object):
         #: remove the wqx because the database does not store that value
         stripped_wqx = [re.sub(self.wqx_re, '-', id) for id in wqxs]
 
+        if self.key_cache:
+            #: a stripped id the cache has in either form is already in the database
+            stripped_wqx = self.key_cache.find_new(STRIPPED_STATIONS, stripped_wqx)
+
         #: get back the unique id's from the wqx subset
-        uniques = set([stripped[0] for stripped in self._get_unique_station_ids(stripped_wqx)])
+        uniques = self._get_unique_station_ids(stripped_wqx)
 
         #: remove the ids that are not in unique
         for id in station_ids:
@@ -631,20 +1186,13 @@ class WqpProgram(object):
         return station_ids
 
     def _remove_existing_results(self, results):
-        sample_ids = map(lambda sample_id: '(\'{}\')'.format(sample_id), results.keys())
-
-        unique_sample_ids = self._get_unique_sample_ids(sample_ids)
-        #: flatten list
-        unique_sample_ids = [item for iter_ in unique_sample_ids for item in iter_]
+        unique_sample_ids = self._get_unique_sample_ids(results.keys())
 
         return {key: results[key] for key in results if key in unique_sample_ids}
 
     def _get_unique_sample_ids(self, sample_ids):
-        if not hasattr(self, 'cursor') or not self.cursor:
-            c = pyodbc.connect(self.db['connection_string'])
-            self.cursor = c.cursor()
-
-        statement = self.sql['new_results'].format(','.join(sample_ids))
-        self.cursor.execute(statement)
+        '''returns the set of sample ids that are not in the Results table'''
+        if self.key_cache:
+            sample_ids = self.key_cache.find_new('Results', sample_ids)
 
-        return self.cursor.fetchall()
+        return self.backend.find_new_ids(self.pool.session().connection, 'Results', 'SampleId', sample_ids)
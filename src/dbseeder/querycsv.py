@@ -37,9 +37,21 @@ import os.path
 import getopt
 import csv
 import sqlite3
+from itertools import islice
 
 VERSION = "3.1.2"
 
+#: the number of csv rows inserted with each executemany
+CHUNK_SIZE = 10000
+
+#: the staging database is disposable so skip the journal and fsyncs and use a larger page cache
+STAGING_PRAGMAS = ["PRAGMA journal_mode = OFF",
+                   "PRAGMA synchronous = OFF",
+                   "PRAGMA cache_size = -131072",
+                   "PRAGMA temp_store = MEMORY"]
+
+CREATE_INDEX = "CREATE INDEX IF NOT EXISTS '{0}_{1}' ON '{1}' ('{0}' ASC)"
+
 log = logging.getLogger(__name__)
 log.setLevel(logging.CRITICAL)
 log.addHandler(logging.StreamHandler(sys.stderr))
@@ -98,26 +110,43 @@ def read_sqlfile(filename):
     return sqlcmds
 
 
-def csv_to_sqldb(db, filename, table_name):
-    dialect = csv.Sniffer().sniff(open(filename, "rt").readline())
-    reader = csv.reader(open(filename, "rt"), dialect)
-    column_names = reader.next()
-    colstr = ",".join("[{0}]".format(col) for col in column_names)
-    try:
-        db.execute("drop table %s;" % table_name)
-    except:
-        pass
-    db.execute("create table %s (%s);" % (table_name, colstr))
-    for row in reader:
-        params = zip(column_names, row)
-        insert_statement = ",".join(map(lambda t: "{0}{1}{0}".format("'", t[0]), params))
-        values = ",".join(map(lambda t: "?", params))
-        sql = "insert into {} ({}) VALUES ({});".format(table_name, insert_statement, values)
+def csv_to_sqldb(db, filename, table_name, indices=None, chunk_size=CHUNK_SIZE):
+    """
+    Bulk load the csv file into a new table with one prepared insert
+    statement executed over chunks of rows. The staging pragmas trade
+    durability for speed since the database can always be rebuilt from
+    the csv. `indices` are the column names to index once the rows are loaded.
+    """
+    with open(filename, "rt") as f:
+        dialect = csv.Sniffer().sniff(f.readline())
+
+    with open(filename, "rt") as f:
+        reader = csv.reader(f, dialect)
+        column_names = next(reader)
+        colstr = ",".join("[{0}]".format(col) for col in column_names)
+
+        for pragma in STAGING_PRAGMAS:
+            db.execute(pragma)
 
         try:
-            db.execute(sql, map(lambda t: unicode(t[1], 'utf8'), params))
-        except Exception as e:
-            raise e
+            db.execute("drop table %s;" % table_name)
+        except:
+            pass
+        db.execute("create table %s (%s);" % (table_name, colstr))
+
+        values = ",".join("?" * len(column_names))
+        sql = "insert into {} ({}) values ({});".format(table_name, colstr, values)
+
+        rows = (_decode_row(row, len(column_names)) for row in reader)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            db.executemany(sql, chunk)
+
+        for column in indices or []:
+            db.execute(CREATE_INDEX.format(column, table_name))
     db.commit()
 
     # Mark CSV as imported
@@ -131,6 +160,18 @@ def csv_to_sqldb(db, filename, table_name):
         log.exception(ex)
 
 
+def _decode_row(row, width):
+    """
+    Decode the utf8 cells of a csv row. Short rows are padded with nulls to
+    match the width of the header.
+    """
+    values = [cell.decode('utf8') for cell in row]
+    if len(values) < width:
+        values.extend([None] * (width - len(values)))
+
+    return values[:width]
+
+
 def execute_sql(conn, sqlcmds):
     """
     Parameters
@@ -166,10 +207,11 @@ def query_sqlite_file(scriptfile, sqlfilename=None):
         return execute_sql(conn, cmds)
 
 
-def query_csv(sqlcmd, infilenames, file_db=None):
+def query_csv(sqlcmd, infilenames, file_db=None, indices=None):
     """
     Query the listed CSV files, optionally writing the output to a
-    sqlite file on disk.
+    sqlite file on disk. `indices` are the columns to index when a
+    CSV is imported.
     """
     database = file_db if file_db else ':memory:'
     with sqlite3.connect(database) as conn:
@@ -179,7 +221,7 @@ def query_csv(sqlcmd, infilenames, file_db=None):
             tablename = get_tablename(csvfile)
             mtime = str(os.path.getmtime(csvfile))
             if filetimes.get(tablename, None) != mtime:
-                csv_to_sqldb(conn, csvfile, tablename)
+                csv_to_sqldb(conn, csvfile, tablename, indices)
         # Execute the SQL
         results = execute_sql(conn, [sqlcmd])
     return results
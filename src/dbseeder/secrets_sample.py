@@ -9,3 +9,8 @@ stage = {
 prod = {
     'connection_string': 'DRIVER={SQL Server};SERVER=localhost;DATABASE=testdb;UID=me;PWD=pass',
 }
+
+local = {
+    'backend': 'sqlite',
+    'path': 'ugs.sqlite3',
+}
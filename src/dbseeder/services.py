@@ -7,15 +7,30 @@ services.py
 modules for acting on items
 '''
 
-import datetime
+import codecs
+import numpy
 import re
 import schema
+import tempfile
+import zipfile
 from collections import OrderedDict
-from csv import reader as csvreader
-from dateutil.parser import parse
-from models import Concentration
+from itertools import izip
+from csv import reader as csvreader, DictReader
+from dates import DateParser
+from models import Batch, Concentration, MISSING, Record
+from os.path import join, dirname
 from pyproj import Proj, transform
 from requests import get
+try:
+    from pyproj import Transformer
+except ImportError:
+    #: pyproj < 2.1 creates its transformations when they are used
+    Transformer = None
+
+NORMALIZATION_RULES = join(dirname(__file__), 'normalization.csv')
+
+#: the number of bytes to read from a response at a time
+DEFAULT_CHUNK_SIZE = 64 * 1024
 
 
 class Reproject(object):
@@ -24,6 +39,9 @@ class Reproject(object):
     input_system = Proj(init='epsg:4326')
     ouput_system = Proj(init='epsg:26912')
 
+    #: building a transformation is much slower than using one so it is built once
+    transformer = Transformer.from_proj(input_system, ouput_system) if Transformer else None
+
     @classmethod
     def to_utm(cls, x, y):
         '''reproject x and y from 4326 to 26912'''
@@ -31,121 +49,231 @@ class Reproject(object):
         if x > 0:
             x = x * -1
 
+        return cls._transform(x, y)
+
+    @classmethod
+    def to_utm_batch(cls, xs, ys):
+        '''reproject sequences of x and y from 4326 to 26912 in one call
+
+        returns a tuple of numpy arrays (x, y)
+        '''
+        #: longitudes in utah are always west
+        xs = -numpy.abs(numpy.asarray(xs, dtype=numpy.float64))
+        ys = numpy.asarray(ys, dtype=numpy.float64)
+
+        return cls._transform(xs, ys)
+
+    @classmethod
+    def _transform(cls, x, y):
+        if cls.transformer is not None:
+            return cls.transformer.transform(x, y)
+
         return transform(cls.input_system, cls.ouput_system, x, y)
 
 
 class Caster(object):
     '''A utility class for casting data to its defined schema type'''
 
+    #: {id(schema): CompiledCaster}
+    compiled = {}
+
+    #: parses the dates of this run. dates after the run started are None
+    dates = DateParser()
+
     @classmethod
     def cast(cls, row, schema):
         '''Given a {string, string} dictionary (row) and the schema
         for the row (result or station) a new {string, string} dictionary
         (row) is returned with the values properly formatted.
         '''
-        for field in schema.iteritems():
-            cast = None
-            #: if the value is not in the csv skip it
-            try:
-                value = row[field[0]]
-            except KeyError:
-                row[field[0]] = None
-                continue
+        return cls.compile(schema).cast(row)
 
-            #: try to remove all whitespace from strings
-            try:
-                value = value.strip()
-            except:
-                pass
-
-            if field[1]['type'] == 'String':
-                cast = str
-            elif field[1]['type'] == 'Long Int':
-                cast = long
-            elif field[1]['type'] == 'Short Int':
-                cast = int
-            elif field[1]['type'] == 'Double':
-                cast = float
-            elif field[1]['type'] == 'Date':
-                if isinstance(value, datetime.datetime):
-                    cast = lambda x: x
-                elif value == '':
-                    row[field[0]] = None
-                    continue
-                else:
-                    cast = parse
-            elif field[1]['type'] == 'Time':
-                if isinstance(value, datetime.time):
-                    cast = lambda x: x
-                elif value == '':
-                    row[field[0]] = None
-                    continue
-                else:
-                    cast = lambda x: datetime.time(*map(int, x.split(':')))
+    @classmethod
+    def cast_batch(cls, batch, schema):
+        '''Given a Batch and the schema for its rows, the columns
+        of the batch are replaced with the cast values.
+        '''
+        return cls.compile(schema).cast_batch(batch)
 
-            try:
-                value = cast(value)
-                if isinstance(value, datetime.datetime) and value > datetime.datetime.now():
-                    value = None
-            except:
-                row[field[0]] = None
-                continue
+    @classmethod
+    def compile(cls, schema):
+        '''returns the CompiledCaster for the schema building it the first time the schema is seen'''
+        caster = cls.compiled.get(id(schema))
 
-            if value == '':
-                row[field[0]] = None
-                continue
+        #: the caster keeps a reference to its schema so the id can not be reused
+        if caster is None or caster.schema is not schema:
+            caster = cls.compiled[id(schema)] = CompiledCaster(schema, cls.dates)
+
+        return caster
 
-            try:
-                if field[1]['length']:
-                    value = value[:field[1]['length']]
-            except KeyError:
-                pass
-            except TypeError:
-                #: you can't trim a datetime object
-                #: but it has a length for some reason?
-                pass
 
+def _strip(value):
+    '''strips strings and returns None for empty ones'''
+    if isinstance(value, basestring):
+        value = value.strip()
+
+        if value == '':
+            return None
+
+    return value
+
+
+def _to_string(length):
+    def convert(value):
+        if isinstance(value, str):
+            value = value.strip()
+        elif isinstance(value, unicode):
             try:
-                if field[1]['actions']:
-                    for action in field[1]['actions']:
-                        value = locals()[action](value)
-            except KeyError:
-                pass
+                value = str(value.strip())
+            except UnicodeError:
+                return None
+        else:
+            value = str(value)
 
-            row[field[0]] = value
+        if value == '':
+            return None
 
-        return row
+        if length:
+            return value[:length]
 
-    @classmethod
-    def cast_for_sql(cls, row):
-        '''
-        Format the values for the sql insert statement
+        return value
+
+    return convert
+
+
+def _to_number(number_type):
+    def convert(value):
+        value = _strip(value)
+
+        if value is None:
+            return None
+
+        try:
+            return number_type(value)
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+    return convert
+
+
+def _to_none(value):
+    return None
+
+
+class CompiledCaster(object):
+    '''Casts rows for one schema with the converter for each field chosen once.
+    Values that can not be cast, empty strings and dates in the future become None.
+    Types without a converter, e.g. Geometry, are always None.
+    '''
+
+    converters = {
+        'String': _to_string,
+        'Long Int': lambda length: _to_number(long),
+        'Short Int': lambda length: _to_number(int),
+        'Double': lambda length: _to_number(float)
+    }
+
+    def __init__(self, schema, dates=None):
+        '''schema - the schema to cast rows to
+        dates - the DateParser for Date and Time fields
         '''
+        super(CompiledCaster, self).__init__()
 
-        for key in row.keys():
-            value = row[key]
-            if key == 'Shape':
-                continue
-            elif isinstance(value, basestring):
-                new_value = "'{}'".format(value.replace('\'', '\'\''))
-            elif isinstance(value, datetime.datetime):
-                try:
-                    new_value = 'Cast(\'{}\' as datetime)'.format(value.strftime('%Y-%m-%d'))
-                except ValueError:
-                    #: year is before 1900
-                    iso = value.isoformat()
-                    date_string = iso.strip().split('T')[0]
-                    new_value = 'Cast(\'{}\' as datetime)'.format(date_string)
-            elif isinstance(value, datetime.time):
-                new_value = "'{}'".format(str(value))
-            elif value is None:
-                new_value = 'Null'
+        self.schema = schema
+        self.fields = []
+
+        dates = dates or DateParser()
+        converters = dict(self.converters, **{
+            'Date': lambda length: dates.parse_date,
+            'Time': lambda length: dates.parse_time
+        })
+
+        for name, field in schema.iteritems():
+            converter = converters.get(field['type'], lambda length: _to_none)
+
+            self.fields.append((name, converter(field.get('length'))))
+
+    def cast(self, row):
+        '''casts the values of the row in place. fields missing from the row are set to None'''
+        for name, convert in self.fields:
+            if name in row:
+                row[name] = convert(row[name])
             else:
-                new_value = str(value)
-            row[key] = new_value
+                row[name] = None
 
         return row
 
+    def cast_batch(self, batch):
+        '''casts the columns of the batch one at a time. fields missing from the rows are set to None'''
+        for name, convert in self.fields:
+            column = batch.columns.get(name)
+
+            if column is None:
+                batch.columns[name] = [None] * batch.count
+            else:
+                batch.columns[name] = [None if value is MISSING else convert(value) for value in column]
+
+        return batch
+
+
+class NormalizationRules(object):
+    '''The chemical and unit conversions for results read from a csv with the columns
+    chemical, unit, conversion_rate, new_param and new_unit. A chemical is matched in lower case
+    and the unit exactly. The first row for a chemical and unit wins. A blank conversion_rate
+    leaves the value alone and a blank new_param keeps the lower case chemical.
+    '''
+
+    #: the number of distinct (chemical, unit) pairs to remember before starting over
+    memo_size = 10000
+
+    def __init__(self, path=NORMALIZATION_RULES, paramgroup=None):
+        '''path - the rules csv
+        paramgroup - {param: paramgroup} for the normalized params
+        '''
+        super(NormalizationRules, self).__init__()
+
+        self.rules = {}
+        self.memo = {}
+
+        paramgroup = paramgroup or {}
+
+        with open(path, 'rb') as f:
+            for row in DictReader(f):
+                key = (row['chemical'].lower(), row['unit'])
+                if key in self.rules:
+                    continue
+
+                new_param = row['new_param'] or key[0]
+                conversion_rate = None
+                if row['conversion_rate']:
+                    conversion_rate = _to_rate(row['conversion_rate'])
+
+                self.rules[key] = (conversion_rate, new_param, row['new_unit'], paramgroup.get(new_param))
+
+    def get(self, chemical, unit):
+        '''returns (conversion_rate, new_param, new_unit, paramgroup) or None if the values are left alone'''
+        key = (chemical, unit)
+
+        try:
+            return self.memo[key]
+        except KeyError:
+            pass
+
+        if len(self.memo) >= self.memo_size:
+            self.memo = {}
+
+        rule = self.memo[key] = self.rules.get((chemical.lower(), unit))
+
+        return rule
+
+
+def _to_rate(value):
+    '''whole numbers stay integers like they were in the original conversions'''
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
 
 class Normalizer(object):
     '''class for handling the normalization of fields'''
@@ -218,6 +346,8 @@ class Normalizer(object):
 
     paramgroup = dict(zip(p, q))
 
+    rules = NormalizationRules(paramgroup=paramgroup)
+
     wqx_re = re.compile('(_WQX)-')
 
     @classmethod
@@ -239,146 +369,60 @@ class Normalizer(object):
         if chemical is None:
             return row
 
-        def calculate_amount(amount, conversion_rate):
-            if amount is None:
-                return None
-            elif not amount:
-                return 0
-
-            return amount * conversion_rate
-
-        def calculate_paramgroup(chemical):
-            if chemical in cls.paramgroup:
-                paramgroup = cls.paramgroup[chemical]
-                return paramgroup
-
-        inorganics_major_metals = ['calcium', 'dissolved calcium', 'dissolved magnesium', 'dissolved potassium', 'dissolved sodium', 'magnesium', 'potassium', 'sodium', 'sodium adsorption ratio',  # noqa
-                                   'sodium adsorption ratio [(na)/(sq root of 1/2 ca + mg)]', 'sodium plus potassium', 'sodium, percent total cations', 'total calcium', 'total magnesium', 'total potassium', 'total sodium', 'percent sodium', 'hypochlorite ion']  # noqa
-        inorganics_major_nonmetals = ['acidity as caco3', 'alkalinity', 'alkalinity, bicarbonate as caco3', 'alkalinity, carbonate as caco3', 'alkalinity, hydroxide as caco3', 'alkalinity, phenolphthalein (total hydroxide+1/2 carbonate)', 'alkalinity, total', 'alkalinity, total as caco3', 'bicarbonate', 'bicarbonate as caco3', 'bicarbonate as hco3', 'bromide', 'carbon dioxide', 'carbonate', 'carbonate (co3)', 'carbonate as caco3', 'carbonate as co3', 'chloride', 'chlorine', 'dissolved oxygen (do)', 'dissolved oxygen (field)', 'dissolved oxygen saturation', 'fluoride', 'fluorine', 'gran acid neutralizing capacity',  # noqa
-                                      'hydrogen', 'hydrogen ion', 'hydroxide', 'inorganic carbon', 'oxygen', 'silica', 'silicon', 'sulfate', 'sulfide', 'sulfur', 'total alkalinity as caco3', 'total carbon', 'silica d/sio2', 't. alk/caco3', 'alkalinity as cac03', 'silica, dis. si02', 'carbon, total', 'chlorine dioxide', 'chlorite', 'residual chlorine', 'hydroxide as calcium carbonate', 'hydrogen sulfide', 'alkalinity, caco3 stability', 'acidity, total (caco3)', 'acidity, m.o. (caco3)', 'alkalinity, bicarbonate', 'alkalinity, carbonate', 'alkalinity, phenolphthalein', 'total chlorine', 'combined chlorine', 'perchlorate', 'free residual chlorine']  # noqa
-        inorganics_minor_nonmetals = ['antimony', 'argon', 'arsenate (aso43-)', 'arsenic', 'arsenite', 'boron', 'bromine', 'cyanide', 'cyanides amenable to chlorination (hcn & cn)', 'dissolved arsenic', 'dissolved boron', 'dissolved selenium',  # noqa
-                                      'germanium', 'helium', 'iodide', 'krypton', 'neon', 'perchlorate', 'selenium', 'sulfur hexafluoride', 'tellurium', 'total arsenic', 'total boron', 'total selenium', 'xenon', 'chlorate', 'antimony, total', 'boron, total', 'asbestos']  # noqa
-        inorganics_minor_metals = ['aluminum', 'barium', 'beryllium', 'bismuth', 'cadmium', 'cerium', 'cesium', 'chromium', 'chromium(iii)', 'chromium(vi)', 'cobalt', 'copper', 'dissolved aluminum', 'dissolved barium', 'dissolved cadmium', 'dissolved chromium', 'dissolved copper', 'dissolved iron', 'dissolved lead', 'dissolved manganese', 'dissolved mercury', 'dissolved molybdenum', 'dissolved nickel', 'dissolved zinc', 'dysprosium', 'erbium', 'europium', 'gadolinium', 'gallium', 'holmium', 'iron', 'iron, ion (fe2+)', 'lanthanum', 'lead', 'lithium', 'lutetium', 'manganese', 'mercury', 'molybdenum', 'neodymium', 'nickel', 'niobium', 'praseodymium', 'rhenium', 'rubidium', 'samarium', 'scandium', 'silver',  # noqa
-                                   'strontium', 'terbium', 'thallium', 'thulium', 'tin', 'titanium', 'total aluminum', 'total barium', 'total cadmium', 'total chromium', 'total copper', 'total iron', 'total iron-d max, dmr', 'total lead', 'total manganese', 'total mercury', 'total molybdenum', 'total nickel', 'total zinc', 'tungsten', 'vanadium', 'ytterbium', 'yttrium', 'zinc', 'zirconium', 'iron, dissolved', 'chromium, hex, as cr', 'copper, free', 'iron, suspended', 'manganese, suspended', 'beryllium, total', 'bismuth, total', 'chromium, hex', 'cobalt, total', 'lithium, total', 'molybdenum, total', 'thallium, total', 'tin, total', 'titanium, total', 'vanadium, total', 'lead summary', 'copper summary', 'manganese, dissolved']   # noqa
-        nutrient = ['ammonia', 'ammonia and ammonium', 'ammonia as n', 'ammonia as nh3', 'ammonia-nitrogen', 'ammonia-nitrogen as n', 'ammonium', 'ammonium as n', 'dissolved nitrate: no3', 'inorganic nitrogen (nitrate and nitrite)', 'inorganic nitrogen (nitrate and nitrite) as n', 'kjeldahl nitrogen', 'nitrate', 'nitrate as n', 'nitrate-nitrogen', 'nitrite', 'nitrite as n', 'nitrogen', 'orthophosphate', 'nitrogen, ammonium/ammonia ratio', 'dissolved nitrite: no2', 'nitrogen, mixed forms (nh3), (nh4), organic, (no2) and (no3)',  # noqa
-                    'no2+no3 as n', 'organic nitrogen', 'ortho. phosphate', 'orthophosphate as p', 'phosphate', 'phosphate-phosphorus', 'phosphate-phosphorus as p', 'phosphate-phosphorus as po4', 'phosphorus', 'total phosphorus', 'nitrate + nitrite as n', 'phosphate, tot. dig. (as p)', 't.k.n.', 'phosphorus 0 as p', 'nitrogen-ammonia as (n)', 'nitrate-nitrite', 'phosphate, total', 'total kjeldahl nitrogen (in water mg/l)', 'phosphorus, soluble', 'phosphate, reactive', 'phosphorus, total']  # noqa
-
-        chemical = chemical.lower()
-        milli_per_liter = new_unit = 'mg/l'
-        conversion_rate = None
-
-        if (chemical in inorganics_major_metals or chemical in inorganics_major_nonmetals) and unit == 'ug/l':
-            conversion_rate = 0.001
-        elif ((chemical in inorganics_minor_metals or chemical in inorganics_minor_nonmetals) and
-              unit == milli_per_liter):
-            conversion_rate = 1000
-            new_unit = 'ug/l'
-        elif chemical in nutrient and unit == 'ug/l':
-            conversion_rate = 0.001
-        elif chemical == 'nitrate' and unit == 'mg/l as n':
-            conversion_rate = 4.426802887
-        elif chemical == 'nitrite' and unit == 'mg/l as n':
-            conversion_rate = 3.284535258
-        elif chemical == 'phosphate' and unit == 'mg/l as p':
-            conversion_rate = 3.131265779
-        elif chemical == 'carbonate as caco3' and unit == milli_per_liter:
-            conversion_rate = 0.60
-            chemical = 'Carbonate'
-        elif ((chemical == 'bicarbonate as caco3' and (unit == milli_per_liter or unit == 'mg/l as caco3')) or
-              (chemical == 'alkalinity, bicarbonate as caco3' and unit == milli_per_liter)):
-            conversion_rate = 1.22
-            chemical = 'Bicarbonate'
-        elif chemical == 'alkalinity, carbonate' and unit == 'mg/l as caco3':
-            conversion_rate = 0.60
-            chemical = 'Carbonate'
-        elif (chemical == 'carbonate as co3' or chemical == 'carbonate (co3)') and unit == milli_per_liter:
-            chemical = 'Carbonate'
-        elif chemical == 'bicarbonate as hco3' and unit == milli_per_liter:
-            chemical = 'Bicarbonate'
-        elif chemical == 'alkalinity, carbonate as caco3' and unit == 'mg/l as caco3':
-            conversion_rate = 0.60
-            chemical = 'Carbonate based on alkalinity'
-        elif (((chemical == 'alkalinity, bicarbonate' or chemical == 'alkalinity') and unit == 'mg/l as caco3') or
-              ((chemical == 't.alk/caco3' or chemical == 'total alkalinity as caco3') and unit == milli_per_liter)):
-            conversion_rate = 1.22
-            chemical = 'Bicarbonate based on alkalinity'
-        elif chemical == 'bicarbonate' and unit == 'mg/l as caco3':
-            conversion_rate = 1.22
-        elif chemical == 'phosphate-phosphorus' and (unit == 'mg/l as p' or unit == milli_per_liter):
-            conversion_rate = 3.131265779
-            chemical = 'Phosphate'
-        elif chemical == 'sulfate as s' and unit == milli_per_liter:
-            conversion_rate = 0.333792756
-            chemical = 'Sulfate'
-        elif ((chemical == 'nitrate-nitrogen' and unit == 'mg/l as n') or
-              (chemical == 'nitrate as n' and (unit == 'mg/l as n' or unit == milli_per_liter))):
-            conversion_rate = 4.426802887
-            chemical = 'Nitrate'
-        elif chemical == 'nitrate-nitrogen' and unit == milli_per_liter:
-            conversion_rate = 4.426802887
-            chemical = 'Nitrite'
-        elif chemical == 'nitrite as n' and (unit == 'mg/l as n' or unit == milli_per_liter):
-            conversion_rate = 3.284535258
-            chemical = 'Nitrite'
-        elif ((chemical == 'nitrate-nitrite' or
-               chemical == 'inorganic nitrogen (nitrate and nitrite) as n' or
-               chemical == 'nitrate + nitrate as n' or
-               chemical == 'no2+no3 as n') and
-              (unit == 'mg/l as n' or unit == milli_per_liter)):
-            conversion_rate = 4.426802887
-            chemical = 'Nitrate and nitrite as NO3'
-        elif ((chemical == 'phosphate-phosphorus as p' and unit == 'mg/l as p') or
-              (chemical == 'orthophosphate as p' and unit == 'mg/l as p') or
-              (chemical == 'phosphate-phosphorus as p' and unit == milli_per_liter) or
-              (chemical == 'orthophosphate as p' and unit == milli_per_liter) or
-              (chemical == 'orthophosphate' and unit == 'mg/l as p')):
-            conversion_rate = 3.131265779
-            chemical = 'Phosphate'
-        elif chemical == 'ammonia and ammonium' and unit == 'mg/l nh4':
-            conversion_rate = 1.05918619
-            chemical = 'Ammonia'
-        elif ((chemical == 'ammonia-nitrogen as n' and unit == 'mg/l as n') or
-              (chemical == 'ammonia-nitrogen' and unit == 'mg/l as n') or
-              (chemical == 'ammonia-nitrogen as n' and unit == milli_per_liter) or
-              (chemical == 'ammonia-nitrogen' and unit == milli_per_liter) or
-              (chemical == 'ammonia' and unit == 'mg/l as n')):
-            conversion_rate = 1.21587526
-            chemical = 'Ammonia'
-        elif chemical == 'specific conductance' and unit == 'ms/cm':
-            conversion_rate = 1000
-            new_unit = 'uS/cm'
-        elif chemical == 'specific conductance' and unit == 'umho/cm':
-            new_unit = 'uS/cm'
-        elif chemical == 'calcium' and unit == 'ueq/l':
-            conversion_rate = 20.039
-        elif chemical == 'magnesium' and unit == 'ueq/l':
-            conversion_rate = 12.1525
-        elif chemical == 'potassium' and unit == 'ueq/l':
-            conversion_rate = 39.0983
-        elif chemical == 'sodium' and unit == 'ueq/l':
-            conversion_rate = 22.9897
-        elif chemical == 'nitrate' and unit == 'ueq/l':
-            conversion_rate = 62.0049
-        elif chemical == 'chloride' and unit == 'ueq/l':
-            conversion_rate = 35.453
-        elif chemical == 'hydroxide' and unit == 'ueq/l':
-            conversion_rate = 17.0073
-        elif chemical == 'sulfate' and unit == 'ueq/l':
-            conversion_rate = 24.01565
-        else:
+        rule = cls.rules.get(chemical, unit)
+
+        if rule is None:
             return row
 
-        row['Param'] = chemical
-        row['Unit'] = new_unit
+        conversion_rate, row['Param'], row['Unit'], paramgroup = rule
+
         if conversion_rate is not None:
-            row['ResultValue'] = calculate_amount(row['ResultValue'], conversion_rate)
+            row['ResultValue'] = cls.calculate_amount(row['ResultValue'], conversion_rate)
 
-        pgroup = calculate_paramgroup(chemical)
-        if pgroup:
-            row['ParamGroup'] = pgroup
+        if paramgroup:
+            row['ParamGroup'] = paramgroup
 
         return row
 
+    @classmethod
+    def normalize_batch(cls, batch):
+        '''normalize_sample for every row of a Batch of results'''
+        columns = batch.columns
+        columns['StationId'] = map(cls.strip_wxp, columns['StationId'])
+
+        units = columns['Unit']
+        values = columns['ResultValue']
+        paramgroups = columns['ParamGroup']
+        params = columns['Param']
+
+        for i, chemical in enumerate(params):
+            if chemical is None:
+                continue
+
+            rule = cls.rules.get(chemical, units[i])
+
+            if rule is None:
+                continue
+
+            conversion_rate, params[i], units[i], paramgroup = rule
+
+            if conversion_rate is not None:
+                values[i] = cls.calculate_amount(values[i], conversion_rate)
+
+            if paramgroup:
+                paramgroups[i] = paramgroup
+
+        return batch
+
+    @staticmethod
+    def calculate_amount(amount, conversion_rate):
+        if amount is None:
+            return None
+        elif not amount:
+            return 0
+
+        return amount * conversion_rate
+
     @classmethod
     def normalize_station(cls, row):
         '''strip wxp
@@ -395,6 +439,10 @@ class Normalizer(object):
 
     @classmethod
     def reorder_filter(cls, row, schema):
+        #: records already hold only the schema fields in insert order
+        if isinstance(row, Record) and row.schema is schema:
+            return row
+
         new_row = OrderedDict()
         for field in schema:
             new_row[field] = row[field]
@@ -417,6 +465,18 @@ class ChargeBalancer(object):
                     'no2': 0.021736513,
                     'no3': 0.016129032}
 
+    #: the column of each ion in the batch arrays
+    _ions = ['ca', 'mg', 'na', 'k', 'na+k', 'cl', 'hco3', 'co3', 'so4', 'no2', 'no3']
+
+    #: {lower case chemical: ion} for the chemicals a Concentration tracks
+    _chemical_ions = dict([(ion, ion) for ion in _ions] + Concentration().chemical_map.items())
+
+    #: the param and unit of the rows made for a charge balance
+    balance_params = [('Charge Balance', '%'), ('Cation Total', 'meq/l'), ('Anions Total', 'meq/l')]
+
+    #: the number of SampleIds balanced by one statement. sqlite before 3.32 allows 999 parameters
+    samples_per_statement = 900
+
     @classmethod
     def calculate_charge_balance(cls, concentration, sampleId):
         calcium = cls._conversions['ca'] * (concentration.calcium or 0)
@@ -478,20 +538,294 @@ class ChargeBalancer(object):
         else:
             return []
 
+    @classmethod
+    def get_charge_balance_batch(cls, batch):
+        '''returns a Batch of the charge balance rows for each set of results in the batch.
+        The concentrations of every set are summed into arrays of sets by ions and balanced
+        at once with the same arithmetic, in the same order, as get_charge_balance.
+        '''
+        balances = Batch(batch.fields)
+
+        if not batch.sets:
+            return balances
+
+        ions = cls._get_ion_indices(batch.columns['Param'])
+        values = batch.columns['ResultValue']
+        detect_conds = batch.columns['DetectCond']
+        sets = numpy.repeat(numpy.arange(len(batch.sets)), [stop - start for start, stop in batch.sets])
+
+        #: the rows a Concentration would keep
+        rows = [i for i, ion in enumerate(ions) if ion is not None and values[i] is not None and not detect_conds[i]]
+
+        sums = numpy.zeros((len(batch.sets), len(cls._ions)))
+        counts = numpy.zeros((len(batch.sets), len(cls._ions)), dtype=numpy.int64)
+
+        if rows:
+            cells = (sets[rows], numpy.array([ions[i] for i in rows]))
+
+            #: add.at sums repeated cells in row order like the sum of a Concentration list
+            numpy.add.at(sums, cells, numpy.array([values[i] for i in rows], dtype=numpy.float64))
+            numpy.add.at(counts, cells, 1)
+
+        present = counts > 0
+        amounts = numpy.where(present, sums / numpy.maximum(counts, 1), 0)
+
+        def amount(ion):
+            return amounts[:, cls._ions.index(ion)]
+
+        def has(ion):
+            return present[:, cls._ions.index(ion)]
+
+        def convert(ion, values):
+            #: adding 0.0 turns -0.0 into 0 like `amount or 0` does
+            return cls._conversions[ion] * (values + 0.0)
+
+        #: infinite and nan amounts give infinite and nan results like they do in python
+        with numpy.errstate(all='ignore'):
+            #: the na, k and na+k rules of the Concentration properties
+            sodium = numpy.where(~has('na') & has('na+k') & has('k'), amount('na+k') - amount('k'), amount('na'))
+            potassium = numpy.where(~has('k') & has('na+k') & has('na'), amount('na+k') - amount('na'), amount('k'))
+            sodium_plus_potassium = numpy.where(has('na+k') & has('na') | has('k'), 0, amount('na+k'))
+
+            cation = (convert('ca', amount('ca')) + convert('mg', amount('mg')) + convert('na', sodium) +
+                      convert('k', potassium) + convert('na+k', sodium_plus_potassium))
+            anion = (convert('cl', amount('cl')) + convert('hco3', amount('hco3')) + convert('co3', amount('co3')) +
+                     convert('so4', amount('so4')) + convert('no3', amount('no3')) + convert('no2', amount('no2')))
+
+            total = cation + anion
+            balance = numpy.where(total == 0, 0, 100 * ((cation - anion) / numpy.where(total == 0, 1, total)))
+
+        major = (has('ca') & has('mg') & has('cl') & has('hco3') & has('so4') &
+                 (has('na') | has('k') | has('na+k')))
+
+        balanced = numpy.flatnonzero(major)
+        sample_ids = [batch.columns['SampleId'][batch.sets[i][0]] for i in balanced.tolist()]
+
+        #: three rows per set like calculate_charge_balance
+        balances.append_columns({
+            'SampleId': [sample_id for sample_id in sample_ids for row in xrange(3)],
+            'Param': ['Charge Balance', 'Cation Total', 'Anions Total'] * len(sample_ids),
+            'ResultValue': [round(value, 2)
+                            for totals in izip(balance[balanced].tolist(), cation[balanced].tolist(), anion[balanced].tolist())
+                            for value in totals],
+            'Unit': ['%', 'meq/l', 'meq/l'] * len(sample_ids)
+        })
+
+        return balances
+
+    @classmethod
+    def get_balance_sql(cls, table='Results', samples=0):
+        '''returns {'delete': statement, 'insert': statement} to replace the charge balance rows of
+        every sample in the table with ones computed by the database. Duplicate chemicals are averaged
+        and the na, k and na+k rules of Concentration are applied in sql.
+        samples - limit the statements to this many SampleIds given as parameters. 0 is every sample
+        '''
+        def quote(value):
+            return "'{}'".format(value.replace("'", "''"))
+
+        def column(ion):
+            return ion.replace('+', '')
+
+        ions = ' '.join('WHEN {} THEN {}'.format(quote(chemical), quote(ion))
+                        for chemical, ion in sorted(cls._chemical_ions.iteritems()))
+        averages = ', '.join('AVG(CASE WHEN ion = {} THEN ResultValue END) AS {}'.format(quote(ion), column(ion))
+                             for ion in cls._ions)
+
+        amounts = {ion: 'COALESCE({}, 0)'.format(column(ion)) for ion in cls._ions}
+        amounts['na'] = 'COALESCE(CASE WHEN na IS NULL AND nak IS NOT NULL AND k IS NOT NULL THEN nak - k ELSE na END, 0)'
+        amounts['k'] = 'COALESCE(CASE WHEN k IS NULL AND nak IS NOT NULL AND na IS NOT NULL THEN nak - na ELSE k END, 0)'
+        amounts['na+k'] = 'COALESCE(CASE WHEN nak IS NOT NULL AND na IS NOT NULL OR k IS NOT NULL THEN 0 ELSE nak END, 0)'
+
+        def total(ions):
+            return ' + '.join('{} * {}'.format(repr(cls._conversions[ion]), amounts[ion]) for ion in ions)
+
+        params = ' UNION ALL '.join('SELECT {} AS n, {} AS Param, {} AS Unit'.format(i, quote(param), quote(unit))
+                                    for i, (param, unit) in enumerate(cls.balance_params))
+
+        is_balance = '({})'.format(' OR '.join('(Param = {} AND Unit = {})'.format(quote(param), quote(unit))
+                                               for param, unit in cls.balance_params))
+
+        in_samples = ''
+        if samples:
+            in_samples = ' AND SampleId IN ({})'.format(','.join('?' * samples))
+
+        insert = ('INSERT INTO {table} (SampleId, Param, ResultValue, Unit) '
+                  'SELECT t.SampleId, p.Param, ROUND(CASE p.n '
+                  'WHEN 0 THEN CASE WHEN t.cation + t.anion = 0 THEN 0 ELSE 100 * ((t.cation - t.anion) / (t.cation + t.anion)) END '
+                  'WHEN 1 THEN t.cation ELSE t.anion END, 2), p.Unit '
+                  'FROM (SELECT SampleId, {cation} AS cation, {anion} AS anion '
+                  'FROM (SELECT SampleId, {averages} '
+                  'FROM (SELECT SampleId, ResultValue, CASE LOWER(Param) {ions} END AS ion '
+                  'FROM {table} WHERE ResultValue IS NOT NULL AND (DetectCond IS NULL OR DetectCond = \'\'){in_samples}) r '
+                  'WHERE ion IS NOT NULL GROUP BY SampleId) a '
+                  'WHERE ca IS NOT NULL AND mg IS NOT NULL AND cl IS NOT NULL AND hco3 IS NOT NULL AND so4 IS NOT NULL '
+                  'AND (na IS NOT NULL OR k IS NOT NULL OR nak IS NOT NULL)) t '
+                  'CROSS JOIN ({params}) p').format(table=table,
+                                                    cation=total(['ca', 'mg', 'na', 'k', 'na+k']),
+                                                    anion=total(['cl', 'hco3', 'co3', 'so4', 'no3', 'no2']),
+                                                    averages=averages,
+                                                    ions=ions,
+                                                    params=params,
+                                                    in_samples=in_samples)
+
+        return {
+            'delete': 'DELETE FROM {} WHERE {}{}'.format(table, is_balance, in_samples),
+            'insert': insert
+        }
+
+    @classmethod
+    def update_in_database(cls, connection, sample_ids=None):
+        '''replaces the charge balance rows with ones computed by the database from the stored results
+        sample_ids - the samples to balance. every sample if None
+        '''
+        cursor = connection.cursor()
+
+        if sample_ids is None:
+            statements = cls.get_balance_sql()
+
+            cursor.execute(statements['delete'])
+            cursor.execute(statements['insert'])
+        else:
+            sample_ids = list(sample_ids)
+
+            for i in xrange(0, len(sample_ids), cls.samples_per_statement):
+                chunk = sample_ids[i:i + cls.samples_per_statement]
+                statements = cls.get_balance_sql(samples=len(chunk))
+
+                cursor.execute(statements['delete'], chunk)
+                cursor.execute(statements['insert'], chunk)
+
+        connection.commit()
+
+    @classmethod
+    def _get_ion_indices(cls, params):
+        '''returns the column of the ion for each param or None if it is not tracked'''
+        indices = {}
+        ions = []
+
+        for param in params:
+            try:
+                ions.append(indices[param])
+            except KeyError:
+                ion = None
+
+                if param is not None:
+                    ion = cls._chemical_ions.get(param.lower())
+
+                ion = indices[param] = cls._ions.index(ion) if ion else None
+                ions.append(ion)
+
+        return ions
+
 
 class HttpClient(object):
     """A wrapper around requests for testing"""
 
     @staticmethod
-    def get_csv(url):
-        response = get(url)
+    def get_csv(url, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''returns a CsvResponse reading the rows of the csv at url as they are downloaded'''
+        response = get(url, stream=True)
         response.raise_for_status()
 
+        csv_response = CsvResponse(response, chunk_size)
+
+        print('query completed in {}'.format(csv_response.elapsed))
+        if csv_response.site_count is not None:
+            print('new sites found {}'.format(csv_response.site_count))
+        if csv_response.result_count is not None:
+            print('new results found {}'.format(csv_response.result_count))
+
+        return csv_response
+
+
+class CsvResponse(object):
+    '''The rows of a streamed csv response. Iterates like a csv reader.
+
+    The body is read `chunk_size` bytes at a time and split into lines so only a chunk
+    and the current row are held in memory. A zip archive, e.g. from WQP with `zip=yes`,
+    can only be read once its directory at the end has arrived so the compressed body is
+    spooled to a temporary file and the csv inside it is read from there. Text in any
+    other encoding is decoded as it arrives and handed to the csv reader as utf-8.
+    '''
+
+    def __init__(self, response, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''response - a requests response made with stream=True
+        chunk_size - the number of bytes to read at a time
+        '''
+        super(CsvResponse, self).__init__()
+
+        self.response = response
+        self.chunk_size = chunk_size
+        self.elapsed = getattr(response, 'elapsed', None)
+        self.site_count = self._get_count(response.headers, 'total-site-count')
+        self.result_count = self._get_count(response.headers, 'total-result-count')
+        self.reader = csvreader(self._get_lines())
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.reader.next()
+
+    def close(self):
+        self.response.close()
+
+    def _get_lines(self):
         try:
-            print('query completed in {}'.format(response.elapsed))
-            print('new sites found {}'.format(response.headers['total-site-count']))
-            print('new results found {}'.format(response.headers['total-result-count']))
-        except:
-            pass
+            if self._is_zip():
+                for line in self._get_zipped_lines():
+                    yield line
+            else:
+                for line in split_lines(self._decode(self.response.iter_content(self.chunk_size))):
+                    yield line
+        finally:
+            self.close()
+
+    def _get_zipped_lines(self):
+        with tempfile.TemporaryFile() as spool:
+            for chunk in self.response.iter_content(self.chunk_size):
+                spool.write(chunk)
+
+            spool.seek(0)
+
+            archive = zipfile.ZipFile(spool)
+            member = archive.open(archive.namelist()[0])
+
+            chunks = iter(lambda: member.read(self.chunk_size), '')
+
+            for line in split_lines(chunks):
+                yield line
+
+    def _is_zip(self):
+        return 'zip' in self.response.headers.get('content-type', '').lower()
+
+    def _decode(self, chunks):
+        '''re-encodes the chunks as utf-8 as they arrive unless they already are'''
+        encoding = self.response.encoding
+
+        if not encoding or codecs.lookup(encoding).name == 'utf-8':
+            return chunks
+
+        return (chunk.encode('utf-8') for chunk in codecs.iterdecode(chunks, encoding))
+
+    @staticmethod
+    def _get_count(headers, name):
+        try:
+            return int(headers[name])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+def split_lines(chunks):
+    '''yields the lines, with their line endings, of an iterable of byte strings'''
+    pending = ''
+
+    for chunk in chunks:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+
+        for line in lines:
+            yield line + '\n'
 
-        return csvreader(response.text.splitlines())
+    if pending:
+        yield pending
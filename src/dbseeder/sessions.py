@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+sessions.py
+----------------------------------
+pooled database connections shared by the seeder and the programs
+'''
+
+import threading
+import time
+from Queue import LifoQueue, Empty
+
+#: the number of idle connections to keep open
+DEFAULT_POOL_SIZE = 4
+
+#: the number of times to retry connecting or a statement after a transient error
+DEFAULT_RETRIES = 3
+
+#: the seconds to wait before the first retry. doubled for every retry after that
+DEFAULT_RETRY_DELAY = 1
+
+
+class ConnectionPool(object):
+    '''Opens connections to a backend and keeps them open for reuse.
+
+    Idle connections are checked with a cheap statement before they are handed out
+    and are replaced when the check fails. Connecting is retried when the backend
+    raises one of its `transient_errors`. Each thread gets its own `Session`.
+    '''
+
+    def __init__(self, backend, size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+        '''backend - the backend to connect to. see backends.create
+        size - the number of idle connections to keep open
+        retries - the number of times to retry after a transient error
+        retry_delay - the seconds to wait before the first retry
+        '''
+        super(ConnectionPool, self).__init__()
+
+        self.backend = backend
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.idle = LifoQueue(size)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.connections_opened = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def session(self):
+        '''returns the session for the calling thread creating it if needed'''
+        session = getattr(self.local, 'session', None)
+
+        if session is None:
+            session = self.local.session = Session(self)
+
+            with self.lock:
+                self.sessions.append(session)
+
+        return session
+
+    def end_session(self):
+        '''returns the connection of the calling thread's session to the pool'''
+        session = getattr(self.local, 'session', None)
+
+        if session is not None:
+            session.close()
+
+    def acquire(self):
+        '''returns a healthy connection from the pool or a new one'''
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except Empty:
+                return self.connect()
+
+            if self.is_healthy(connection):
+                return connection
+
+            self.discard(connection)
+
+    def release(self, connection):
+        '''puts the connection back in the pool or closes it if the pool is full'''
+        try:
+            connection.rollback()
+            self.idle.put_nowait(connection)
+        except Exception:
+            self.discard(connection)
+
+    def connect(self):
+        '''opens a new connection retrying transient errors'''
+        connection = self.retry(self.backend.connect)
+
+        with self.lock:
+            self.connections_opened += 1
+
+        return connection
+
+    def is_healthy(self, connection):
+        try:
+            connection.cursor().execute(self.backend.sql['health_check']).fetchall()
+
+            return True
+        except Exception:
+            return False
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def retry(self, function, on_retry=None):
+        '''calls function retrying when the backend raises a transient error
+        on_retry - called before each retry. e.g. to reconnect
+        '''
+        delay = self.retry_delay
+
+        for attempt in xrange(self.retries + 1):
+            try:
+                return function()
+            except self.backend.transient_errors, e:
+                if attempt == self.retries or not self.backend.is_transient(e):
+                    raise
+
+                print('transient database error. retrying in {} seconds. {}'.format(delay, e))
+                time.sleep(delay)
+                delay *= 2
+
+                if on_retry:
+                    on_retry()
+
+    def close(self):
+        '''closes every session and idle connection'''
+        with self.lock:
+            sessions = self.sessions
+            self.sessions = []
+
+        for session in sessions:
+            session.close(release=False)
+
+        self.local = threading.local()
+
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except Empty:
+                break
+
+
+class Session(object):
+    '''A connection and a cursor for one thread. The connection is taken from the pool
+    the first time it is needed and given back with `close`.
+
+    Objects that keep using the connection, e.g. writers, get it with `hold`. A statement
+    retried on a new connection leaves a held connection open for its holders.
+    '''
+
+    def __init__(self, pool):
+        super(Session, self).__init__()
+
+        self.pool = pool
+        self._connection = None
+        self._cursor = None
+        self._held = False
+        #: held connections the session moved off of. they are discarded when the session closes
+        self._detached = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = self.pool.acquire()
+
+        return self._connection
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.connection.cursor()
+
+        return self._cursor
+
+    def hold(self):
+        '''returns the connection for an object that keeps using it'''
+        connection = self.connection
+        self._held = True
+
+        return connection
+
+    def execute(self, statement, parameters=None):
+        '''executes a statement on the session cursor and returns the cursor.
+        the statement is run again on a new connection after a transient error
+        so only use it for statements that are safe to repeat.
+        '''
+        def execute():
+            if parameters is None:
+                return self.cursor.execute(statement)
+
+            return self.cursor.execute(statement, parameters)
+
+        self.pool.retry(execute, on_retry=self.reconnect)
+
+        return self.cursor
+
+    def commit(self):
+        if self._connection is not None:
+            self._connection.commit()
+
+    def reconnect(self):
+        '''throws away the current connection so the next statement gets a new one'''
+        if self._held:
+            self._detached.append(self._connection)
+        elif self._connection is not None:
+            self.pool.discard(self._connection)
+
+        self._connection = None
+        self._cursor = None
+        self._held = False
+
+    def close(self, release=True):
+        '''gives the connection back to the pool'''
+        while self._detached:
+            self.pool.discard(self._detached.pop())
+
+        if self._connection is None:
+            return
+
+        if release:
+            self.pool.release(self._connection)
+        else:
+            self.pool.discard(self._connection)
+
+        self._connection = None
+        self._cursor = None
+        self._held = False
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+writers.py
+----------------------------------
+classes for sending rows to the database
+'''
+
+import datetime
+import threading
+
+#: the number of rows to send before committing
+DEFAULT_BATCH_SIZE = 5000
+
+#: the approximate number of bytes of parameters to send before committing
+DEFAULT_BYTE_BUDGET = 32 * 1024 * 1024
+
+#: sql server allows at most 1000 rows in a VALUES list
+MAX_VALUES_ROWS = 1000
+
+#: sql server allows fewer than 2100 parameters in a statement
+MAX_PARAMETERS = 2100
+
+
+def get_columns(insert_template):
+    '''Given an insert statement template, `insert into Table (a, b) values ({})`,
+    return the list of column names'''
+
+    columns = insert_template[insert_template.index('(') + 1:insert_template.index(')')]
+
+    return [column.strip() for column in columns.split(',')]
+
+
+def get_table(insert_template):
+    '''Given an insert statement template, `insert into Table (a, b) values ({})`,
+    return the table name'''
+
+    return insert_template.split()[2]
+
+
+def get_parameter_size(value):
+    '''an estimate of the number of bytes a parameter takes on the wire'''
+    if value is None:
+        return 1
+    elif isinstance(value, basestring):
+        return len(value)
+    elif isinstance(value, (datetime.datetime, datetime.time)):
+        return 16
+
+    return 8
+
+
+class ExecuteManyWriter(object):
+    '''Sends rows as typed parameter tuples with `executemany` and commits
+    after `batch_size` rows or `byte_budget` bytes, whichever comes first.
+    '''
+
+    def __init__(self, connection, insert_template, parameters=None, batch_size=DEFAULT_BATCH_SIZE,
+                 byte_budget=DEFAULT_BYTE_BUDGET, lock=None, auto_flush=True):
+        '''connection - a db api connection
+        insert_template - an insert statement with a `{}` for the values
+        parameters - {column: placeholder} for columns that need more than `?` e.g. a geometry constructor
+        batch_size - the number of rows to send before committing
+        byte_budget - the approximate number of bytes to send before committing
+        lock - held while rows are sent. e.g. a semaphore limiting the processes writing at once
+        auto_flush - send the rows when the batch is full. if False the rows are only sent by `flush`
+                     so the caller decides which rows are committed together. see `full`
+        '''
+        super(ExecuteManyWriter, self).__init__()
+
+        self.connection = connection
+        self.insert_template = insert_template
+        self.columns = get_columns(insert_template)
+        self.placeholders = ','.join(self._get_placeholders(parameters or {}))
+        self.statement = insert_template.format(self.placeholders)
+        self.batch_size = batch_size
+        self.byte_budget = byte_budget
+        self.rows_written = 0
+        self.pending = []
+        self.pending_bytes = 0
+        self.lock = lock or threading.Lock()
+        self.auto_flush = auto_flush
+
+        self.cursor = connection.cursor()
+        #: bind parameters as arrays instead of row by row. pyodbc >= 4.0.19
+        if hasattr(self.cursor, 'fast_executemany'):
+            self.cursor.fast_executemany = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def write(self, rows):
+        '''queues the rows and sends them when the batch is full
+        rows: an iterable of sequences in the same order as the columns of the insert template
+        '''
+        for row in rows:
+            self.pending.append(tuple(row))
+            self.pending_bytes += sum(get_parameter_size(value) for value in row)
+
+            if self.auto_flush and self.full:
+                self.flush()
+
+    @property
+    def full(self):
+        '''True when `batch_size` rows or `byte_budget` bytes are queued'''
+        return len(self.pending) >= self.batch_size or self.pending_bytes >= self.byte_budget
+
+    def write_batch(self, batch):
+        '''queues the rows of a Batch with a column for each column of the insert template'''
+        self.write(batch.rows(self.columns))
+
+    def flush(self):
+        '''sends and commits the queued rows'''
+        if not self.pending:
+            return
+
+        with self.lock:
+            self._execute(self.pending)
+            self.connection.commit()
+
+        self.rows_written += len(self.pending)
+        self.pending = []
+        self.pending_bytes = 0
+
+    def _execute(self, rows):
+        self.cursor.executemany(self.statement, rows)
+
+    def _get_placeholders(self, parameters):
+        return [parameters.get(column, '?') for column in self.columns]
+
+
+class MultiRowValuesWriter(ExecuteManyWriter):
+    '''Packs as many rows as sql server allows into each `INSERT ... VALUES (...),(...)` statement.
+    The number of rows is limited by the 1000 row VALUES limit and the 2100 parameter limit.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(MultiRowValuesWriter, self).__init__(*args, **kwargs)
+
+        parameters_per_row = self.placeholders.count('?')
+        self.rows_per_statement = max(1, min(MAX_VALUES_ROWS, (MAX_PARAMETERS - 1) // parameters_per_row))
+        self.values_statement = self._get_values_statement(self.rows_per_statement)
+
+    def _execute(self, rows):
+        for i in xrange(0, len(rows), self.rows_per_statement):
+            chunk = rows[i:i + self.rows_per_statement]
+
+            statement = self.values_statement
+            if len(chunk) < self.rows_per_statement:
+                statement = self._get_values_statement(len(chunk))
+
+            self.cursor.execute(statement, [value for row in chunk for value in row])
+
+    def _get_values_statement(self, rows):
+        return self.insert_template.format('),('.join([self.placeholders] * rows))
@@ -0,0 +1,413 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+backends
+----------------------------------
+test the backends module
+'''
+
+import csv
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from dbseeder import backends
+from dbseeder.programs import WqpProgram
+from dateutil.parser import parse
+from mock import patch
+from os.path import join
+
+
+class TestCreate(unittest.TestCase):
+
+    def test_sqlite_configuration(self):
+        backend = backends.create({'backend': 'sqlite', 'path': ':memory:'})
+
+        self.assertIsInstance(backend, backends.SqliteBackend)
+        self.assertEqual(backend.sql['shape_parameter'], '?')
+
+    def test_connection_string_is_sql_server(self):
+        backend = backends.create({'connection_string': 'DRIVER={SQL Server}'})
+
+        self.assertIsInstance(backend, backends.SqlServerBackend)
+        self.assertEqual(backend.sql['shape_parameter'], 'geometry::STGeomFromText(?, 26912)')
+
+    def test_spatialite_constructs_geometry(self):
+        backend = backends.create({'backend': 'sqlite', 'path': ':memory:', 'spatialite': True})
+
+        self.assertEqual(backend.sql['shape_parameter'], 'GeomFromText(?, 26912)')
+        self.assertEqual(backends.SqliteBackend.sql['shape_parameter'], '?')
+
+
+class TestSqliteBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.db = {'backend': 'sqlite', 'path': join(self.folder, 'test.sqlite3')}
+        self.patient = backends.create(self.db)
+
+        self.connection = self.patient.connect()
+        self.patient.create_tables(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.folder)
+
+    def test_create_tables(self):
+        tables = [row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        indices = [row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+
+        for table in ['Stations', 'Results', 'Params', 'SyncState']:
+            self.assertIn(table, tables)
+
+        self.assertIn('StationId_index', indices)
+        self.assertIn('SampleId_index', indices)
+
+    def test_new_ids(self):
+        self.connection.execute("INSERT INTO Stations (StationId) VALUES ('1')")
+        self.connection.executemany('INSERT INTO Results (SampleId) VALUES (?)', [('a',), ('a',)])
+
+        self.assertEqual(self.patient.find_new_ids(self.connection, 'Stations', 'StationId', ['1', '2', '2']), set(['2']))
+        self.assertEqual(self.patient.find_new_ids(self.connection, 'Results', 'SampleId', ['a', 'b', None]), set(['b']))
+        self.assertEqual(self.patient.find_new_ids(self.connection, 'Results', 'SampleId', []), set())
+
+    def test_new_ids_are_checked_in_chunks(self):
+        ids = [str(i) for i in xrange(backends.CANDIDATES_PER_INSERT + 10)]
+        self.connection.executemany('INSERT INTO Results (SampleId) VALUES (?)', [(id,) for id in ids[::2]])
+
+        self.assertEqual(self.patient.find_new_ids(self.connection, 'Results', 'SampleId', ids), set(ids[1::2]))
+
+    def test_seed(self):
+        for insert_mode in ['executemany', 'values', 'bulk']:
+            self.patient.create_tables(self.connection)
+
+            program = WqpProgram(self.db,
+                                 file_location=join('tests', 'data', 'WQP', 'insert'),
+                                 insert_mode=insert_mode,
+                                 bulk_folder=join(self.folder, 'bulk'))
+            program.seed()
+
+            stations = self.connection.execute('SELECT StationId, Shape FROM Stations').fetchall()
+            results = self.connection.execute('SELECT count(*) FROM Results').fetchone()[0]
+
+            self.assertEqual(len(stations), 1, insert_mode)
+            self.assertTrue(stations[0][1].startswith('POINT ('), insert_mode)
+            self.assertGreater(results, 0, insert_mode)
+
+            self.patient.update_params_table(self.connection)
+
+            params = self.connection.execute('SELECT count(*) FROM Params').fetchone()[0]
+            self.assertGreater(params, 0, insert_mode)
+
+            if os.path.isdir(join(self.folder, 'bulk')):
+                shutil.rmtree(join(self.folder, 'bulk'))
+
+    def test_seed_with_workers(self):
+        counts = []
+
+        for workers in [1, 2]:
+            self.patient.create_tables(self.connection)
+
+            program = WqpProgram(self.db,
+                                 file_location=join('tests', 'data', 'WQP', 'get_files'),
+                                 workers=workers,
+                                 writers=1,
+                                 staging_db=join(self.folder, 'staging.sqlite3'))
+            program.seed()
+
+            counts.append(self.connection.execute('SELECT count(*), count(DISTINCT SampleId) FROM Results').fetchone())
+
+        self.assertGreater(counts[0][0], 0)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_seed_with_pipeline(self):
+        rows = []
+
+        for transformers in [0, 2]:
+            self.patient.create_tables(self.connection)
+
+            program = WqpProgram(self.db,
+                                 file_location=join('tests', 'data', 'WQP', 'get_files'),
+                                 transformers=transformers,
+                                 queue_size=1)
+            program.seed()
+
+            rows.append(self.connection.execute('SELECT SampleId, Param, ResultValue FROM Results '
+                                                'ORDER BY SampleId, Param, ResultValue').fetchall())
+
+        self.assertGreater(len(rows[0]), 0)
+        self.assertEqual(rows[0], rows[1])
+
+    def test_seed_columnar(self):
+        rows = []
+
+        for columnar, grouping in [(False, 'stream'), (True, 'stream'), (True, 'staged')]:
+            self.patient.create_tables(self.connection)
+
+            program = WqpProgram(self.db,
+                                 file_location=join('tests', 'data', 'WQP', 'get_files'),
+                                 grouping=grouping,
+                                 columnar=columnar,
+                                 batch_size=10)
+            program.seed()
+
+            columns = [column[1] for column in self.connection.execute('PRAGMA table_info(Results)') if column[1] != 'Id']
+            rows.append(sorted(self.connection.execute('SELECT {} FROM Results'.format(', '.join(columns))).fetchall()))
+
+        self.assertGreater(len(rows[0]), 0)
+        self.assertEqual(rows[0], rows[1])
+        self.assertEqual(rows[0], rows[2])
+
+    def _seed_and_resume(self, fail, staging=(), **options):
+        '''seeds until fail raises, resumes the seed and returns the rows of the resumed seed and a clean one
+        staging - the staging databases the interrupted seed should leave for the resumed one
+        '''
+        options.update(file_location=join('tests', 'data', 'WQP', 'get_files'),
+                       manifest=join(self.folder, 'manifest.sqlite3'),
+                       staging_db=join(self.folder, 'staging.sqlite3'),
+                       batch_size=10)
+        rows = []
+
+        with fail:
+            self.assertRaises(IOError, WqpProgram(self.db, **options).seed)
+
+        self.assertTrue(os.path.exists(options['manifest']))
+
+        for path in staging:
+            self.assertTrue(os.path.exists(path), path)
+
+        for resume in [True, False]:
+            WqpProgram(self.db, resume=resume, **options).seed()
+
+            rows.append(self.connection.execute('SELECT SampleId, Param, ResultValue FROM Results '
+                                                'ORDER BY SampleId, Param, ResultValue').fetchall())
+            self.patient.create_tables(self.connection)
+
+        self.assertFalse(os.path.exists(options['manifest']))
+
+        return rows
+
+    def test_resumed_seed_skips_committed_samples(self):
+        write = WqpProgram._write_sample_set
+        written = []
+
+        def fail_after_a_few(program, rows):
+            if len(written) == 5:
+                raise IOError('connection lost')
+
+            written.append(rows)
+            write(program, rows)
+
+        for transformers, grouping in [(0, 'stream'), (2, 'stream'), (0, 'staged'), (2, 'staged')]:
+            del written[:]
+
+            rows = self._seed_and_resume(patch.object(WqpProgram, '_write_sample_set', fail_after_a_few),
+                                         transformers=transformers,
+                                         grouping=grouping)
+
+            self.assertGreater(len(rows[1]), 0)
+            self.assertEqual(rows[0], rows[1])
+
+    def test_resumed_worker_seed_reuses_the_staging_databases(self):
+        write = WqpProgram._write_sample_set
+        written = []
+
+        def fail_after_a_few(program, rows):
+            #: each forked worker counts its own sample sets
+            if len(written) == 5:
+                raise IOError('connection lost')
+
+            written.append(rows)
+            write(program, rows)
+
+        staging = [join(self.folder, 'sample_chemistry.staging.sqlite3'),
+                   join(self.folder, 'sample_chemistry2.staging.sqlite3')]
+
+        rows = self._seed_and_resume(patch.object(WqpProgram, '_write_sample_set', fail_after_a_few),
+                                     staging=staging,
+                                     workers=2,
+                                     writers=1,
+                                     grouping='staged')
+
+        self.assertGreater(len(rows[1]), 0)
+        self.assertEqual(rows[0], rows[1])
+
+        for path in staging:
+            self.assertFalse(os.path.exists(path))
+
+    def test_resumed_seed_removes_samples_that_may_not_have_been_committed(self):
+        from dbseeder.checkpoints import Manifest
+        commit_pending = Manifest.commit_pending
+        commits = []
+
+        def fail_before_recording_a_commit(manifest, csv_file):
+            if len(commits) == 2:
+                raise IOError('killed')
+
+            commits.append(csv_file)
+            commit_pending(manifest, csv_file)
+
+        for columnar, grouping in [(False, 'stream'), (True, 'stream'), (False, 'staged'), (True, 'staged')]:
+            del commits[:]
+
+            rows = self._seed_and_resume(patch.object(Manifest, 'commit_pending', fail_before_recording_a_commit),
+                                         columnar=columnar,
+                                         grouping=grouping)
+
+            self.assertGreater(len(rows[1]), 0)
+            self.assertEqual(rows[0], rows[1])
+
+    def test_removing_pending_samples_keeps_rows_written_before_or_by_other_sources(self):
+        self.connection.executemany('INSERT INTO Results (DataSource, SampleId) VALUES (?, ?)',
+                                    [('WQP', 'a'), ('UGS', 'b'), ('WQP', 'a'), ('WQP', 'b'), ('UGS', 'a')])
+        self.connection.commit()
+
+        WqpProgram(self.db)._delete_samples(['a', 'b'], after_id=2)
+
+        self.assertEqual(self.connection.execute('SELECT Id, DataSource, SampleId FROM Results').fetchall(),
+                         [(1, 'WQP', 'a'), (2, 'UGS', 'b'), (5, 'UGS', 'a')])
+
+    def _write_balance_samples(self):
+        #: the balance samples use the database column names so write them with the wqp names
+        file_location = join(self.folder, 'balance')
+        os.makedirs(join(file_location, 'WQP', 'Results'))
+        shutil.copytree(join('tests', 'data', 'WQP', 'get_files', 'WQP', 'Stations'), join(file_location, 'WQP', 'Stations'))
+
+        wqp_names = dict((field, name) for name, field in WqpProgram.result_config.items())
+        with open(join('tests', 'data', 'WQP', 'balance', 'WQP', 'Results', 'sample_multiple_balance.csv'), 'rb') as source:
+            reader = csv.reader(source)
+            header = [wqp_names.get(field, field) for field in reader.next()]
+
+            with open(join(file_location, 'WQP', 'Results', 'balance.csv'), 'wb') as results:
+                writer = csv.writer(results)
+                writer.writerow(header)
+                writer.writerows(reader)
+
+        return file_location
+
+    def test_seed_with_database_balance(self):
+        file_location = self._write_balance_samples()
+        rows = []
+
+        for balance in ['python', 'database']:
+            self.patient.create_tables(self.connection)
+
+            program = WqpProgram(self.db,
+                                 file_location=file_location,
+                                 balance=balance)
+            program.seed()
+
+            rows.append(self.connection.execute('SELECT SampleId, Param, ResultValue, Unit FROM Results '
+                                                'ORDER BY SampleId, Param, ResultValue').fetchall())
+
+        self.assertIn(('Charge Balance', '%'), [(row[1], row[3]) for row in rows[0]])
+        self.assertEqual(rows[0], rows[1])
+
+    def test_seed_leaves_balances_to_the_database(self):
+        file_location = self._write_balance_samples()
+
+        for balance in ['database', 'incremental']:
+            for columnar in [False, True]:
+                self.patient.create_tables(self.connection)
+
+                program = WqpProgram(self.db, file_location=file_location, balance=balance, columnar=columnar)
+
+                with patch.object(WqpProgram, '_update_charge_balances'):
+                    program.seed()
+
+                balances = self.connection.execute("SELECT count(*) FROM Results WHERE Param = 'Charge Balance'").fetchone()
+
+                self.assertEqual(balances[0], 0, (balance, columnar))
+
+    def test_incremental_update_adds_late_analytes(self):
+        file_location = self._write_balance_samples()
+        results = join(file_location, 'WQP', 'Results', 'balance.csv')
+        stations = join(file_location, 'WQP', 'Stations', 'sample_stations.csv')
+        query = 'SELECT SampleId, Param, ResultValue, Unit FROM Results ORDER BY SampleId, Param, ResultValue'
+
+        WqpProgram(self.db, file_location=file_location).seed()
+        expected = self.connection.execute(query).fetchall()
+
+        #: the sulfate results are published after the rest of their samples were seeded
+        self.connection.execute("DELETE FROM Results WHERE Param = 'Sulfate'")
+        self.connection.execute("UPDATE Results SET ResultValue = 99 WHERE Param = 'Charge Balance'")
+        self.connection.commit()
+
+        def get_csv(url):
+            with open(results if '/Result/' in url else stations, 'rb') as response:
+                return iter(list(csv.reader(response)))
+
+        #: the results are fetched as one partition since every partition would get the same csv
+        with patch('dbseeder.programs.HttpClient.get_csv', side_effect=get_csv):
+            WqpProgram(self.db, balance='incremental', fetch_days=0).update()
+
+        self.assertEqual(self.connection.execute(query).fetchall(), expected)
+
+    def test_update_with_key_cache_skips_existing_samples(self):
+        file_location = self._write_balance_samples()
+        results = join(file_location, 'WQP', 'Results', 'balance.csv')
+        stations = join(file_location, 'WQP', 'Stations', 'sample_stations.csv')
+        query = 'SELECT SampleId, Param, ResultValue, Unit FROM Results ORDER BY SampleId, Param, ResultValue'
+
+        WqpProgram(self.db, file_location=file_location).seed()
+        expected = self.connection.execute(query).fetchall()
+
+        #: one sample was not seeded
+        self.connection.execute("DELETE FROM Results WHERE SampleId = 'nwisaz.01.92600004'")
+        self.connection.commit()
+
+        def get_csv(url):
+            with open(results if '/Result/' in url else stations, 'rb') as response:
+                return iter(list(csv.reader(response)))
+
+        with patch('dbseeder.programs.HttpClient.get_csv', side_effect=get_csv):
+            WqpProgram(self.db, fetch_days=0, key_cache=join(self.folder, 'keys.sqlite3')).update()
+
+        self.assertEqual(self.connection.execute(query).fetchall(), expected)
+
+    def test_sync_state(self):
+        self.assertIsNone(self.patient.get_sync_state(self.connection, 'WQP'))
+
+        for count in [1, 2]:
+            self.patient.save_sync_state(self.connection, {
+                'DataSource': 'WQP',
+                'WindowHi': datetime.datetime(2015, 1, count),
+                'Results': count,
+                'UpdatedAt': datetime.datetime(2015, 1, count)
+            })
+
+        state = self.patient.get_sync_state(self.connection, 'WQP')
+
+        self.assertEqual(state['WindowHi'], '2015-01-02 00:00:00')
+        self.assertEqual(state['Results'], 2)
+        self.assertIsNone(state['Checksum'])
+
+    def test_update_starts_where_the_last_update_ended(self):
+        file_location = self._write_balance_samples()
+        results = join(file_location, 'WQP', 'Results', 'balance.csv')
+        urls = []
+
+        WqpProgram(self.db, file_location=file_location).seed()
+
+        def get_csv(url):
+            urls.append(url)
+
+            with open(results if '/Result/' in url else join(file_location, 'WQP', 'Stations', 'sample_stations.csv'),
+                      'rb') as response:
+                return iter(list(csv.reader(response)))
+
+        with patch('dbseeder.programs.HttpClient.get_csv', side_effect=get_csv):
+            WqpProgram(self.db, fetch_days=0).update()
+
+            state = self.patient.get_sync_state(self.connection, 'WQP')
+            with open(results, 'rb') as response:
+                self.assertEqual(state['Results'], len(list(csv.reader(response))) - 1)
+            self.assertEqual(len(state['Checksum']), 16)
+
+            urls = []
+            WqpProgram(self.db, fetch_days=0).update()
+
+        start = parse(state['WindowHi']).strftime('startDateLo=%m-%d-%Y&')
+        self.assertTrue(all(start in url for url in urls))
@@ -0,0 +1,129 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+bulk
+----------------------------------
+test the bulk module
+'''
+
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, time
+from dbseeder.bulk import BulkFileSpooler, SqliteBulkLoader, SqlServerBulkLoader, format_value, read_table_columns
+from dbseeder.programs import WqpProgram
+from mock import Mock
+from os.path import basename
+
+
+class TestReadTableColumns(unittest.TestCase):
+    def test_reads_columns_in_script_order(self):
+        tables = read_table_columns()
+
+        self.assertEqual(tables.keys(), ['Results', 'Stations', 'Params', 'SyncState'])
+        self.assertEqual(tables['Results'][:3], [('Id', 'int'), ('AnalysisDate', 'datetime2'), ('AnalytMeth', 'nvarchar')])
+        self.assertEqual(tables['Stations'][-1], ('Shape', 'geometry'))
+        self.assertEqual(len(tables['Results']), 43)
+
+
+class TestFormatValue(unittest.TestCase):
+    def test_formats_types(self):
+        self.assertEqual(format_value(None), '')
+        self.assertEqual(format_value(u'caf\xe9'), 'caf\xc3\xa9')
+        self.assertEqual(format_value(datetime(1899, 1, 2)), '1899-01-02 00:00:00')
+        self.assertEqual(format_value(time(12, 30)), '12:30:00')
+        self.assertEqual(format_value(0.1), '0.1')
+        self.assertEqual(format_value(3L), '3')
+
+    def test_replaces_terminators(self):
+        self.assertEqual(format_value('a\tb\r\nc'), 'a b  c')
+
+
+class TestBulkFileSpooler(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.connection = sqlite3.connect(':memory:')
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.folder)
+
+    def test_rotates_files_and_loads_each_one(self):
+        template = 'insert into Params (Param) values ({})'
+        loader = SqliteBulkLoader(self.connection)
+
+        with BulkFileSpooler(self.folder, template, loader=loader, max_bytes=7) as patient:
+            patient.write([['calcium'], ['sodium'], [None]])
+
+        self.assertEqual(map(basename, patient.files), ['Params_0000.tsv', 'Params_0001.tsv', 'Params_0002.tsv'])
+        self.assertEqual(patient.loaded, patient.files)
+        self.assertEqual(self.connection.execute('select Param from Params').fetchall(),
+                         [(u'calcium',), (u'sodium',), (None,)])
+
+    def test_waits_for_flush_to_rotate_without_auto_flush(self):
+        template = 'insert into Params (Param) values ({})'
+        loader = SqliteBulkLoader(self.connection)
+
+        with BulkFileSpooler(self.folder, template, loader=loader, max_bytes=7, auto_flush=False) as patient:
+            patient.write([['calcium'], ['sodium']])
+
+            self.assertTrue(patient.full)
+            self.assertEqual(len(patient.files), 1)
+
+            patient.flush()
+
+            self.assertFalse(patient.full)
+
+        self.assertEqual(patient.loaded, patient.files)
+        self.assertEqual(self.connection.execute('select count(*) from Params').fetchone()[0], 2)
+
+    def test_writes_rows_in_create_table_order(self):
+        template = WqpProgram.sql['result_insert']
+        loader = SqliteBulkLoader(self.connection)
+        row = [None] * 42
+        row[19] = 'Calcium'  #: Param
+        row[25] = 1.5  #: ResultValue
+        row[32] = datetime(2011, 1, 2)  #: SampleDate
+        row[34] = 'sampleid'  #: SampleId
+
+        with BulkFileSpooler(self.folder, template, loader=loader) as patient:
+            patient.write([row])
+
+        actual = self.connection.execute('select Id, Param, ResultValue, SampleDate, SampleId, Unit from Results').fetchall()
+
+        self.assertEqual(actual, [(1, u'Calcium', 1.5, u'2011-01-02 00:00:00', u'sampleid', None)])
+
+    def test_format_file_skips_identity(self):
+        patient = BulkFileSpooler(self.folder, 'insert into Params (Param) values ({})')
+
+        with open(patient.format_file, 'rb') as f:
+            lines = f.read().splitlines()
+
+        self.assertEqual(lines, ['10.0', '1', '1\tSQLCHAR\t0\t0\t"\\n"\t2\tParam\t""'])
+
+
+class TestSqlServerBulkLoader(unittest.TestCase):
+    def setUp(self):
+        self.connection = Mock()
+        self.cursor = self.connection.cursor.return_value
+        self.cursor.execute.return_value.fetchone.return_value = (41,)
+
+    def test_sets_the_srid_of_the_stations_just_loaded(self):
+        SqlServerBulkLoader(self.connection).load('Stations', 'Stations_0000.tsv', 'Stations.fmt')
+
+        statements = [call[0] for call in self.cursor.execute.call_args_list]
+
+        self.assertEqual(len(statements), 3)
+        self.assertIn('MAX(Id)', statements[0][0])
+        self.assertIn('BULK INSERT', statements[1][0])
+        self.assertIn('WHERE Id > ?', statements[2][0])
+        self.assertEqual(statements[2][1], (41,))
+        self.connection.commit.assert_called_once_with()
+
+    def test_other_tables_are_only_loaded(self):
+        SqlServerBulkLoader(self.connection).load('Results', 'Results_0000.tsv', 'Results.fmt')
+
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        self.assertIn('BULK INSERT', self.cursor.execute.call_args[0][0])
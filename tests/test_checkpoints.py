@@ -0,0 +1,88 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+checkpoints
+----------------------------------
+test the checkpoints module
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from dbseeder.checkpoints import CheckpointError, Manifest
+from nose.tools import raises
+from os.path import join
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.csv_file = join(self.folder, 'results.csv')
+
+        with open(self.csv_file, 'w') as f:
+            f.write('SampleId\n1\n2\n')
+
+        self.patient = Manifest(join(self.folder, 'manifest.sqlite3'))
+
+    def tearDown(self):
+        self.patient.close()
+        shutil.rmtree(self.folder)
+
+    def test_pending_samples_are_committed(self):
+        self.patient.start(self.csv_file)
+        self.patient.add_pending(self.csv_file, ['1', '2', None])
+
+        self.assertEqual(self.patient.get_pending(self.csv_file), set(['1', '2']))
+        self.assertEqual(self.patient.get_committed(self.csv_file), set())
+
+        self.patient.commit_pending(self.csv_file)
+        self.patient.add_pending(self.csv_file, ['3'])
+
+        self.assertEqual(self.patient.get_pending(self.csv_file), set(['3']))
+        self.assertEqual(self.patient.get_committed(self.csv_file), set(['1', '2']))
+
+        self.patient.clear_pending(self.csv_file)
+
+        self.assertEqual(self.patient.get_pending(self.csv_file), set())
+
+    def test_pending_samples_remember_the_id_they_were_written_after(self):
+        self.patient.start(self.csv_file)
+
+        self.assertEqual(self.patient.get_pending_after(self.csv_file), 0)
+
+        self.patient.add_pending(self.csv_file, ['1'], after_id=42)
+
+        self.assertEqual(self.patient.get_pending_after(self.csv_file), 42)
+
+    def test_finished_files_survive_reopening(self):
+        self.patient.start(self.csv_file)
+        self.patient.add_pending(self.csv_file, ['1'])
+        self.patient.commit_pending(self.csv_file)
+        self.patient.finish(self.csv_file)
+        self.patient.close()
+
+        self.patient = Manifest(self.patient.path)
+
+        self.assertTrue(self.patient.is_done(self.csv_file))
+        self.assertEqual(self.patient.get_committed(self.csv_file), set())
+
+        self.patient.reset()
+
+        self.assertFalse(self.patient.is_done(self.csv_file))
+
+    @raises(CheckpointError)
+    def test_changed_files_can_not_be_resumed(self):
+        self.patient.start(self.csv_file)
+
+        with open(self.csv_file, 'a') as f:
+            f.write('3\n')
+
+        self.patient.start(self.csv_file)
+
+    def test_remove_deletes_the_file(self):
+        self.patient.remove()
+
+        self.assertFalse(os.path.exists(self.patient.path))
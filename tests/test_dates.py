@@ -0,0 +1,61 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+dates
+----------------------------------
+test the dates module
+'''
+
+import datetime
+import unittest
+from dbseeder.dates import DateParser, LruCache
+
+
+class TestDateParser(unittest.TestCase):
+
+    def setUp(self):
+        self.patient = DateParser(now=datetime.datetime(2016, 1, 1))
+
+    def test_iso_dates(self):
+        self.assertEqual(self.patient.parse_date(' 2015-02-03 '), datetime.datetime(2015, 2, 3))
+        self.assertEqual(self.patient.parse_date('2015-02-03'), datetime.datetime(2015, 2, 3))
+        self.assertEqual(self.patient.dates.hits, 1)
+
+    def test_other_formats_use_dateutil(self):
+        self.assertEqual(self.patient.parse_date('02/03/2015'), datetime.datetime(2015, 2, 3))
+        self.assertEqual(self.patient.parse_date('2015-02-03 10:20:30'), datetime.datetime(2015, 2, 3, 10, 20, 30))
+
+    def test_invalid_and_empty_dates_are_none(self):
+        self.assertIsNone(self.patient.parse_date('2015-02-30'))
+        self.assertIsNone(self.patient.parse_date('not a date'))
+        self.assertIsNone(self.patient.parse_date(''))
+        self.assertIsNone(self.patient.parse_date(None))
+
+    def test_dates_after_now_are_none(self):
+        self.assertIsNone(self.patient.parse_date('2016-01-02'))
+        self.assertIsNone(self.patient.parse_date(datetime.datetime(2017, 1, 1)))
+        self.assertEqual(self.patient.parse_date('2016-01-01'), datetime.datetime(2016, 1, 1))
+
+    def test_times(self):
+        self.assertEqual(self.patient.parse_time('10:20:30'), datetime.time(10, 20, 30))
+        self.assertEqual(self.patient.parse_time('10:20'), datetime.time(10, 20))
+        self.assertEqual(self.patient.parse_time(datetime.time(1)), datetime.time(1))
+        self.assertIsNone(self.patient.parse_time('25:00:00'))
+        self.assertIsNone(self.patient.parse_time(''))
+        self.assertIsNone(self.patient.parse_time(None))
+
+
+class TestLruCache(unittest.TestCase):
+
+    def test_forgets_least_recently_used(self):
+        patient = LruCache(2)
+
+        patient.get('a', str.upper)
+        patient.get('b', str.upper)
+        patient.get('a', str.upper)
+        patient.get('c', str.upper)
+
+        self.assertEqual(patient.items.keys(), ['a', 'c'])
+        self.assertEqual(patient.hits, 1)
+        self.assertEqual(patient.misses, 3)
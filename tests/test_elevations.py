@@ -0,0 +1,184 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+elevations
+----------------------------------
+test the elevations module against a local stand in for the elevation point query service
+'''
+
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from dbseeder import backends
+from dbseeder.dbseeder import Seeder
+from dbseeder.elevations import ElevationFetcher, RateLimiter
+from dbseeder.sessions import ConnectionPool
+from os.path import join
+from urlparse import urlparse, parse_qs
+
+
+class ElevationServer(ThreadingMixIn, HTTPServer):
+    '''answers with an elevation of x + y. points with x = 0 have no elevation and the first request for each
+    point with x < 0 is busy
+    '''
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), ElevationHandler)
+
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = set()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/epqs/pqs.php'.format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.01})
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ElevationHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        x = float(query['x'][0])
+        y = float(query['y'][0])
+
+        with self.server.lock:
+            busy = x < 0 and (x, y) not in self.server.requests
+            self.server.requests.append((x, y))
+            self.server.connections.add(self.client_address)
+
+        if busy:
+            return self._respond(503, 'busy')
+
+        if x == 0:
+            return self._respond(200, 'not json')
+
+        self._respond(200, json.dumps({
+            'USGS_Elevation_Point_Query_Service': {'Elevation_Query': {'x': x, 'y': y, 'Elevation': x + y}}
+        }))
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_spaces_out_calls(self):
+        now = [100.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+
+        patient = RateLimiter(rate=4, clock=lambda: now[0], sleep=sleep)
+
+        for i in xrange(3):
+            patient.wait()
+
+        self.assertEqual(waits, [0.25, 0.5])
+
+        now[0] = 200.0
+        patient.wait()
+
+        self.assertEqual(len(waits), 2)
+
+    def test_no_rate_does_not_wait(self):
+        patient = RateLimiter(rate=0, sleep=self.fail)
+
+        patient.wait()
+
+
+class TestElevationFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ElevationServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_looks_up_every_point_on_a_few_connections(self):
+        points = [(float(i), 1.0, i) for i in xrange(1, 41)]
+
+        with ElevationFetcher(self.server.url, threads=4, rate=0) as patient:
+            elevations = dict(patient.fetch(points))
+
+        self.assertEqual(elevations, dict((i, i + 1.0) for i in xrange(1, 41)))
+        self.assertEqual(len(self.server.requests), 40)
+        self.assertLessEqual(len(self.server.connections), 4)
+
+    def test_busy_responses_are_retried(self):
+        with ElevationFetcher(self.server.url, threads=2, rate=0, retry_delay=0) as patient:
+            elevations = dict(patient.fetch([(-5.0, 1.0, 'a'), (-2.0, 1.0, 'b')]))
+
+        self.assertEqual(elevations, {'a': -4.0, 'b': -1.0})
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_failed_points_have_no_elevation(self):
+        with ElevationFetcher(self.server.url, rate=0, retries=0) as patient:
+            elevations = dict(patient.fetch([(0.0, 1.0, 'no data'), (-1.0, 1.0, 'busy'), (1.0, 1.0, 'ok')]))
+
+        self.assertEqual(elevations, {'no data': None, 'busy': None, 'ok': 2.0})
+
+    def test_connection_errors_give_up_after_retrying(self):
+        #: nothing listens at the url of a stopped server
+        url = self.server.url
+        self.server.stop()
+        self.server = ElevationServer()
+        self.server.start()
+
+        with ElevationFetcher(url, rate=0, retries=1, retry_delay=0, timeout=1) as patient:
+            self.assertEqual(list(patient.fetch([(1.0, 1.0, 'a')])), [('a', None)])
+
+
+class TestUpdateElevations(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ElevationServer()
+        self.server.start()
+
+        self.folder = tempfile.mkdtemp()
+        self.pool = ConnectionPool(backends.create({'backend': 'sqlite', 'path': join(self.folder, 'test.sqlite3')}))
+        self.connection = self.pool.session().connection
+        self.pool.backend.create_tables(self.connection)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+        shutil.rmtree(self.folder)
+
+    def test_updates_missing_elevations_in_batches(self):
+        stations = [(float(i), 1.0, None) for i in xrange(1, 8)] + [(0.0, 1.0, None), (9.0, 1.0, 100.0)]
+        self.connection.executemany('INSERT INTO Stations (Lon_X, Lat_Y, Elev) VALUES (?, ?, ?)', stations)
+        self.connection.commit()
+
+        Seeder()._update_elevations(self.pool, self.server.url, updates_per_commit=3, threads=3, rate=0)
+
+        rows = self.connection.execute('SELECT Lon_X, Elev, ElevUnit, ElevMeth FROM Stations ORDER BY Lon_X').fetchall()
+
+        self.assertEqual(rows[0], (0.0, None, None, None))
+        self.assertEqual(rows[1:8], [(float(i), i + 1.0, 'meters', 'Other') for i in xrange(1, 8)])
+        self.assertEqual(rows[8], (9.0, 100.0, None, None))
+        self.assertEqual(len(self.server.requests), 8)
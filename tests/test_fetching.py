@@ -0,0 +1,103 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+fetching
+----------------------------------
+test the fetching module
+'''
+
+import threading
+import unittest
+from datetime import date
+from dbseeder.fetching import PartitionedFetcher, FetchError, get_date_partitions
+from nose.tools import raises
+
+
+class TestGetDatePartitions(unittest.TestCase):
+
+    def test_partitions_cover_the_range_without_overlapping(self):
+        self.assertEqual(get_date_partitions(date(2015, 1, 1), date(2015, 2, 5), days=15), [
+            (date(2015, 1, 1), date(2015, 1, 15)),
+            (date(2015, 1, 16), date(2015, 1, 30)),
+            (date(2015, 1, 31), date(2015, 2, 5))
+        ])
+
+    def test_no_days_is_one_partition(self):
+        self.assertEqual(get_date_partitions(date(2015, 1, 1), date(2015, 2, 5), days=0),
+                         [(date(2015, 1, 1), date(2015, 2, 5))])
+
+
+class TestPartitionedFetcher(unittest.TestCase):
+
+    def get_csv(self, url):
+        return iter([['Id', 'Url']] + [[str(i), url] for i in xrange(2500)])
+
+    def test_merges_every_partition_with_one_header(self):
+        patient = PartitionedFetcher(self.get_csv, threads=3)
+
+        rows = list(patient.fetch(['a', 'b', 'c', 'd'], queue_size=1))
+
+        self.assertEqual(rows[0], ['Id', 'Url'])
+        self.assertEqual(len(rows), 10001)
+        self.assertItemsEqual(set(row[1] for row in rows[1:]), ['a', 'b', 'c', 'd'])
+
+    def test_downloads_at_the_same_time(self):
+        lock = threading.Lock()
+        started = []
+        everyone_started = threading.Event()
+        waited = []
+
+        def get_csv(url):
+            with lock:
+                started.append(url)
+
+                if len(started) == 3:
+                    everyone_started.set()
+
+            #: a serial fetch would time out waiting here for the other downloads
+            waited.append(everyone_started.wait(5))
+
+            return self.get_csv(url)
+
+        rows = list(PartitionedFetcher(get_csv, threads=3).fetch(['a', 'b', 'c']))
+
+        self.assertEqual(len(rows), 7501)
+        self.assertEqual(waited, [True, True, True])
+
+    def test_partitions_without_rows_still_have_a_header(self):
+        rows = list(PartitionedFetcher(lambda url: iter([['Id']])).fetch(['a', 'b']))
+
+        self.assertEqual(rows, [['Id']])
+
+    @raises(ValueError)
+    def test_download_errors_are_raised(self):
+        def get_csv(url):
+            if url == 'c':
+                raise ValueError('service unavailable')
+
+            return self.get_csv(url)
+
+        list(PartitionedFetcher(get_csv, threads=2).fetch(['a', 'b', 'c', 'd'], queue_size=1))
+
+    @raises(FetchError)
+    def test_headers_must_match(self):
+        list(PartitionedFetcher(lambda url: iter([[url], ['1']]), threads=1).fetch(['a', 'b']))
+
+    def test_close_stops_the_downloads(self):
+        started = []
+
+        def get_csv(url):
+            started.append(url)
+
+            return self.get_csv(url)
+
+        fetch = PartitionedFetcher(get_csv, threads=1).fetch(['a', 'b', 'c'], queue_size=1)
+        fetch.next()
+        fetch.close()
+
+        for thread in threading.enumerate():
+            if thread.name.startswith('fetch-'):
+                thread.join(5)
+
+        self.assertLess(len(started), 3)
@@ -0,0 +1,43 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+grouping
+----------------------------------
+test the grouping module
+'''
+
+import unittest
+from dbseeder.grouping import SampleGrouper
+
+
+class TestSampleGrouper(unittest.TestCase):
+    rows = [['1', 'a'], ['2', 'b'], ['1', 'c'], ['3', 'd'], ['2', 'e'], ['1', 'f']]
+
+    def test_groups_in_memory_in_read_order(self):
+        patient = SampleGrouper(0)
+
+        actual = list(patient.group(iter(self.rows)))
+
+        self.assertEqual(actual, [
+            ('1', [['1', 'a'], ['1', 'c'], ['1', 'f']]),
+            ('2', [['2', 'b'], ['2', 'e']]),
+            ('3', [['3', 'd']])
+        ])
+
+    def test_spills_runs_and_merges_them_when_over_budget(self):
+        patient = SampleGrouper(0, memory_budget=1)
+
+        actual = list(patient.group(iter(self.rows)))
+
+        self.assertEqual(actual, [
+            ('1', [['1', 'a'], ['1', 'c'], ['1', 'f']]),
+            ('2', [['2', 'b'], ['2', 'e']]),
+            ('3', [['3', 'd']])
+        ])
+        self.assertEqual(patient.runs, [])
+
+    def test_empty_input(self):
+        patient = SampleGrouper(0, memory_budget=1)
+
+        self.assertEqual(list(patient.group(iter([]))), [])
@@ -0,0 +1,127 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+keycache
+----------------------------------
+test the keycache module
+'''
+
+import shutil
+import tempfile
+import unittest
+from dbseeder import backends
+from dbseeder.keycache import BloomFilter, KeyCache, STRIPPED_STATIONS
+from os.path import join
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_members_are_always_found(self):
+        keys = ['key{}'.format(i) for i in xrange(5000)]
+        patient = BloomFilter(len(keys))
+        patient.add(keys)
+
+        self.assertTrue(patient.contains(keys).all())
+        self.assertIn('key1', patient)
+
+    def test_most_other_keys_are_not_found(self):
+        patient = BloomFilter(5000, error_rate=0.01)
+        patient.add('key{}'.format(i) for i in xrange(5000))
+
+        false_positives = patient.contains('other{}'.format(i) for i in xrange(10000)).sum()
+
+        self.assertLess(false_positives, 300)
+
+    def test_each_key_sets_more_than_one_bit(self):
+        #: a small filter so some keys hash to a step that is a multiple of its size
+        patient = BloomFilter(2, error_rate=0.1)
+
+        bits = patient._get_bits(['key{}'.format(i) for i in xrange(1000)])
+
+        self.assertGreater(patient.hashes, 1)
+        self.assertTrue(all(len(set(key_bits)) > 1 for key_bits in bits))
+
+    def test_unicode_and_utf8_keys_are_the_same(self):
+        patient = BloomFilter(10)
+        patient.add([u'caf\xe9'])
+
+        self.assertIn('caf\xc3\xa9', patient)
+
+
+class TestKeyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.backend = backends.create({'backend': 'sqlite', 'path': join(self.folder, 'test.sqlite3')})
+        self.connection = self.backend.connect()
+        self.backend.create_tables(self.connection)
+
+        self.connection.executemany('INSERT INTO Stations (StationId) VALUES (?)', [('s1',), ('s2',)])
+        self.connection.executemany('INSERT INTO Results (SampleId) VALUES (?)', [('a',), ('a',), ('b',)])
+        self.connection.commit()
+
+        self.patient = KeyCache(join(self.folder, 'keys.sqlite3'))
+
+    def tearDown(self):
+        self.patient.close()
+        self.connection.close()
+        shutil.rmtree(self.folder)
+
+    def test_finds_keys_not_in_the_database(self):
+        self.assertEqual(self.patient.sync(self.connection), {'Stations': 2, 'Results': 3})
+
+        self.assertEqual(self.patient.find_new('Stations', ['s1', 's3', None]), set(['s3']))
+        self.assertEqual(self.patient.find_new('Results', ['a', 'b', 'c']), set(['c']))
+
+    def test_sync_only_reads_new_rows(self):
+        self.patient.sync(self.connection)
+
+        self.connection.execute("INSERT INTO Results (SampleId) VALUES ('c')")
+        self.connection.commit()
+
+        self.assertEqual(self.patient.sync(self.connection), {'Stations': 0, 'Results': 1})
+        self.assertEqual(self.patient.get_mark('Results'), 4)
+        self.assertEqual(self.patient.find_new('Results', ['a', 'c', 'd']), set(['d']))
+
+    def test_sync_picks_up_rows_committed_below_the_mark(self):
+        self.connection.execute("INSERT INTO Results (Id, SampleId) VALUES (10, 'z')")
+        self.connection.commit()
+        self.patient.sync(self.connection)
+
+        #: an identity value reserved before the last sync and committed after it
+        self.connection.execute("INSERT INTO Results (Id, SampleId) VALUES (5, 'late')")
+        self.connection.commit()
+
+        self.assertEqual(self.patient.sync(self.connection), {'Stations': 0, 'Results': 0})
+        self.assertEqual(self.patient.get_mark('Results'), 10)
+        self.assertEqual(self.patient.find_new('Results', ['late', 'new']), set(['new']))
+
+    def test_keys_survive_reopening(self):
+        self.patient.sync(self.connection)
+        self.patient.close()
+
+        self.patient = KeyCache(self.patient.path)
+
+        self.assertEqual(self.patient.find_new('Stations', ['s1', 's2', 's3']), set(['s3']))
+
+    def test_recreated_tables_are_copied_again(self):
+        self.patient.sync(self.connection)
+
+        self.backend.create_tables(self.connection)
+        self.connection.execute("INSERT INTO Results (SampleId) VALUES ('z')")
+        self.connection.commit()
+
+        self.assertEqual(self.patient.sync(self.connection), {'Stations': 0, 'Results': 1})
+        self.assertEqual(self.patient.find_new('Results', ['a', 'z']), set(['a']))
+
+    def test_stripped_station_ids_are_kept_when_asked_for(self):
+        self.connection.executemany('INSERT INTO Stations (StationId) VALUES (?)', [('org_WQX-1',), ('org-2',)])
+        self.connection.commit()
+
+        self.patient.close()
+        self.patient = KeyCache(self.patient.path, strip_station=lambda id: id.replace('_WQX-', '-'))
+        self.patient.sync(self.connection)
+
+        self.assertEqual(self.patient.find_new(STRIPPED_STATIONS, ['org-1', 'org-2', 'org-3']), set(['org-3']))
+        self.assertEqual(self.patient.find_new('Stations', ['org-1', 'org_WQX-1']), set(['org-1']))
@@ -136,3 +136,66 @@ class TestConcentrationModel(unittest.TestCase):
     def tearDown(self):
         self.patient = None
         del self.patient
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_appends_csv_rows_by_column(self):
+        patient = models.Batch(['a', 'b', 'c'])
+
+        patient.append_rows([['1', '2', 'x'], ['3']], ['a', 'b', 'a'])
+        patient.append_rows([['4', '5', '6']], ['a', 'b', 'a'])
+
+        self.assertEqual(len(patient), 3)
+        self.assertEqual(patient.sets, [(0, 2), (2, 3)])
+        self.assertEqual(patient.columns['a'], ['x', models.MISSING, '6'])
+        self.assertEqual(patient.columns['b'], ['2', models.MISSING, '5'])
+        self.assertEqual(patient.columns['c'], [models.MISSING] * 3)
+
+    def test_appends_dicts_and_returns_rows_in_field_order(self):
+        patient = models.Batch(['a', 'b'])
+
+        patient.append_dicts([{'a': 1, 'b': 2, 'c': 3}, {'b': 4}])
+
+        self.assertEqual(patient.rows(), [(1, 2), (models.MISSING, 4)])
+        self.assertEqual(patient.rows(['b', 'a']), [(2, 1), (4, models.MISSING)])
+        self.assertEqual(models.Batch(['a']).rows(), [])
+
+    def test_appends_columns_with_none_for_missing_fields(self):
+        patient = models.Batch(['a', 'b'])
+
+        patient.append_columns({'a': [1, 2]})
+
+        self.assertEqual(patient.rows(), [(1, None), (2, None)])
+        self.assertEqual(patient.sets, [(0, 2)])
+
+
+class TestRecord(unittest.TestCase):
+
+    def test_fields_are_in_insert_order(self):
+        from dbseeder.programs import WqpProgram
+        from dbseeder.writers import get_columns
+
+        self.assertEqual(list(models.StationRecord.fields), get_columns(WqpProgram.sql['station_insert']))
+        self.assertEqual(list(models.ResultRecord.fields), get_columns(WqpProgram.sql['result_insert']))
+
+    def test_reads_and_writes_like_a_dictionary(self):
+        patient = models.ResultRecord.from_row(['SampleId', 'NotAField', 'Param', 'Param'], ['a', 'b', 'c', 'd'])
+
+        self.assertEqual(patient['SampleId'], 'a')
+        self.assertEqual(patient['Param'], 'd')
+        self.assertIn('Param', patient)
+        self.assertNotIn('Unit', patient)
+        self.assertNotIn('NotAField', patient)
+        self.assertIsNone(patient.get('Unit'))
+        self.assertRaises(KeyError, lambda: patient['Unit'])
+        self.assertRaises(KeyError, lambda: patient['fields'])
+
+        patient['Unit'] = 'mg/l'
+
+        self.assertEqual(patient.items(), [('Param', 'd'), ('SampleId', 'a'), ('Unit', 'mg/l')])
+        self.assertEqual(len(patient.values()), 42)
+        self.assertEqual(patient, models.ResultRecord({'SampleId': 'a', 'Param': 'd', 'Unit': 'mg/l'}))
+
+    def test_has_no_dictionary(self):
+        self.assertFalse(hasattr(models.ResultRecord(), '__dict__'))
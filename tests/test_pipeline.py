@@ -0,0 +1,71 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+pipeline
+----------------------------------
+test the pipeline module
+'''
+
+import threading
+import unittest
+from dbseeder.pipeline import Pipeline, PipelineError
+from nose.tools import raises
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_transforms_and_writes_every_item(self):
+        written = []
+        patient = Pipeline(lambda x: x * 2, written.append, transformers=3, queue_size=2)
+
+        self.assertEqual(patient.run(xrange(100)), 100)
+        self.assertEqual(sorted(written), range(0, 200, 2))
+
+    def test_writes_in_the_calling_thread(self):
+        threads = set()
+        patient = Pipeline(lambda x: x, lambda x: threads.add(threading.current_thread()))
+
+        patient.run(xrange(10))
+
+        self.assertEqual(threads, set([threading.current_thread()]))
+
+    def test_transform_errors_are_raised(self):
+        def transform(x):
+            if x == 50:
+                raise ValueError('bad sample set')
+
+            return x
+
+        patient = Pipeline(transform, lambda x: None, queue_size=1)
+
+        self.assertRaises(ValueError, patient.run, xrange(1000))
+
+    def test_write_errors_stop_the_reader(self):
+        read = []
+
+        def source():
+            for i in xrange(1000):
+                read.append(i)
+                yield i
+
+        def write(x):
+            raise IOError('database is gone')
+
+        patient = Pipeline(lambda x: x, write, queue_size=2)
+
+        self.assertRaises(IOError, patient.run, source())
+        self.assertLess(len(read), 1000)
+
+    def test_reader_errors_are_raised(self):
+        def source():
+            yield 1
+            raise KeyError('bad csv')
+
+        patient = Pipeline(lambda x: x, lambda x: None)
+
+        self.assertRaises(KeyError, patient.run, source())
+
+    @raises(PipelineError)
+    def test_needs_a_transformer(self):
+        Pipeline(lambda x: x, lambda x: None, transformers=0)
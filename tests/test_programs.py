@@ -9,8 +9,10 @@ test the programs module
 
 import unittest
 from dbseeder.programs import WqpProgram
+from dbseeder.models import ResultRecord
 from collections import OrderedDict
 from csv import reader as csvreader
+from datetime import datetime, time
 from mock import Mock
 from nose.tools import raises
 from os.path import join, basename
@@ -95,7 +97,7 @@ class TestWqpProgram(unittest.TestCase):
             'Lat_Y': 40
         }
         actual = self.patient._update_row(row)
-        expected = 'geometry::STGeomFromText(\'POINT ({} {})\', 26912)'.format(243900.352024, 4432069.05679)
+        expected = 'POINT ({} {})'.format(243900.352024, 4432069.05679)
 
         self.assertEqual(actual['Shape'], expected)
         self.assertEqual(actual['DataSource'], self.patient.datasource)
@@ -117,9 +119,6 @@ class TestWqpProgram(unittest.TestCase):
         mock = Mock()
         self.patient._insert_rows = mock
 
-        #: prevent sql error for missing table
-        self.patient._add_sample_index = lambda x: None
-
         self.patient.seed()
 
         self.assertEqual(mock.call_count, 2)
@@ -130,87 +129,91 @@ class TestWqpProgram(unittest.TestCase):
         station_row = station_call[0][0][0]
 
         self.assertEqual(station_row, [
-            "'orgid'",
-            "'orgname'",
-            "'stationid'",
-            "'stationname'",
-            "'stationtype'",
-            "'stationcomment'",
-            "'huc8'",
-            "-114.0",  #: Longitude
-            "42.0",  #: latitude
-            "0.0",  #: HorAcc
-            "'hunit'",  #: HorAccUnit
-            "'horcollmeth'",
-            "'horref'",
-            "1.0",  #: Elev
-            "'elevunit'",
-            "2.0",
-            "'euni'",
-            "'elevmeth'",
-            "'elevref'",
-            "3",  #: StateCode
-            "4",  #: CountyCode
-            "'aquifer'",
-            "'fmtype'",
-            "'aquifertype'",
-            "Cast('2011-01-01' as datetime)",
-            "5.0",  #: depth
-            "'dunit'",
-            "6.0",  #: HoleDepth
-            "'hdunit'",
-            'Null',  #: demELEVm
-            "'WQP'",  #: DataSource
-            'Null',  #: WIN
-            "geometry::STGeomFromText('POINT (251535.079282 4654130.89121)', 26912)"
+            'orgid',
+            'orgname',
+            'stationid',
+            'stationname',
+            'stationtype',
+            'stationcomment',
+            'huc8',
+            -114.0,  #: Longitude
+            42.0,  #: latitude
+            0.0,  #: HorAcc
+            'hunit',  #: HorAccUnit
+            'horcollmeth',
+            'horref',
+            1.0,  #: Elev
+            'elevunit',
+            2.0,
+            'euni',
+            'elevmeth',
+            'elevref',
+            3,  #: StateCode
+            4,  #: CountyCode
+            'aquifer',
+            'fmtype',
+            'aquifertype',
+            datetime(2011, 1, 1),
+            5.0,  #: depth
+            'dunit',
+            6.0,  #: HoleDepth
+            'hdunit',
+            None,  #: demELEVm
+            'WQP',  #: DataSource
+            None,  #: WIN
+            'POINT (251535.079282 4654130.89121)'
         ])
 
         result_rows = result_call[0][0][0]
         self.assertEqual(result_rows, [
-            "Cast('2011-01-01' as datetime)",  #: analysis date
-            "'analythmeth'",
-            "'analythmethid'",
-            'Null',  #: AutoQual
-            'Null',  #: CAS_Reg
-            'Null',  #: Chrg
-            "'WQP'",  #: DataSource
-            "'detectcondition'",
-            'Null',  #: IdNum
-            "'labcomments'",
-            "'labname'",
-            'Null',  #: Lat
-            "'limittype'",
-            'Null',  #: Long
-            '0.0',  #: MDL
-            "'mdlunit'",
-            "'methoddescript'",
-            "'origid'",
-            "'orgname'",
-            "'param'",
-            'Null',  #: ParamGroup
-            "'projectid'",
-            "'qualcode'",
-            "'resultcomment'",
-            "'resultstatus'",
-            '1.0',  #: ResultValue
-            "'sampcomment'",
-            '2.0',  #: SampDepth
-            "'sampdepthref'",
-            "'sampdepthu'",
-            "'sampequip'",
-            "'sampfrac'",
-            "Cast('2011-01-02' as datetime)",  #: activity date
-            "'12:00:00'",  #: activity Time
-            "'sampleid'",
-            "'sampmedia'",
-            "'sampmeth'",
-            "'sampmethname'",
-            "'samptype'",
-            "'stationid'",
-            "'unit'",
-            "'usgspcode'"
+            datetime(2011, 1, 1),  #: analysis date
+            'analythmeth',
+            'analythmethid',
+            None,  #: AutoQual
+            None,  #: CAS_Reg
+            None,  #: Chrg
+            'WQP',  #: DataSource
+            'detectcondition',
+            None,  #: IdNum
+            'labcomments',
+            'labname',
+            None,  #: Lat
+            'limittype',
+            None,  #: Long
+            0.0,  #: MDL
+            'mdlunit',
+            'methoddescript',
+            'origid',
+            'orgname',
+            'param',
+            None,  #: ParamGroup
+            'projectid',
+            'qualcode',
+            'resultcomment',
+            'resultstatus',
+            1.0,  #: ResultValue
+            'sampcomment',
+            2.0,  #: SampDepth
+            'sampdepthref',
+            'sampdepthu',
+            'sampequip',
+            'sampfrac',
+            datetime(2011, 1, 2),  #: activity date
+            time(12, 0, 0),  #: activity Time
+            'sampleid',
+            'sampmedia',
+            'sampmeth',
+            'sampmethname',
+            'samptype',
+            'stationid',
+            'unit',
+            'usgspcode'
         ])
 
+    @raises(Exception)
+    def test_unknown_balance(self):
+        WqpProgram(self.patient.db, balance='excel')
+
     @raises(Exception)
     def test_seed_with_no_file_location(self):
         self.patient = WqpProgram('bad db connection')
@@ -221,6 +224,15 @@ class TestWqpProgram(unittest.TestCase):
         self.assertEqual(self.patient._format_url(template, 'Result', '01/01/1999', today='01/01/2000'),
                          'type=Result&lastupdated=01-01-1999&today=01-01-2000')
 
+    def test_partition_urls(self):
+        template = 'type={}&lastupdated={}&today={}'
+        patient = WqpProgram('bad db connection', fetch_days=10)
+
+        self.assertEqual(patient._get_partition_urls(template, 'Station', '12/25/1999', today='01/10/2000'), [
+            'type=Station&lastupdated=12-25-1999&today=01-03-2000',
+            'type=Station&lastupdated=01-04-2000&today=01-10-2000'
+        ])
+
     def test_group_sample_ids(self):
         sample_response = join('tests', 'data', 'WQP', 'webservice.csv.as.txt')
         with open(sample_response, 'rb') as f:
@@ -232,9 +244,22 @@ class TestWqpProgram(unittest.TestCase):
             self.assertEqual(len(unique_sample_ids['nwisaz.01.00000154']), 3)
             self.assertTrue('nwisaz.01.00000154' in unique_sample_ids)
 
+    def test_grouped_records_transform_like_dictionaries(self):
+        sample_response = join('tests', 'data', 'WQP', 'webservice.csv.as.txt')
+        with open(sample_response, 'rb') as f:
+            records = self.patient._group_rows_by_id(csvreader(f))['nwisaz.01.00000154']
+
+        with open(sample_response, 'rb') as f:
+            reader = csvreader(f)
+            header = reader.next()
+            rows = [self.patient._etl_column_names(row, self.patient.result_config, header=header) for row in reader]
+
+        self.assertIsInstance(records[0], ResultRecord)
+        self.assertEqual(self.patient._transform_results(records), self.patient._transform_results(rows))
+
     def test_find_new_station_ids(self):
         mock = Mock()
-        mock.side_effect = lambda x: [[i] for i in x]
+        mock.side_effect = lambda x: set(x)
 
         self.patient._get_unique_station_ids = mock
 
@@ -250,11 +275,11 @@ class TestWqpProgram(unittest.TestCase):
 
         expected = self.patient._find_new_station_ids(rows)
 
-        self.assertEqual(expected, [1, 2])
+        self.assertItemsEqual(expected, [1, 2])
 
     def test_find_new_station_ids_with_empty(self):
         mock = Mock()
-        mock.side_effect = lambda x: [[i] for i in x]
+        mock.side_effect = lambda x: set(x)
 
         self.patient._get_unique_station_ids = mock
 
@@ -278,14 +303,6 @@ class TestWqpProgram(unittest.TestCase):
 
         self.assertEqual(actual, [{'StationId': 1, 'someValue': 'insert1'}, {'StationId': 3, 'someValue': 'insert3'}])
 
-    def test_new_stations_sql_format(self):
-        station_ids = ['(1)', '(2)', '(3)']
-        statement = self.patient.sql['new_stations'].format(','.join(station_ids))
-
-        self.assertEqual(('SELECT * FROM (VALUES(1),(2),(3)) AS t(StationId) WHERE NOT EXISTS(' +
-                          'SELECT 1 FROM [UGSWaterChemistry].[dbo].[Stations] WHERE [StationId] = t.StationId)'),
-                         statement)
-
     def test_etl_column_names_with_dict(self):
         row = {'StationId': 1}
 
@@ -297,7 +314,7 @@ class TestWqpProgram(unittest.TestCase):
         new_station_ids = ['123_WQX-ABC', '1234']
 
         mock = Mock()
-        mock.side_effect = lambda x: [[i] for i in ['123-ABC']]
+        mock.side_effect = lambda x: set(['123-ABC'])
 
         self.patient._get_unique_station_ids = mock
 
@@ -305,6 +322,18 @@ class TestWqpProgram(unittest.TestCase):
 
         self.assertEqual(ids, ['123_WQX-ABC'])
 
+    def test_remove_existing_wqx_station_ids_skips_the_ids_the_key_cache_has(self):
+        new_station_ids = ['123_WQX-ABC', '123_WQX-DEF']
+
+        self.patient.key_cache = Mock()
+        self.patient.key_cache.find_new.return_value = set(['123-DEF'])
+        self.patient._get_unique_station_ids = Mock(side_effect=lambda x: set(x))
+
+        ids = self.patient._remove_existing_wqx_station_ids(new_station_ids)
+
+        self.patient._get_unique_station_ids.assert_called_once_with(set(['123-DEF']))
+        self.assertEqual(ids, ['123_WQX-DEF'])
+
     def test_remove_existing_wqx_station_ids_returns_ids_when_no_wqx(self):
         new_station_ids = ['123', '1234']
 
@@ -316,7 +345,7 @@ class TestWqpProgram(unittest.TestCase):
         new_station_ids = ['123_WQX-ABC', '123-ABC']
 
         mock = Mock()
-        mock.side_effect = lambda x: [[i] for i in ['123-ABC', '123-ABC']]
+        mock.side_effect = lambda x: set(['123-ABC'])
 
         self.patient._get_unique_station_ids = mock
 
@@ -328,10 +357,25 @@ class TestWqpProgram(unittest.TestCase):
         results = {'sampleid1': [], 'sampleid2': [], 'existingsampleid': []}
 
         mock = Mock()
-        mock.side_effect = lambda x: [[i] for i in ['sampleid1', 'sampleid2']]
+        mock.side_effect = lambda x: set(['sampleid1', 'sampleid2'])
 
         self.patient._get_unique_sample_ids = mock
 
         new_results = self.patient._remove_existing_results(results)
 
         self.assertItemsEqual(new_results.keys(), ['sampleid1', 'sampleid2'])
+
+    def test_streamed_sample_sets_match_staged_sample_sets(self):
+        csv_file = join('tests', 'data', 'WQP', 'Results', 'sample_chemistry.csv')
+
+        streamed = list(self.patient._get_streamed_sample_sets(csv_file))
+        self.patient.memory_budget = 1
+        spilled = list(self.patient._get_streamed_sample_sets(csv_file))
+        staged = list(self.patient._get_staged_sample_sets(csv_file))
+
+        def key(sample_set):
+            return sample_set[0]['SampleId']
+
+        self.assertEqual(len(streamed), len(staged))
+        self.assertEqual(sorted(streamed, key=key), sorted(spilled, key=key))
+        self.assertEqual(sorted(streamed, key=key), sorted(staged, key=key))
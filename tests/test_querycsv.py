@@ -0,0 +1,36 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+querycsv
+----------------------------------
+test the querycsv module
+'''
+
+import sqlite3
+import unittest
+from dbseeder.querycsv import csv_to_sqldb
+from os.path import join
+
+
+class TestCsvToSqlDb(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_loads_rows_in_chunks(self):
+        csv_to_sqldb(self.db, join('tests', 'data', 'WQP', 'distinct_sampleids.csv'), 'distinct_sampleids', chunk_size=1)
+
+        rows = self.db.execute('select ActivityIdentifier from distinct_sampleids').fetchall()
+
+        self.assertItemsEqual([(u'1',), (u'1',), (u'2',)], rows)
+
+    def test_creates_indices_after_load(self):
+        csv_to_sqldb(self.db, join('tests', 'data', 'WQP', 'distinct_sampleids.csv'), 'distinct_sampleids',
+                     indices=['ActivityIdentifier'])
+
+        indices = self.db.execute("select name from sqlite_master where type = 'index'").fetchall()
+
+        self.assertEqual([(u'ActivityIdentifier_distinct_sampleids',)], indices)
@@ -7,11 +7,18 @@ services
 test the services module
 '''
 
+import datetime
+import shutil
+import tempfile
 import unittest
+import zipfile
 from collections import OrderedDict
-from dbseeder.services import Caster, Reproject, ChargeBalancer, Normalizer
-from dbseeder.models import Concentration
-import datetime
+from dbseeder import backends
+from dbseeder.services import Caster, Reproject, ChargeBalancer, Normalizer, NormalizationRules, HttpClient
+from io import BytesIO
+from mock import Mock, patch
+from dbseeder.models import Batch, Concentration
+from os.path import join
 
 
 class TestCaster_Cast(unittest.TestCase):
@@ -100,51 +107,67 @@ class TestCaster_Cast(unittest.TestCase):
             'Something': None,
         })
 
+    def test_compiles_each_schema_once(self):
+        schema = OrderedDict([
+            ('Something', {
+                'type': 'Double'
+            })
+        ])
 
-class TestCaster_CastForSQL(unittest.TestCase):
-    def test_doesnt_touch_shape(self):
-        input = {'Shape': 'blah'}
-        actual = Caster.cast_for_sql(input)
-
-        self.assertEqual(actual['Shape'], 'blah')
-
-    def test_quotes_strings(self):
-        input = {'hello': 'blah', 'hello2': 'blah2'}
-        actual = Caster.cast_for_sql(input)
-
-        self.assertEqual(actual['hello'], "'blah'")
-        self.assertEqual(actual['hello2'], "'blah2'")
-
-    def test_escape_quotes_in_strings(self):
-        input = {'hello': 'bl\'ah', 'hello2': 'bl\'\'ah2'}
-        actual = Caster.cast_for_sql(input)
-
-        self.assertEqual(actual['hello'], "'bl''ah'")
-        self.assertEqual(actual['hello2'], "'bl''''ah2'")
-
-    def test_casts_dates(self):
-        input = {'date': datetime.datetime(2015, 8, 11)}
-        actual = Caster.cast_for_sql(input)
-
-        self.assertEqual(actual['date'], "Cast('2015-08-11' as datetime)")
+        self.assertIs(Caster.compile(schema), Caster.compile(schema))
+        self.assertEqual(Caster.cast({'Something': ' 1.5 '}, schema), {'Something': 1.5})
+        self.assertEqual(Caster.cast({'Something': ''}, schema), {'Something': None})
+        self.assertEqual(Caster.cast({'Something': 'abc'}, schema), {'Something': None})
 
-    def test_casts_old_dates(self):
-        input = {'date': datetime.datetime(1800, 8, 11)}
-        actual = Caster.cast_for_sql(input)
+    def test_casts_times_and_unknown_types(self):
+        simple_row = {
+            'Time': '10:30:05',
+            'BadTime': '10:xx',
+            'Shape': 'POINT (1 2)'
+        }
+        schema = OrderedDict([
+            ('Time', {
+                'type': 'Time'
+            }),
+            ('BadTime', {
+                'type': 'Time'
+            }),
+            ('Shape', {
+                'type': 'Geometry'
+            })
+        ])
 
-        self.assertEqual(actual['date'], "Cast('1800-08-11' as datetime)")
+        actual = Caster.cast(simple_row, schema)
+        self.assertEqual(actual, {
+            'Time': datetime.time(10, 30, 5),
+            'BadTime': None,
+            'Shape': None
+        })
 
-    def test_null_for_none(self):
-        input = {'test': None}
-        actual = Caster.cast_for_sql(input)
+    def test_casts_batches_like_rows(self):
+        schema = OrderedDict([
+            ('OrgId', {
+                'type': 'String',
+                'length': 2
+            }),
+            ('Value', {
+                'type': 'Double'
+            }),
+            ('Missing', {
+                'type': 'String'
+            })
+        ])
+        rows = [{'OrgId': ' 12345 ', 'Value': ' 1.5 '}, {'Value': 'abc'}, {'OrgId': '', 'Value': None}]
 
-        self.assertEqual(actual['test'], 'Null')
+        batch = Batch(['OrgId', 'Value'])
+        batch.append_dicts([dict(row) for row in rows])
 
-    def test_convert_numbers_to_strings(self):
-        input = {'num': 1.2345}
-        actual = Caster.cast_for_sql(input)
+        actual = Caster.cast_batch(batch, schema)
 
-        self.assertEqual(actual['num'], '1.2345')
+        self.assertEqual(actual.columns['OrgId'], ['12', None, None])
+        self.assertEqual(actual.columns['Missing'], [None, None, None])
+        self.assertEqual([dict(zip(schema, row)) for row in actual.rows(schema.keys())],
+                         [Caster.cast(row, schema) for row in rows])
 
 
 class TestReproject(unittest.TestCase):
@@ -159,6 +182,52 @@ class TestReproject(unittest.TestCase):
         self.assertAlmostEqual(actual[0], expected[0], places=0)
         self.assertAlmostEqual(actual[1], expected[1], places=0)
 
+    def test_batch_matches_single_points(self):
+        xs = [-114, 120, -111.5]
+        ys = [40, 40, 37.25]
+
+        actual_x, actual_y = Reproject.to_utm_batch(xs, ys)
+
+        self.assertEqual(len(actual_x), 3)
+        for i in range(3):
+            expected = Reproject.to_utm(xs[i], ys[i])
+            self.assertAlmostEqual(actual_x[i], expected[0], places=6)
+            self.assertAlmostEqual(actual_y[i], expected[1], places=6)
+
+        self.assertEqual(actual_x[1], Reproject.to_utm(-120, 40)[0])
+
+
+class TestNormalizationRules(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = join(self.folder, 'rules.csv')
+
+        with open(self.path, 'wb') as f:
+            f.write('chemical,unit,conversion_rate,new_param,new_unit\n'
+                    'Calcium,ug/l,0.001,,mg/l\n'
+                    'calcium,ug/l,5,,mg/l\n'
+                    'sulfate as s,mg/l,0.333792756,Sulfate,mg/l\n'
+                    'specific conductance,umho/cm,,,uS/cm\n')
+
+        self.patient = NormalizationRules(self.path, paramgroup={'Sulfate': 'Inorganics, Major, Non-metals'})
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_first_rule_wins_and_blank_param_is_lower_case(self):
+        self.assertEqual(self.patient.get('CALCIUM', 'ug/l'), (0.001, 'calcium', 'mg/l', None))
+
+    def test_new_param_has_paramgroup(self):
+        self.assertEqual(self.patient.get('Sulfate as S', 'mg/l'), (0.333792756, 'Sulfate', 'mg/l', 'Inorganics, Major, Non-metals'))
+
+    def test_blank_rate_is_none(self):
+        self.assertEqual(self.patient.get('Specific conductance', 'umho/cm'), (None, 'specific conductance', 'uS/cm', None))
+
+    def test_units_match_exactly(self):
+        self.assertIsNone(self.patient.get('calcium', 'ug/L'))
+        self.assertIsNone(self.patient.get('calcium', None))
+        self.assertIn(('calcium', 'ug/L'), self.patient.memo)
+
 
 class TestNormalizer_NormalizeSample(unittest.TestCase):
     def setUp(self):
@@ -182,6 +251,19 @@ class TestNormalizer_NormalizeSample(unittest.TestCase):
         })
         self.assertEqual(row['StationId'], 'ABC-abc')
 
+    def test_normalizes_batches_like_rows(self):
+        rows = [{'StationId': 'ABC_WQX-abc', 'Param': 'Calcium', 'Unit': 'ug/l', 'ResultValue': 2000.0, 'ParamGroup': None},
+                {'StationId': 'ABC-abc', 'Param': None, 'Unit': 'unit', 'ResultValue': 0, 'ParamGroup': None},
+                {'StationId': 'ABC-abc', 'Param': 'Unknown', 'Unit': 'mg/l', 'ResultValue': 1, 'ParamGroup': None}]
+
+        batch = Batch(['StationId', 'Param', 'Unit', 'ResultValue', 'ParamGroup'])
+        batch.append_dicts([dict(row) for row in rows])
+
+        actual = [dict(zip(batch.fields, row)) for row in self.patient.normalize_batch(batch).rows()]
+
+        self.assertEqual(actual, [self.patient.normalize_sample(row) for row in rows])
+        self.assertEqual(actual[0]['ResultValue'], 2.0)
+
 
 class TestNormalizer_NormlizeStation(unittest.TestCase):
     def setUp(self):
@@ -302,3 +384,152 @@ class TestChargeBalancer(unittest.TestCase):
 
         self.assertEqual(len(rows[0]), 42)
         self.assertIsNone(rows[0]['AnalysisDate'])
+
+    def test_balances_each_sample_set_of_a_batch(self):
+        major = [('Bicarbonate', 188), ('Calcium', 66), ('Chloride', 57), ('Magnesium', 27), ('Nitrate', 0.8),
+                 ('Potassium', 7.4), ('Sodium', 109), ('Sulfate', 273)]
+
+        def sample_set(sample_id, chemicals):
+            return [{'SampleId': sample_id, 'Param': param, 'ResultValue': value, 'DetectCond': None}
+                    for param, value in chemicals]
+
+        batch = Batch(['SampleId', 'Param', 'ResultValue', 'DetectCond'])
+        batch.append_dicts(sample_set('a', major))
+        batch.append_dicts(sample_set('b', major[:2]))
+        batch.append_dicts(sample_set('c', major))
+
+        actual = self.patient.get_charge_balance_batch(batch)
+
+        self.assertEqual(actual.columns['SampleId'], ['a'] * 3 + ['c'] * 3)
+        self.assertEqual(actual.columns['ResultValue'], [0.27, 10.45, 10.39] * 2)
+        self.assertEqual(actual.columns['DetectCond'], [None] * 6)
+
+    def test_batch_balances_match_concentrations(self):
+        sample_sets = [
+            [('Calcium', 66), ('calcium', 67.5), ('Magnesium', 27), ('Chloride', 57), ('Bicarbonate', 188),
+             ('Sulfate', 273), ('Sodium plus potassium', 25), ('Potassium', 7.4)],
+            [('ca', 46), ('mg', 10), ('cl', 12), ('hco3', 139), ('so4', 76), ('Sodium plus potassium', 25), ('Sodium', 20)],
+            [('Calcium', 0), ('Magnesium', 0), ('Chloride', 0), ('Bicarbonate', 0), ('Sulfate', 0), ('Sodium', 0)],
+            [('Calcium', 66), ('Magnesium', 27), ('Chloride', 57), ('Bicarbonate', 188), ('Sulfate', None), ('Sodium', 1)],
+            [('Calcium', 66), ('Magnesium', 27), ('Chloride', 57), ('Bicarbonate', 188), ('Sulphate', 273), ('Sodium', 1),
+             ('Nitrate', 0.8), ('Nitrite', 0.1), ('Carbonate', 3), ('pH', 7)]
+        ]
+
+        batch = Batch(['SampleId', 'Param', 'ResultValue', 'DetectCond', 'Unit'])
+        expected = []
+
+        for i, chemicals in enumerate(sample_sets):
+            rows = [{'SampleId': i, 'Param': param, 'ResultValue': value, 'DetectCond': None, 'Unit': None}
+                    for param, value in chemicals]
+            rows.append({'SampleId': i, 'Param': 'Calcium', 'ResultValue': 1000, 'DetectCond': 'Not Detected', 'Unit': None})
+
+            batch.append_dicts(rows)
+            expected.extend(self.patient.get_charge_balance(rows))
+
+        actual = self.patient.get_charge_balance_batch(batch)
+
+        self.assertEqual(len(actual), 12)
+        self.assertEqual(actual.rows(), [tuple(row[field] for field in batch.fields) for row in expected])
+
+    def test_database_balances_match_concentrations(self):
+        backend = backends.create({'backend': 'sqlite', 'path': ':memory:'})
+        connection = backend.connect()
+        backend.create_tables(connection)
+
+        sample_sets = [
+            [('Calcium', 66), ('calcium', 67.5), ('Magnesium', 27), ('Chloride', 57), ('Bicarbonate', 188),
+             ('Sulfate', 273), ('Sodium plus potassium', 25), ('Potassium', 7.4)],
+            [('ca', 46), ('mg', 10), ('cl', 12), ('hco3', 139), ('so4', 76), ('Sodium plus potassium', 25), ('Sodium', 20)],
+            [('Calcium', 0), ('Magnesium', 0), ('Chloride', 0), ('Bicarbonate', 0), ('Sulfate', 0), ('Sodium', 0)],
+            [('Calcium', 66), ('Magnesium', 27), ('Chloride', 57), ('Bicarbonate', 188), ('Sulfate', None), ('Sodium', 1)]
+        ]
+
+        expected = []
+        for i, chemicals in enumerate(sample_sets):
+            rows = [{'SampleId': str(i), 'Param': param, 'ResultValue': value, 'DetectCond': None}
+                    for param, value in chemicals]
+            rows.append({'SampleId': str(i), 'Param': 'Calcium', 'ResultValue': 1000, 'DetectCond': 'Not Detected'})
+
+            connection.executemany('INSERT INTO Results (SampleId, Param, ResultValue, DetectCond) VALUES (?, ?, ?, ?)',
+                                   [(row['SampleId'], row['Param'], row['ResultValue'], row['DetectCond']) for row in rows])
+            expected.extend((row['SampleId'], row['Param'], row['ResultValue'], row['Unit'])
+                            for row in self.patient.get_charge_balance(rows))
+
+        #: a stale balance is replaced
+        connection.execute("INSERT INTO Results (SampleId, Param, ResultValue, Unit) VALUES ('0', 'Charge Balance', 99, '%')")
+
+        self.patient.update_in_database(connection)
+
+        actual = connection.execute("SELECT SampleId, Param, ResultValue, Unit FROM Results WHERE Unit IS NOT NULL").fetchall()
+
+        self.assertEqual(len(actual), 9)
+        self.assertItemsEqual(actual, expected)
+
+    def test_database_balances_only_given_samples(self):
+        backend = backends.create({'backend': 'sqlite', 'path': ':memory:'})
+        connection = backend.connect()
+        backend.create_tables(connection)
+
+        chemicals = [('Calcium', 66), ('Magnesium', 27), ('Sodium', 25), ('Chloride', 57), ('Bicarbonate', 188),
+                     ('Sulfate', 273)]
+        rows = [{'SampleId': '1', 'Param': param, 'ResultValue': value, 'DetectCond': None} for param, value in chemicals]
+        expected = [(row['SampleId'], row['Param'], row['ResultValue']) for row in self.patient.get_charge_balance(rows)]
+
+        for sample_id in ['1', '2']:
+            connection.executemany('INSERT INTO Results (SampleId, Param, ResultValue) VALUES (?, ?, ?)',
+                                   [(sample_id, param, value) for param, value in chemicals])
+            connection.execute("INSERT INTO Results (SampleId, Param, ResultValue, Unit) VALUES (?, 'Charge Balance', 99, '%')",
+                               (sample_id,))
+
+        self.patient.update_in_database(connection, sample_ids=['1'])
+
+        actual = connection.execute("SELECT SampleId, Param, ResultValue FROM Results WHERE Unit IS NOT NULL").fetchall()
+
+        self.assertItemsEqual(actual, expected + [('2', 'Charge Balance', 99)])
+
+
+class TestHttpClient(unittest.TestCase):
+    csv = 'Id,Comment\r\n1,"two\r\nlines"\r\n2,caf\xc3\xa9\r\n'
+
+    def get_response(self, content, headers=None, encoding='utf-8'):
+        response = Mock(headers=headers or {}, encoding=encoding)
+        response.iter_content.side_effect = lambda size: (content[i:i + size] for i in xrange(0, len(content), size))
+
+        return response
+
+    def get_rows(self, response):
+        with patch('dbseeder.services.get', return_value=response) as get:
+            rows = list(HttpClient.get_csv('url', chunk_size=3))
+
+        get.assert_called_once_with('url', stream=True)
+        self.assertTrue(response.close.called)
+
+        return rows
+
+    def test_reads_rows_split_across_chunks(self):
+        rows = self.get_rows(self.get_response(self.csv))
+
+        self.assertEqual(rows, [['Id', 'Comment'], ['1', 'two\r\nlines'], ['2', 'caf\xc3\xa9']])
+
+    def test_reads_zipped_csv(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zipped:
+            zipped.writestr('result.csv', self.csv)
+
+        rows = self.get_rows(self.get_response(archive.getvalue(), {'content-type': 'application/zip'}))
+
+        self.assertEqual(rows, [['Id', 'Comment'], ['1', 'two\r\nlines'], ['2', 'caf\xc3\xa9']])
+
+    def test_decodes_other_encodings_to_utf8(self):
+        rows = self.get_rows(self.get_response('Id,Comment\n2,caf\xe9', encoding='ISO-8859-1'))
+
+        self.assertEqual(rows, [['Id', 'Comment'], ['2', 'caf\xc3\xa9']])
+
+    def test_exposes_counts(self):
+        response = self.get_response(self.csv, {'total-site-count': '2', 'total-result-count': 'many'})
+
+        with patch('dbseeder.services.get', return_value=response):
+            csv_response = HttpClient.get_csv('url')
+
+        self.assertEqual(csv_response.site_count, 2)
+        self.assertIsNone(csv_response.result_count)
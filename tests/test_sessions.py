@@ -0,0 +1,102 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+sessions
+----------------------------------
+test the sessions module
+'''
+
+import sqlite3
+import threading
+import unittest
+from dbseeder.backends import SqliteBackend
+from dbseeder.sessions import ConnectionPool
+from mock import Mock
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = SqliteBackend(':memory:')
+        self.patient = ConnectionPool(self.backend, retry_delay=0)
+
+    def tearDown(self):
+        self.patient.close()
+
+    def test_connections_are_reused(self):
+        first = self.patient.session().connection
+        self.patient.end_session()
+
+        second = self.patient.session().connection
+
+        self.assertIs(first, second)
+        self.assertEqual(self.patient.connections_opened, 1)
+
+    def test_unhealthy_connections_are_replaced(self):
+        first = self.patient.session().connection
+        self.patient.end_session()
+        first.close()
+
+        second = self.patient.session().connection
+
+        self.assertIsNot(first, second)
+        self.assertEqual(self.patient.connections_opened, 2)
+
+    def test_one_session_per_thread(self):
+        sessions = []
+
+        def get_session():
+            sessions.append(self.patient.session())
+
+        thread = threading.Thread(target=get_session)
+        thread.start()
+        thread.join()
+
+        self.assertIs(self.patient.session(), self.patient.session())
+        self.assertIsNot(self.patient.session(), sessions[0])
+
+    def test_execute_reconnects_after_transient_errors(self):
+        session = self.patient.session()
+        cursor = Mock()
+        cursor.execute.side_effect = sqlite3.OperationalError('database is locked')
+        session._cursor = cursor
+        session._connection = Mock()
+
+        self.assertEqual(session.execute('SELECT 1').fetchall(), [(1,)])
+        self.assertEqual(cursor.execute.call_count, 1)
+
+    def test_only_locked_databases_are_retried(self):
+        function = Mock(side_effect=sqlite3.OperationalError('no such table: Things'))
+
+        self.assertRaises(sqlite3.OperationalError, self.patient.retry, function)
+        self.assertEqual(function.call_count, 1)
+
+    def test_retried_statements_leave_held_connections_open(self):
+        session = self.patient.session()
+        held = session.hold()
+        cursor = Mock()
+        cursor.execute.side_effect = sqlite3.OperationalError('database is locked')
+        session._cursor = cursor
+
+        session.execute('SELECT 1')
+
+        self.assertIsNot(session.connection, held)
+        self.assertEqual(held.execute('SELECT 2').fetchall(), [(2,)])
+
+        session.close()
+
+        self.assertRaises(sqlite3.ProgrammingError, held.execute, 'SELECT 1')
+
+    def test_retry_gives_up(self):
+        function = Mock(side_effect=sqlite3.OperationalError('database is locked'))
+
+        self.assertRaises(sqlite3.OperationalError, self.patient.retry, function)
+        self.assertEqual(function.call_count, 4)
+
+    def test_close_closes_connections(self):
+        connection = self.patient.session().connection
+
+        self.patient.close()
+
+        self.assertRaises(sqlite3.ProgrammingError, connection.execute, 'SELECT 1')
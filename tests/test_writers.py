@@ -0,0 +1,136 @@
+#!usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+writers
+----------------------------------
+test the writers module
+'''
+
+import sqlite3
+import unittest
+from dbseeder.models import Batch
+from dbseeder.writers import ExecuteManyWriter, MultiRowValuesWriter, get_columns
+from mock import Mock, MagicMock
+
+
+class TestGetColumns(unittest.TestCase):
+    def test_returns_columns_from_template(self):
+        self.assertEqual(get_columns('insert into Stations (OrgId, OrgName,' + ' Shape) values ({})'),
+                         ['OrgId', 'OrgName', 'Shape'])
+
+
+class TestExecuteManyWriter(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute('create table Things (Name text, Amount real, Shape text)')
+        self.template = 'insert into Things (Name, Amount, Shape) values ({})'
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_formats_placeholders(self):
+        patient = ExecuteManyWriter(self.connection, self.template, parameters={'Shape': 'upper(?)'})
+
+        self.assertEqual(patient.statement, 'insert into Things (Name, Amount, Shape) values (?,?,upper(?))')
+
+    def test_commits_after_batch_size(self):
+        connection = Mock()
+        patient = ExecuteManyWriter(connection, self.template, batch_size=2)
+
+        patient.write([('a', 1.0, None), ('b', None, None), ('c', 3.0, None)])
+
+        self.assertEqual(connection.commit.call_count, 1)
+        self.assertEqual(patient.rows_written, 2)
+        self.assertEqual(len(patient.pending), 1)
+
+        patient.flush()
+
+        self.assertEqual(connection.commit.call_count, 2)
+        self.assertEqual(patient.rows_written, 3)
+
+    def test_commits_after_byte_budget(self):
+        connection = Mock()
+        patient = ExecuteManyWriter(connection, self.template, byte_budget=10)
+
+        patient.write([('a' * 10, 1.0, None)])
+
+        self.assertEqual(connection.commit.call_count, 1)
+
+    def test_waits_for_flush_without_auto_flush(self):
+        connection = Mock()
+        patient = ExecuteManyWriter(connection, self.template, batch_size=2, auto_flush=False)
+
+        patient.write([('a', 1.0, None), ('b', None, None), ('c', 3.0, None)])
+
+        self.assertTrue(patient.full)
+        self.assertFalse(connection.commit.called)
+
+        patient.flush()
+
+        self.assertFalse(patient.full)
+        self.assertEqual(patient.rows_written, 3)
+
+    def test_holds_lock_while_sending(self):
+        lock = MagicMock()
+        patient = ExecuteManyWriter(Mock(), self.template, lock=lock)
+
+        patient.write([('a', 1.0, None)])
+        self.assertFalse(lock.__enter__.called)
+
+        patient.flush()
+        self.assertEqual(lock.__enter__.call_count, 1)
+        self.assertEqual(lock.__exit__.call_count, 1)
+
+    def test_inserts_typed_parameters(self):
+        with ExecuteManyWriter(self.connection, self.template, parameters={'Shape': 'upper(?)'}) as patient:
+            patient.write([["it's", 1.5, 'point (1 2)'], ['b', None, None]])
+
+        rows = self.connection.execute('select * from Things').fetchall()
+
+        self.assertEqual(rows, [(u"it's", 1.5, u'POINT (1 2)'), (u'b', None, None)])
+
+    def test_writes_batch_columns_in_template_order(self):
+        batch = Batch(['Shape', 'Amount', 'Name', 'Other'])
+        batch.append_dicts([{'Name': 'a', 'Amount': 1.5, 'Shape': None, 'Other': 'x'}])
+
+        with ExecuteManyWriter(self.connection, self.template) as patient:
+            patient.write_batch(batch)
+
+        self.assertEqual(self.connection.execute('select * from Things').fetchall(), [(u'a', 1.5, None)])
+
+
+class TestMultiRowValuesWriter(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute('create table Things (Name text, Amount real, Shape text)')
+        self.template = 'insert into Things (Name, Amount, Shape) values ({})'
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_rows_per_statement_respects_parameter_limit(self):
+        template = 'insert into Results ({}) values ({{}})'.format(', '.join('c{}'.format(i) for i in range(42)))
+
+        patient = MultiRowValuesWriter(Mock(), template)
+
+        self.assertEqual(patient.rows_per_statement, 49)
+
+    def test_rows_per_statement_respects_row_limit(self):
+        patient = MultiRowValuesWriter(Mock(), 'insert into Things (Name) values ({})')
+
+        self.assertEqual(patient.rows_per_statement, 1000)
+
+    def test_inserts_rows_in_packed_statements(self):
+        with MultiRowValuesWriter(self.connection, self.template, parameters={'Shape': 'upper(?)'}) as patient:
+            patient.rows_per_statement = 2
+            patient.values_statement = patient._get_values_statement(2)
+
+            self.assertEqual(patient.values_statement,
+                             'insert into Things (Name, Amount, Shape) values (?,?,upper(?)),(?,?,upper(?))')
+
+            patient.write([['a', 1.0, 'point (1 2)'], ['b', None, None], ['c', 3.0, None]])
+
+        rows = self.connection.execute('select * from Things').fetchall()
+
+        self.assertEqual(rows, [(u'a', 1.0, u'POINT (1 2)'), (u'b', None, None), (u'c', 3.0, None)])